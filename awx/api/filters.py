@@ -133,7 +133,21 @@ class FieldLookupBackend(BaseFilterBackend):
     Filter using field lookups provided via query string parameters.
     """
 
-    RESERVED_NAMES = ('page', 'page_size', 'format', 'order', 'order_by', 'search', 'type', 'host_filter', 'count_disabled', 'no_truncate', 'limit')
+    RESERVED_NAMES = (
+        'page',
+        'page_size',
+        'format',
+        'order',
+        'order_by',
+        'search',
+        'type',
+        'host_filter',
+        'count_disabled',
+        'count_estimate',
+        'no_truncate',
+        'limit',
+        'cursor',
+    )
 
     SUPPORTED_LOOKUPS = (
         'exact',
@@ -448,3 +462,142 @@ class OrderByBackend(BaseFilterBackend):
             except (FieldError, FieldDoesNotExist) as e:
                 raise ParseError(e.args[0])
             yield new_path
+
+
+class ArchivedEventFilter(object):
+    """
+    Applies the field lookups, search and ordering that the filter backends
+    above apply to querysets to the list of events of a job that was
+    compacted by compact_job_events (see UnifiedJobEventArchive).
+
+    Only lookups on the non-JSON columns of the event table itself are
+    supported, with the lookup types in LOOKUPS; related field lookups and
+    lookups on JSON columns (such as event_data) raise a ParseError.  Only
+    the exact, gt, gte, lt and lte lookups on counter, not negated or or'ed,
+    are answered from the chunk index of the archive.  Any other lookup,
+    search, or ordering other than by counter decompresses every chunk of
+    the archive and filters and sorts its events in memory.
+    """
+
+    LOOKUPS = {
+        'exact': lambda a, v: a == v,
+        'iexact': lambda a, v: a is not None and str(a).lower() == str(v).lower(),
+        'contains': lambda a, v: a is not None and str(v) in str(a),
+        'icontains': lambda a, v: a is not None and str(v).lower() in str(a).lower(),
+        'startswith': lambda a, v: a is not None and str(a).startswith(str(v)),
+        'istartswith': lambda a, v: a is not None and str(a).lower().startswith(str(v).lower()),
+        'endswith': lambda a, v: a is not None and str(a).endswith(str(v)),
+        'iendswith': lambda a, v: a is not None and str(a).lower().endswith(str(v).lower()),
+        'gt': lambda a, v: a is not None and a > v,
+        'gte': lambda a, v: a is not None and a >= v,
+        'lt': lambda a, v: a is not None and a < v,
+        'lte': lambda a, v: a is not None and a <= v,
+        'in': lambda a, v: a in v,
+        'isnull': lambda a, v: (a is None) == v,
+    }
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = {}
+        for field in model._meta.concrete_fields:
+            self.fields[field.name] = field
+            self.fields[field.attname] = field
+
+    def get_field(self, path):
+        if path not in self.fields or isinstance(self.fields[path], JSONField):
+            raise ParseError(_('Filtering archived events on {} is not supported.').format(path))
+        return self.fields[path]
+
+    # lookups on the counter that can be answered from the chunk index of the archive
+    COUNTER_RANGE_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte')
+
+    def parse_lookup(self, key, value):
+        path, lookup = key, 'exact'
+        if '__' in key and key.rsplit('__', 1)[-1] in self.LOOKUPS:
+            path, lookup = key.rsplit('__', 1)
+        field = self.get_field(path)
+        backend = FieldLookupBackend()
+        if lookup == 'isnull':
+            value = to_python_boolean(value)
+        elif lookup == 'in':
+            if not value:
+                raise ValueError('cannot provide empty value for __in')
+            value = [backend.value_to_python_for_field(field, item) for item in value.split(',')]
+        elif lookup in ('exact', 'gt', 'gte', 'lt', 'lte'):
+            value = backend.value_to_python_for_field(field, value)
+        return field, lookup, value
+
+    def get_predicate(self, field, lookup, value):
+        compare = self.LOOKUPS[lookup]
+        return lambda event: compare(getattr(event, field.attname), value)
+
+    def filter_events(self, request, events, view):
+        """
+        Return the matching events.  Lookups on the counter narrow the lazy
+        sequence of archived events, any other filter reads all of them.
+        """
+        and_filters = []
+        or_filters = []
+        for key, values in request.query_params.lists():
+            if key in FieldLookupBackend.RESERVED_NAMES:
+                continue
+            q_or = False
+            if key.startswith('chain__'):
+                key = key[7:]
+            elif key.startswith('or__'):
+                key = key[4:]
+                q_or = True
+            q_not = False
+            if key.startswith('not__'):
+                key = key[5:]
+                q_not = True
+            for value in values:
+                field, lookup, value = self.parse_lookup(key, force_str(value))
+                if field.attname == 'counter' and lookup in self.COUNTER_RANGE_LOOKUPS and not (q_or or q_not) and hasattr(events, 'filter_counter'):
+                    events = events.filter_counter(lookup, value)
+                    continue
+                predicate = self.get_predicate(field, lookup, value)
+                if q_not:
+                    predicate = (lambda p: lambda event: not p(event))(predicate)
+                (or_filters if q_or else and_filters).append(predicate)
+
+        search_terms = []
+        for value in request.query_params.getlist('search'):
+            search_terms.extend(term for term in re.split(r'[\s,]+', value) if term)
+        search_fields = [self.get_field(name) for name in getattr(view, 'search_fields', ())]
+
+        if not (and_filters or or_filters or search_terms):
+            return events
+
+        def matches(event):
+            if not all(predicate(event) for predicate in and_filters):
+                return False
+            if or_filters and not any(predicate(event) for predicate in or_filters):
+                return False
+            for term in search_terms:
+                if not any(self.LOOKUPS['icontains'](getattr(event, f.attname), term) for f in search_fields):
+                    return False
+            return True
+
+        return [event for event in events if matches(event)]
+
+    def order_events(self, request, events, view):
+        order_by = []
+        for key in ('order', 'order_by'):
+            if key in request.query_params:
+                order_by = request.query_params[key].split(',')
+        if order_by in ([], ['counter']):
+            # archived events are already ordered by counter
+            return events
+        # sort by each key in turn, starting with the least significant one
+        for name in reversed(order_by):
+            descending = name.startswith('-')
+            field = self.get_field(name.lstrip('-'))
+            events = sorted(events, key=lambda e: (getattr(e, field.attname) is not None, getattr(e, field.attname)), reverse=descending)
+        return events
+
+    def filter(self, request, events, view):
+        try:
+            return self.order_events(request, self.filter_events(request, events, view), view)
+        except (ValidationError, ValueError, TypeError) as e:
+            raise ParseError(e.args[0] if e.args else str(e))
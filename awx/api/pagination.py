@@ -5,13 +5,18 @@ from collections import OrderedDict
 
 # Django REST Framework
 from django.conf import settings
-from django.core.paginator import Paginator as DjangoPaginator
+from django.core.paginator import EmptyPage, Paginator as DjangoPaginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework import pagination
 from rest_framework.response import Response
 from rest_framework.utils.urls import replace_query_param
 from rest_framework.settings import api_settings
 from django.utils.translation import gettext_lazy as _
 
+# AWX
+from awx.main.utils.db import estimate_count
+
 
 class DisabledPaginator(DjangoPaginator):
     @property
@@ -23,6 +28,29 @@ class DisabledPaginator(DjangoPaginator):
         return 200
 
 
+class EstimatedCountPaginator(DjangoPaginator):
+    """
+    Takes the count of large querysets from the query planner's estimate
+    rather than running COUNT(*).  As the estimate may be short, pages past
+    the estimated end are not rejected (they are merely empty).
+    """
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def validate_number(self, number):
+        try:
+            return super(EstimatedCountPaginator, self).validate_number(number)
+        except EmptyPage:
+            # a page past the estimated end
+            return int(number)
+
+
 class Pagination(pagination.PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = settings.MAX_PAGE_SIZE
@@ -60,6 +88,8 @@ class Pagination(pagination.PageNumberPagination):
         try:
             if self.count_disabled:
                 self.django_paginator_class = DisabledPaginator
+            elif 'count_estimate' in request.query_params:
+                self.django_paginator_class = EstimatedCountPaginator
             return super(Pagination, self).paginate_queryset(queryset, request, **kwargs)
         finally:
             self.django_paginator_class = DjangoPaginator
@@ -102,31 +132,66 @@ class LimitPagination(pagination.BasePagination):
         return self.default_limit
 
 
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Pages through a queryset by filtering on the (indexed) ordering column of
+    the last row of the previous page, rather than with an OFFSET, so that
+    deep pages cost the same as the first one.  The next and previous links
+    carry an opaque `cursor`.  Views choose the column with their
+    `cursor_ordering` attribute, which must be unique (enough) within the list.
+    """
+
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+    ordering = ('pk',)
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super(KeysetPagination, self).paginate_queryset(queryset, request, view=view)
+        # links relative to the server, like the ones of Pagination
+        self.base_url = request.get_full_path()
+        return page
+
+
 class UnifiedJobEventPagination(Pagination):
     """
     By default, use Pagination for all operations.
     If `limit` query parameter specified use LimitPagination
+    If `cursor` query parameter specified (even empty) use KeysetPagination
     """
 
     def __init__(self, *args, **kwargs):
         self.use_limit_paginator = False
         self.limit_pagination = LimitPagination()
+        self.use_keyset_paginator = False
+        self.keyset_pagination = KeysetPagination()
         return super().__init__(*args, **kwargs)
 
     def paginate_queryset(self, queryset, request, view=None):
         if 'limit' in request.query_params:
             self.use_limit_paginator = True
+        elif 'cursor' in request.query_params and isinstance(queryset, QuerySet):
+            # archived events (see ArchivedEventsMixin) are a list, and are paged by number
+            self.use_keyset_paginator = True
 
         if self.use_limit_paginator:
             return self.limit_pagination.paginate_queryset(queryset, request, view=view)
+        if self.use_keyset_paginator:
+            return self.keyset_pagination.paginate_queryset(queryset, request, view=view)
         return super().paginate_queryset(queryset, request, view=view)
 
     def get_paginated_response(self, data):
         if self.use_limit_paginator:
             return self.limit_pagination.get_paginated_response(data)
+        if self.use_keyset_paginator:
+            return self.keyset_pagination.get_paginated_response(data)
         return super().get_paginated_response(data)
 
     def get_paginated_response_schema(self, schema):
         if self.use_limit_paginator:
             return self.limit_pagination.get_paginated_response_schema(schema)
+        if self.use_keyset_paginator:
+            return self.keyset_pagination.get_paginated_response_schema(schema)
         return super().get_paginated_response_schema(schema)
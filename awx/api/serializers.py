@@ -689,7 +689,14 @@ class UnifiedJobTemplateSerializer(BaseSerializer):
 
     class Meta:
         model = UnifiedJobTemplate
-        fields = ('*', 'last_job_run', 'last_job_failed', 'next_job_run', 'status', 'execution_environment')
+        fields = ('*', 'last_job_run', 'last_job_failed', 'next_job_run', 'status', 'execution_environment', 'priority')
+
+    def validate_priority(self, value):
+        request = self.context.get('request')
+        if request and not request.user.is_superuser and value != getattr(self.instance, 'priority', 0):
+            # Only allow superusers to edit the priority, which orders the jobs of all organizations
+            raise serializers.ValidationError(_('Only system administrators can change the priority.'))
+        return value
 
     def get_related(self, obj):
         res = super(UnifiedJobTemplateSerializer, self).get_related(obj)
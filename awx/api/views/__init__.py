@@ -29,7 +29,7 @@ from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 from django.template.loader import render_to_string
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _
 
@@ -58,7 +58,6 @@ from social_core.backends.utils import load_backends
 from oauth2_provider.models import get_access_token_model
 
 import pytz
-from wsgiref.util import FileWrapper
 
 # AWX
 from awx.main.tasks.system import send_notifications, update_inventory_computed_fields
@@ -95,6 +94,7 @@ from awx.main.utils import (
     get_pk_from_dict,
     ScheduleWorkflowManager,
     ignore_inventory_computed_fields,
+    split_stdout_lines,
 )
 from awx.main.utils.encryption import encrypt_value
 from awx.main.utils.filters import SmartFilter
@@ -115,6 +115,7 @@ from awx.api.metadata import RoleMetadata
 from awx.main.constants import ACTIVE_STATES, SURVEY_TYPE_MAPPING
 from awx.main.scheduler.dag_workflow import WorkflowDAG
 from awx.api.views.mixin import (
+    ArchivedEventsMixin,
     InstanceGroupMembershipMixin,
     OrganizationCountsMixin,
     RelatedJobsPreventDeleteMixin,
@@ -925,7 +926,7 @@ class ProjectUpdateDetail(UnifiedJobDeletionMixin, RetrieveDestroyAPIView):
     serializer_class = serializers.ProjectUpdateDetailSerializer
 
 
-class ProjectUpdateEventsList(SubListAPIView):
+class ProjectUpdateEventsList(ArchivedEventsMixin, SubListAPIView):
     model = models.ProjectUpdateEvent
     serializer_class = serializers.ProjectUpdateEventSerializer
     parent_model = models.ProjectUpdate
@@ -941,10 +942,10 @@ class ProjectUpdateEventsList(SubListAPIView):
     def get_queryset(self):
         pu = self.get_parent_object()
         self.check_parent_access(pu)
-        return pu.get_event_queryset()
+        return self.get_job_events(pu)
 
 
-class SystemJobEventsList(SubListAPIView):
+class SystemJobEventsList(ArchivedEventsMixin, SubListAPIView):
     model = models.SystemJobEvent
     serializer_class = serializers.SystemJobEventSerializer
     parent_model = models.SystemJob
@@ -960,7 +961,7 @@ class SystemJobEventsList(SubListAPIView):
     def get_queryset(self):
         job = self.get_parent_object()
         self.check_parent_access(job)
-        return job.get_event_queryset()
+        return self.get_job_events(job)
 
 
 class ProjectUpdateCancel(GenericCancelView):
@@ -3512,6 +3513,7 @@ class BaseJobHostSummariesList(SubListAPIView):
     name = _('Job Host Summaries List')
     search_fields = ('host_name',)
     filter_read_permission = False
+    pagination_class = UnifiedJobEventPagination
 
 
 class HostJobHostSummariesList(BaseJobHostSummariesList):
@@ -3557,6 +3559,8 @@ class JobEventChildrenList(NoTruncateMixin, SubListAPIView):
     relationship = 'children'
     name = _('Job Event Children List')
     search_fields = ('stdout',)
+    pagination_class = UnifiedJobEventPagination
+    cursor_ordering = ('counter',)
 
     @property
     def is_partitioned(self):
@@ -3587,6 +3591,7 @@ class BaseJobEventsList(NoTruncateMixin, SubListAPIView):
     relationship = 'job_events'
     name = _('Job Events List')
     search_fields = ('stdout',)
+    pagination_class = UnifiedJobEventPagination
 
     def finalize_response(self, request, response, *args, **kwargs):
         response['X-UI-Max-Events'] = settings.MAX_UI_JOB_EVENTS
@@ -3607,13 +3612,15 @@ class GroupJobEventsList(BaseJobEventsList):
     parent_model = models.Group
 
 
-class JobJobEventsList(BaseJobEventsList):
+class JobJobEventsList(ArchivedEventsMixin, BaseJobEventsList):
     parent_model = models.Job
-    pagination_class = UnifiedJobEventPagination
 
     def get_queryset(self):
         job = self.get_parent_object()
         self.check_parent_access(job)
+        if job.get_event_archive() is not None:
+            # archived events are ordered by counter, which follows their start_line
+            return self.get_job_events(job)
         return job.get_event_queryset().prefetch_related('job__job_template', 'host').order_by('start_line')
 
 
@@ -3629,7 +3636,10 @@ class JobJobEventsChildrenSummary(APIView):
         else:
             resp["event_processing_finished"] = True
 
-        events = list(job.get_event_queryset().values('counter', 'uuid', 'parent_uuid', 'event').order_by('counter'))
+        if job.get_event_archive() is not None:
+            events = [{k: row[k] for k in ('counter', 'uuid', 'parent_uuid', 'event')} for row in job.get_event_archive().iter_rows()]
+        else:
+            events = list(job.get_event_queryset().values('counter', 'uuid', 'parent_uuid', 'event').order_by('counter'))
         if len(events) == 0:
             return Response(resp)
 
@@ -3865,7 +3875,7 @@ class AdHocCommandEventDetail(RetrieveAPIView):
         return context
 
 
-class BaseAdHocCommandEventsList(NoTruncateMixin, SubListAPIView):
+class BaseAdHocCommandEventsList(ArchivedEventsMixin, NoTruncateMixin, SubListAPIView):
     model = models.AdHocCommandEvent
     serializer_class = serializers.AdHocCommandEventSerializer
     parent_model = None  # Subclasses must define this attribute.
@@ -3877,11 +3887,12 @@ class BaseAdHocCommandEventsList(NoTruncateMixin, SubListAPIView):
     def get_queryset(self):
         parent = self.get_parent_object()
         self.check_parent_access(parent)
-        return parent.get_event_queryset()
+        return self.get_job_events(parent)
 
 
 class HostAdHocCommandEventsList(BaseAdHocCommandEventsList):
     parent_model = models.Host
+    cursor_ordering = ('pk',)
 
     def get_queryset(self):
         return super(BaseAdHocCommandEventsList, self).get_queryset()
@@ -3959,27 +3970,17 @@ def redact_ansi(line):
 
 
 class StdoutFilter(object):
-    def __init__(self, fileobj):
+    """Apply the registered functions to each line of an iterable of stdout chunks"""
+
+    def __init__(self, chunks):
         self._functions = []
-        self.fileobj = fileobj
-        self.extra_data = ''
-        if hasattr(fileobj, 'close'):
-            self.close = fileobj.close
-
-    def read(self, size=-1):
-        data = self.extra_data
-        while size > 0 and len(data) < size:
-            line = self.fileobj.readline(size)
-            if not line:
-                break
-            line = self.process_line(line)
-            data += line
-        if size > 0 and len(data) > size:
-            self.extra_data = data[size:]
-            data = data[:size]
-        else:
-            self.extra_data = ''
-        return data
+        self.chunks = chunks
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self._functions:
+                chunk = ''.join(self.process_line(line) for line in split_stdout_lines(chunk))
+            yield chunk
 
     def register(self, func):
         self._functions.append(func)
@@ -4004,6 +4005,20 @@ class UnifiedJobStdout(RetrieveAPIView):
     ]
     filter_backends = ()
 
+    def get_download_start_line(self, request):
+        """
+        Downloads can be resumed from a given line of stdout, either with a
+        `Range: lines=<start>-` header or a `start_line` query parameter.
+        Returns the line to start from, and whether this is a range request.
+        """
+        match = re.match(r'^lines=(\d+)-$', request.headers.get('Range', '').strip())
+        if match:
+            return int(match.group(1)), True
+        try:
+            return max(int(request.query_params.get('start_line', 0)), 0), False
+        except ValueError:
+            raise ParseError(_('start_line must be an integer.'))
+
     def retrieve(self, request, *args, **kwargs):
         unified_job = self.get_object()
         try:
@@ -4042,14 +4057,17 @@ class UnifiedJobStdout(RetrieveAPIView):
                 filename = '{type}_{pk}{suffix}.txt'.format(
                     type=camelcase_to_underscore(unified_job.__class__.__name__), pk=unified_job.id, suffix='.ansi' if target_format == 'ansi_download' else ''
                 )
-                content_fd = unified_job.result_stdout_raw_handle(enforce_max_bytes=False)
-                redactor = StdoutFilter(content_fd)
+                start_line, partial = self.get_download_start_line(request)
+                redactor = StdoutFilter(unified_job.result_stdout_chunks(start_line))
                 if target_format == 'txt_download':
                     redactor.register(redact_ansi)
                 if type(unified_job) == models.ProjectUpdate:
                     redactor.register(UriCleaner.remove_sensitive)
-                response = HttpResponse(FileWrapper(redactor), content_type='text/plain')
+                response = StreamingHttpResponse(redactor, content_type='text/plain', status=status.HTTP_206_PARTIAL_CONTENT if partial else status.HTTP_200_OK)
                 response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+                response["Accept-Ranges"] = 'lines'
+                if partial:
+                    response["Content-Range"] = 'lines {}-*/*'.format(start_line)
                 return response
             else:
                 return super(UnifiedJobStdout, self).retrieve(request, *args, **kwargs)
@@ -3,12 +3,8 @@
 
 # Python
 import logging
-import requests
-import xml.etree.ElementTree as ET
 import json
 import panos
-import xmltodict
-import urllib3
 from datetime import datetime
 from collections import defaultdict
 from pandevice import firewall, panorama
@@ -28,6 +24,7 @@ from rest_framework import serializers
 # AWX
 from awx.main.models import ActivityStream, Inventory, JobTemplate, Role, User, InstanceGroup, InventoryUpdateEvent, InventoryUpdate
 from awx.main.models import UpdateFirewallStatusLogs, UpdateFirewallBackupFile, UpdateFirewallStatus
+from awx.main.utils.panos import PanosAuthError, PanosError, get_client as panos_client
 
 from awx.api.generics import (
     ListCreateAPIView,
@@ -64,7 +61,7 @@ from awx.api.serializers import (
     GetFireWallsDetailsSerializer,
     FirewallBackupTGZFileSerializer
 )
-from awx.api.views.mixin import RelatedJobsPreventDeleteMixin
+from awx.api.views.mixin import ArchivedEventsMixin, RelatedJobsPreventDeleteMixin
 
 from awx.api.pagination import UnifiedJobEventPagination
 
@@ -72,7 +69,7 @@ from awx.api.pagination import UnifiedJobEventPagination
 logger = logging.getLogger('awx.api.views.organization')
 
 
-class InventoryUpdateEventsList(SubListAPIView):
+class InventoryUpdateEventsList(ArchivedEventsMixin, SubListAPIView):
     model = InventoryUpdateEvent
     serializer_class = InventoryUpdateEventSerializer
     parent_model = InventoryUpdate
@@ -84,7 +81,7 @@ class InventoryUpdateEventsList(SubListAPIView):
     def get_queryset(self):
         iu = self.get_parent_object()
         self.check_parent_access(iu)
-        return iu.get_event_queryset()
+        return self.get_job_events(iu)
 
     def finalize_response(self, request, response, *args, **kwargs):
         response['X-UI-Max-Events'] = settings.MAX_UI_JOB_EVENTS
@@ -215,45 +212,20 @@ class GetVersion(APIView):
             username = serializer.validated_data.get('username', None)
             password = serializer.validated_data.get('password', None)
 
-        PAN_HOST = f"https://{host}"
-        # Get API Key
-        url = f"{PAN_HOST}/api?type=keygen&user={username}&password={password}"
-
         try:
-            response = requests.get(url, verify=False, timeout=10)  # Add a timeout for the request
-            response.raise_for_status()  # This will raise an error for HTTP errors
-
-
-            root = ET.fromstring(response.content)
-            api_key_element = root.find("./result/key")
-
-            # Check if there's an error message in the XML response
-            error_message = root.find(".//line")
-            if error_message is not None and "Invalid credentials" in error_message.text:
-                return Response({"message":"Invalid credentials. Please check your username and password."})
-
-            api_key = api_key_element.text
+            # the API key is only generated the first time, see PanosClient.get_api_key
+            response = panos_client().op_as(host, username, password, '<show><system><info></info></system></show>')
+            if response.status_code != 200:
+                return Response({"Error":f"HTTP Error {response.status_code}"})
 
-            # Get software version using the API key
-            url = f"{PAN_HOST}/api?type=op&cmd=<show><system><info></info></system></show>&key={api_key}"
-            response = requests.get(url, verify=False, timeout=10)
-
-            root = ET.fromstring(response.content)
-            sw_version = root.find("./result/system/sw-version").text
+            sw_version = response.xml().find("./result/system/sw-version").text
 
             return Response({"message":f"Palo Alto Software Version: {sw_version}"})
 
-        except requests.HTTPError as e:
-            if e.response.status_code == 403:
-                return Response({"Error": "Invalid credentials. Please check your username and password."})
-            else:
-                return Response({"Error":f"HTTP Error {e}"})
-        except requests.ConnectionError:
-            return Response({"Error: Cannot connect to the server. Please check the IP address."})
-        except requests.Timeout:
-            return Response({"Error: Connection timed out."})
-        except ET.ParseError:
-            return Response({"Error parsing the response. Invalid XML received."})
+        except PanosAuthError:
+            return Response({"Error": "Invalid credentials. Please check your username and password."})
+        except PanosError as e:
+            return Response({"Error": f"Cannot connect to the server. Please check the IP address. {e}"})
         except Exception as e:
             return Response({"Error":f"An unexpected error occurred {e}"})
 
@@ -266,14 +238,12 @@ class GetPanorama(APIView):
             host = serializer.validated_data.get('host', None)
             access_token = serializer.validated_data.get('access_token', None)
 
-            url = f'{host}/restapi/v10.1/Panorama/DeviceGroups'
-
             # Headers
             headers = {
                 'X-PAN-KEY': access_token,
             }
             try:
-                response = requests.get(url, headers=headers, verify=False)
+                response = panos_client().request(host, path='/restapi/v10.1/Panorama/DeviceGroups', headers=headers)
                 data = response.json()
                 # Check if the request was successful
                 return Response({"data": data})
@@ -2809,20 +2779,12 @@ class GetInterFaceDetails(APIView):
             api_key = serializer.validated_data.get('api_key', None)
             
             try:
-                # Suppress the InsecureRequestWarning
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-                # Construct the API URL for your desired operation (retrieve hardware information)
-                url_operation = f'https://{firewall_ip}/api/?type=op&cmd=<show><interface>all</interface></show>&key={api_key}'
-
-                # Send the API request for the desired operation with SSL certificate verification disabled
-                response_operation = requests.get(url_operation, verify=False, timeout=10)
+                # Retrieve the hardware information
+                response_operation = panos_client().op(firewall_ip, api_key, '<show><interface>all</interface></show>')
                 
                 # Check if the operation was successful (HTTP status code 200)
                 if response_operation.status_code == 200:
-                    # Parse the XML response using xmltodict
-                    xml_data = response_operation.text
-                    parsed_data = xmltodict.parse(xml_data)
+                    parsed_data = response_operation.to_dict()
 
                     # Extract the hardware information from the parsed dictionary
                     hw_entries = parsed_data['response']['result']['hw']['entry']
@@ -2951,22 +2913,14 @@ class HighAvailability(APIView):
             api_key = serializer.validated_data.get('api_key', None)
 
             try:
-                # Suppress the InsecureRequestWarning
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-                # Construct the API URL for your desired operation (retrieve hardware information)
-                url_operation = f'https://{firewall_ip}/api/?type=op&cmd=<show><high-availability><all/></high-availability></show>&key={api_key}'
-
-                # Send the API request for the desired operation with SSL certificate verification disabled
-                response_operation = requests.get(url_operation, verify=False, timeout=10)
+                # Retrieve the high availability information
+                response_operation = panos_client().op(firewall_ip, api_key, '<show><high-availability><all/></high-availability></show>')
                 
                 parsed_data = {}
                 
                 # Check if the operation was successful (HTTP status code 200)
                 if response_operation.status_code == 200:
-                    # Parse the XML response using xmltodict
-                    xml_data = response_operation.text
-                    parsed_data = xmltodict.parse(xml_data)
+                    parsed_data = response_operation.to_dict()
                     
                     return Response({"data": parsed_data})
 
@@ -3111,23 +3065,12 @@ class GeneralInformation(APIView):
             api_key = serializer.validated_data.get('api_key', None)
 
             try:
-                # Define the API endpoint
-                url = f'https://{ip}/api/'
-
-                # Define the parameters for the get request
-                params = {
-                    'type': 'op',
-                    'cmd': '<show><system><info></info></system></show>',
-                    'key': api_key
-                }
-
-                # Send the get request
-                response = requests.get(url, params=params, verify=False, timeout=10)
+                response = panos_client().op(ip, api_key, '<show><system><info></info></system></show>')
 
                 # Check the response
                 if response.status_code == 200:
                     print('Successfully retrieved configuration')
-                    return Response({"data": xmltodict.parse(response.text)})
+                    return Response({"data": response.to_dict()})
                 else:
                     return Response({"Error":"Failed to retrieve configuration"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -3215,21 +3158,11 @@ class SessionInformation(APIView):
             api_key = serializer.validated_data.get('api_key', None)
 
             try:
-                # Define the API endpoint
-                url = f'https://{ip}/api/'
-
-                # Define the parameters for the get request
-                params_session = {
-                    'type': 'op',
-                    'cmd': '<show><session><info></info></session></show>',
-                    'key': api_key
-                }
-
                 # Get the session info
-                response = requests.get(url, params=params_session, verify=False, timeout=10)
+                response = panos_client().op(ip, api_key, '<show><session><info></info></session></show>')
                 if response.status_code == 200:
                     print('Successfully retrieved session information')
-                    return Response({"data": xmltodict.parse(response.text)})
+                    return Response({"data": response.to_dict()})
                 else:
                     return Response({"Error":"Failed to retrieve session information"}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
@@ -3373,26 +3306,13 @@ class GenerateAPIKey(APIView):
             username = serializer.validated_data.get('username', None)
             password = serializer.validated_data.get('password', None)
 
-            params =  {
-                'type':'keygen',
-                'user': username,
-                'password': password
-            }
-            # url = f"https://{ip_address}/api/?type=keygen&user={username}&password={password}"
-            url = f'https://{ip_address}/api/'
-
             key = ''
             try: 
-                response = requests.get(url, params=params,verify=False)
-                if response.status_code == 200:
-                    root = ET.fromstring(response.text)
-                    key_element = root.find('.//key')
-                    key = key_element.text
-                else:
-                    key = 'invalid end point or connection timed out'
-                    return Response({"Error":key}, status=status.HTTP_400_BAD_REQUEST)             
-            except requests.exceptions.RequestException as e:
-                key = e.args[0]
+                key = panos_client().get_api_key(ip_address, username, password)
+            except PanosAuthError as e:
+                return Response({"Error":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except PanosError as e:
+                key = f'invalid end point or connection timed out: {e}'
                 return Response({"Error":key}, status=status.HTTP_400_BAD_REQUEST)
                 
             return Response({"data":key})
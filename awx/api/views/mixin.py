@@ -21,7 +21,9 @@ from awx.main.models.organization import Team
 from awx.main.models.projects import Project
 from awx.main.models.inventory import Inventory
 from awx.main.models.jobs import JobTemplate
+from awx.main.models.events import ArchivedEvents
 from awx.api.exceptions import ActiveJobConflict
+from awx.api.filters import ArchivedEventFilter
 
 logger = logging.getLogger('awx.api.views.mixin')
 
@@ -196,3 +198,26 @@ class NoTruncateMixin(object):
         if self.request.query_params.get('no_truncate'):
             context.update(no_truncate=True)
         return context
+
+
+class ArchivedEventsMixin(object):
+    """
+    For event lists of a single job; the events of jobs compacted by
+    compact_job_events are served from their archive.  Pages of events,
+    optionally filtered on their counter, only read the archive chunks that
+    hold them; other filters are applied in memory.
+    """
+
+    # the counter is unique within a job, and indexed with it
+    cursor_ordering = ('counter',)
+
+    def get_job_events(self, job):
+        archive = job.get_event_archive()
+        if archive is not None:
+            return archive.get_events(self.model)
+        return job.get_event_queryset()
+
+    def filter_queryset(self, queryset):
+        if isinstance(queryset, (ArchivedEvents, list)):
+            return ArchivedEventFilter(self.model).filter(self.request, queryset, self)
+        return super().filter_queryset(queryset)
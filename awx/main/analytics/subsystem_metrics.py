@@ -97,6 +97,37 @@ class SetFloatM(SetIntM):
             return 0
 
 
+class SetDictM(BaseM):
+    """A gauge per value of a label, set at once from a dict, e.g. {'organization-1': 3}"""
+
+    def __init__(self, field, help_text, label):
+        self.label = label
+        super(SetDictM, self).__init__(field, help_text)
+        self.current_value = {}
+
+    def reset_value(self, conn):
+        conn.hset(root_key, self.field, json.dumps({}))
+        self.current_value = {}
+
+    def decode_value(self, value):
+        if value is not None:
+            return json.loads(value)
+        else:
+            return {}
+
+    def store_value(self, conn):
+        if self.metric_has_changed:
+            conn.hset(root_key, self.field, json.dumps(self.current_value))
+            self.metric_has_changed = False
+
+    def to_prometheus(self, instance_data):
+        output_text = f"# HELP {self.field} {self.help_text}\n# TYPE {self.field} gauge\n"
+        for instance in instance_data:
+            for label_value, value in instance_data[instance].get(self.field, {}).items():
+                output_text += f'{self.field}{{{self.label}="{label_value}",node="{instance}"}} {value}\n'
+        return output_text
+
+
 class HistogramM(BaseM):
     def __init__(self, field, help_text, buckets):
         self.buckets = buckets
@@ -179,6 +210,19 @@ class Metrics:
             FloatM('callback_receiver_events_insert_db_seconds', 'Total time spent saving events to database'),
             IntM('callback_receiver_events_insert_db', 'Number of events batch inserted into database'),
             IntM('callback_receiver_events_broadcast', 'Number of events broadcast to other control plane nodes'),
+            IntM('callback_receiver_broadcast_dropped', 'Number of event websocket messages dropped because the broadcast queue was full'),
+            SetIntM('callback_receiver_broadcast_queue_size', 'Number of items in the callback receiver broadcast queue when last drained'),
+            IntM('callback_receiver_events_insert_db_copy', 'Number of events inserted into database with COPY'),
+            FloatM('callback_receiver_events_insert_db_copy_seconds', 'Total time spent inserting events into database with COPY'),
+            IntM('callback_receiver_events_insert_db_bulk_create', 'Number of events inserted into database with bulk_create'),
+            FloatM('callback_receiver_events_insert_db_bulk_create_seconds', 'Total time spent inserting events into database with bulk_create'),
+            IntM('callback_receiver_batch_events_bisections', 'Number of times a failed event batch was split in half to isolate bad events'),
+            SetIntM('callback_receiver_batch_size', 'Batch size chosen by the callback receiver adaptive flush policy'),
+            IntM('callback_receiver_flush_reason_forced', 'Number of event buffer flushes forced by an empty queue or shutdown'),
+            IntM('callback_receiver_flush_reason_batch_size', 'Number of event buffer flushes triggered by reaching the batch size'),
+            IntM('callback_receiver_flush_reason_memory', 'Number of event buffer flushes triggered by the buffered stdout size limit'),
+            IntM('callback_receiver_flush_reason_time', 'Number of event buffer flushes triggered by JOB_EVENT_BUFFER_SECONDS'),
+            IntM('callback_receiver_flush_reason_idle', 'Number of event buffer flushes triggered by a drained redis queue'),
             HistogramM(
                 'callback_receiver_batch_events_insert_db', 'Number of events batch inserted into database', settings.SUBSYSTEM_METRICS_BATCH_INSERT_BUCKETS
             ),
@@ -188,6 +232,7 @@ class Metrics:
             FloatM('subsystem_metrics_send_metrics_seconds', 'Time spent sending metrics to other nodes'),
             SetFloatM('task_manager_get_tasks_seconds', 'Time spent in loading tasks from db'),
             SetFloatM('task_manager_start_task_seconds', 'Time spent starting task'),
+            SetFloatM('task_manager_start_tasks_seconds', 'Time spent saving and submitting the started tasks'),
             SetFloatM('task_manager_process_running_tasks_seconds', 'Time spent processing running tasks'),
             SetFloatM('task_manager_process_pending_tasks_seconds', 'Time spent processing pending tasks'),
             SetFloatM('task_manager__schedule_seconds', 'Time spent in running the entire _schedule'),
@@ -197,7 +242,13 @@ class Metrics:
             SetIntM('task_manager_running_processed', 'Number of running tasks processed'),
             SetIntM('task_manager_pending_processed', 'Number of pending tasks processed'),
             SetIntM('task_manager_tasks_blocked', 'Number of tasks blocked from running'),
+            SetIntM('task_manager_tasks_skipped', 'Number of pending tasks not evaluated because nothing they were waiting on changed'),
+            SetIntM('task_manager_tasks_reloaded', 'Number of tasks loaded from db, either all of them or only those that changed'),
+            SetIntM('task_manager_reconciled', 'Whether all tasks were reloaded from db'),
             SetFloatM('task_manager_commit_seconds', 'Time spent in db transaction, including on_commit calls'),
+            SetDictM('task_manager_queue_pending', 'Number of pending tasks per fair-share queue', 'queue'),
+            SetDictM('task_manager_queue_wait_seconds', 'How long the oldest pending task of each fair-share queue has been waiting', 'queue'),
+            SetDictM('task_manager_queue_started', 'Number of tasks started per fair-share queue', 'queue'),
             SetFloatM('dependency_manager_get_tasks_seconds', 'Time spent loading pending tasks from db'),
             SetFloatM('dependency_manager_generate_dependencies_seconds', 'Time spent generating dependencies for pending tasks'),
             SetFloatM('dependency_manager__schedule_seconds', 'Time spent in running the entire _schedule'),
@@ -213,6 +264,11 @@ class Metrics:
             SetIntM('dispatcher_pool_scale_up_events', 'Number of times local dispatcher scaled up a worker since startup'),
             SetIntM('dispatcher_pool_active_task_count', 'Number of active tasks in the worker pool when last task was submitted'),
             SetIntM('dispatcher_pool_max_worker_count', 'Highest number of workers in worker pool in last collection interval, about 20s'),
+            SetDictM('dispatcher_pool_class_worker_count', 'Number of workers in the pool of each class of task', 'task_class'),
+            SetDictM('dispatcher_pool_class_active_task_count', 'Number of active tasks in the pool of each class of task', 'task_class'),
+            SetDictM('dispatcher_pool_class_queue_wait_avg_seconds', 'Average wait for a worker per class of task in last collection interval', 'task_class'),
+            SetDictM('dispatcher_pool_class_queue_wait_max_seconds', 'Longest wait for a worker per class of task in last collection interval', 'task_class'),
+            SetFloatM('dispatcher_pool_first_task_seconds', 'Longest time a new worker took to start its first task in last collection interval'),
             SetFloatM('dispatcher_availability', 'Fraction of time (in last collection interval) dispatcher was able to receive messages'),
         ]
         # turn metric list into dictionary with the metric name as a key
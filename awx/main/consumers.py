@@ -4,17 +4,13 @@ import time
 import hmac
 import asyncio
 import redis
-import requests
 # from ping3 import ping
-import xml.etree.ElementTree as ET
 from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
 from django.utils.encoding import force_bytes
 from django.contrib.auth.models import User
 from asgiref.sync import sync_to_async
 from django.db import connection
-from collections import defaultdict
-from enum import Enum
 from channels.generic.websocket import AsyncJsonWebsocketConsumer, AsyncWebsocketConsumer
 from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
@@ -106,6 +102,10 @@ class RelayConsumer(AsyncJsonWebsocketConsumer):
     async def internal_message(self, event):
         await self.send(event['text'])
 
+    async def internal_messages(self, event):
+        for text in event['texts']:
+            await self.send(text)
+
     async def receive_json(self, data):
         (group, message) = unwrap_broadcast_msg(data)
         if group == "metrics":
@@ -222,624 +222,100 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
     async def internal_message(self, event):
         await self.send(event['text'])
 
-
-class FirewallStatus(Enum):
-    WAITING = "waiting"
-    SOLAR_WIND_MUTE = "solar_wind_mute"
-    BACKUP = "backup"
-    CLEANUP = "cleanup"   
-    DOWNLOAD = "download"
-    INSTALL = "install"
-    REBOOT = "reboot"
-    LOGIN = "login"
-    SOLAR_WIND_UNMUTE = "solar_wind_unmute"
-    UPDATED = "updated"
-    ERROR = "error"
+    async def internal_messages(self, event):
+        # several coalesced notifications for this group, see emit_channel_notifications()
+        for text in event['texts']:
+            await self.send(text)
 
 
 class UpdateFirewallsConsumer(AsyncWebsocketConsumer):
+    """
+    Starts the upgrade of firewalls and follows its progress.  The upgrades
+    run in the dispatcher, see awx.main.tasks.firewall, and go on when the
+    websocket is closed; a client that connects again with only the job_id
+    gets the current status of the job, then its progress.  The messages sent
+    are the status of the firewalls, by group, unless the client also asks
+    for the `logs` of the job, which are then sent as they are logged, as
+    {"log": {...}} messages.
+    """
+
     async def connect(self):
+        self.progress_groups = []
         await self.accept()
 
     async def disconnect(self, close_code):
-        pass
-    
-    # Function to send the export request and save the response
-    async def export_and_save(self, params, filename, job_id, ip):
-        from awx.main.models import UpdateFirewallBackupFile
-
-        # Define the API endpoint
-        url = f'https://{ip}/api/'
-        try:
-            response = requests.get(url, params=params, verify=False, timeout=10)
-            if response.status_code == 200:
-                firewall_backup_file = await sync_to_async(UpdateFirewallBackupFile.objects.create)(
-                    job_id=job_id,
-                    ip_address=ip,
-                    file_name=filename,
-                    xml_content=response.content
-                )
-                with open(filename, 'wb') as file:
-                    file.write(response.content)
-                print(f'Successfully saved to {filename}')
-                return True
-            else:
-                print(f'Failed to save to {filename}')
-                return False
-        except Exception as e:
-            print(f'Failed to save to {filename}')
-            # return False
-            pass
-        finally:
-            import xml.etree.ElementTree as ET
-
-            # Create the root element
-            root = ET.Element("root")
-
-            # Create child elements
-            child1 = ET.SubElement(root, "child1")
-            child2 = ET.SubElement(root, "child2")
-
-            # Add some data to the child elements
-            child1.text = "Data for Child 1"
-            child2.text = "Data for Child 2"
-
-            # Create the XML tree
-            tree = ET.ElementTree(root)
-
-            xml_content = ET.tostring(root, encoding="utf-8", method="xml")
-
-            # Write the tree to an XML file
-            tree.write(filename)
-            firewall_backup_file = await sync_to_async(UpdateFirewallBackupFile.objects.create)(
-                    job_id=job_id,
-                    ip_address=ip,
-                    file_name=filename,
-                    xml_content=xml_content
-                )
-            return True
-
-    async def create_firewall_status_log(self, job_id, ip, text):
-        from awx.main.models import UpdateFirewallStatusLogs
-        firewall_log = await sync_to_async(UpdateFirewallStatusLogs.objects.create)(
-                    job_id=job_id,
-                    ip_address=ip,
-                    text=text
-                )
-
-    async def download_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "downloading started")
-
-        # Define the API endpoint
-        url = f'https://{ip}/api/'
-
-        # Define the parameters for the get request
-        params_get = {
-            'type': 'op',
-            'cmd': '<request><system><software><check></check></software></system></request>',
-            'key': api_key
-        }
-
-        # Send the get request
-        response = requests.get(url, params=params_get, verify=False)
-
-        # Check the response
-        if response.status_code == 200:
-            print('Successfully retrieved software versions')
-            await self.create_firewall_status_log(job_id, ip, "Successfully retrieved the current software versions")
-            root = ET.fromstring(response.text)
-            entry = root.find(f".//versions/entry[version='{version_to_download}']")
-            if entry is not None and entry.find('downloaded').text == 'yes':
-                print(f'Software version {version_to_download} is already downloaded')
-                await self.create_firewall_status_log(job_id, ip, f'Software version {version_to_download} is already downloaded')
-            else:
-                # Define the parameters for the download request
-                params_download = {
-                    'type': 'op',
-                    'cmd': f'<request><system><software><download><version>{version_to_download}</version></download></software></system></request>',
-                    'key': api_key
-                }
-
-                # Send the download request
-                response = requests.get(url, params=params_download, verify=False)
-
-                # Check the response
-                if response.status_code == 200:
-                    print(f'Successfully started download of software version {version_to_download}')
-                    await self.create_firewall_status_log(job_id, ip,f'Started downloading the targeted software version: {version_to_download}')
-                else:
-                    print(f'Failed to start download of software version {version_to_download}')
-                    await self.create_firewall_status_log(job_id, ip,f'Failed to start download of software version {version_to_download}')
-
-                # Wait for the download to complete
-                for i in range(15):  # Try 10 times
-                    response = requests.get(url, params=params_get, verify=False)
-                    if response.status_code == 200:
-                        root = ET.fromstring(response.text)
-                        entry = root.find(f".//versions/entry[version='{version_to_download}']")
-                        if entry is not None and entry.find('downloaded').text == 'yes':
-                            print(f'Successfully downloaded software version {version_to_download}')
-                            await self.create_firewall_status_log(job_id, ip,f'Successfully downloaded software version {version_to_download}')
-                            break
-                    print('Waiting for download to complete...')
-                    await self.create_firewall_status_log(job_id, ip,f'Waiting for download to complete...')
-                    await asyncio.sleep(60)  # Wait for 60 seconds before checking again
-                else:
-                    print('Download did not complete after 10 minutes')
-                    await self.create_firewall_status_log(job_id, ip,f'Maximum tries reached and software download failed after 15 mins')
-                    return False #todo : Error
-        await self.create_firewall_status_log(job_id, ip, "downloading completed")
-        return True
-    
-    async def solar_wind_mute_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "solar_wind_mute started")
-        # await asyncio.sleep(10)
-        await self.create_firewall_status_log(job_id, ip, "This module is not implmeneted yet.")
-        await self.create_firewall_status_log(job_id, ip, "solar_wind_mute completed")
-        return True
-
-    async def backup_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "backup started")
-        params_config = {
-            'type': 'export',
-            'category': 'configuration',
-            'action': 'save',
-            'key': api_key
-        }
-
-        params_device_state = {
-            'type': 'export',
-            'category': 'device-state',
-            'action': 'save',
-            'key': api_key
-        }
-
-        file1 = f'backup_file/{ip}_{current_version}_config_backup.xml'
-        # Export and save the configuration
-        file1_result = await self.export_and_save(params_config, file1, job_id, ip)
-
-        file2 = f'backup_file/{ip}_{current_version}_device_state_cfg.tgz'
-        # Export and save the device state
-        file2_result = await self.export_and_save(params_device_state, file2, job_id, ip)
-        if file1_result and file2_result:
-            await self.create_firewall_status_log(job_id, ip, "Successfully downloaded all back file")
-            return True
-        else:
-            await self.create_firewall_status_log(job_id, ip, "Backup files are not downloading")
-            return False
-        return True
+        if self.progress_groups:
+            for group in self.progress_groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            await self.channel_layer.group_send(
+                settings.BROADCAST_WEBSOCKET_GROUP_NAME,
+                {"type": "consumer.unsubscribe", "groups": self.progress_groups, "origin_channel": self.channel_name},
+            )
 
-    async def cleanup_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, f'Removing all the old software from {ip}')
-        
-        # Define the API endpoint
-        url = f'https://{ip}/api/'
-
-        # Define the parameters for the get request
-        params_get = {
-            'type': 'op',
-            'cmd': '<request><system><software><check></check></software></system></request>',
-            'key': api_key
-        }
-
-        # Send the get request
-        response = requests.get(url, params=params_get, verify=False)
-
-        # Check the response
-        if response.status_code == 200:
-            await self.create_firewall_status_log(job_id, ip, f'Successfully retrieved software versions for {ip}')
-            root = ET.fromstring(response.text)
-            
-            for entry in root.findall('.//versions/entry'):
-                
-                downloaded = entry.find('downloaded').text
-                current = entry.find('current').text
-                version = entry.find('version').text
-                
-                if downloaded == 'yes' and current == 'no':
-                    params_delete = {
-                        'type': 'op',
-                        'cmd': f'<request><system><software><delete><version>{version}</version></delete></software></system></request>',
-                        'key': api_key
-                    }
-                    response = requests.get(url, params=params_delete, verify=False)
-                    if response.status_code == 200:
-                        await self.create_firewall_status_log(job_id, ip, f'Successfully deleted software version {version}')
-                        
-                    else:
-                        await self.create_firewall_status_log(job_id, ip, f"Failed to delete software version {version}")
-        else:
-            await self.create_firewall_status_log(job_id, ip, f'Failed to retrieve software versions')
+    async def follow_progress(self, job_id, logs=False):
+        from awx.main.tasks.firewall import get_log_group, get_progress_group
 
-        await self.create_firewall_status_log(job_id, ip, 'Successfully deleted all the old softwares')
-        return True
-
-    async def install_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, f'Installing {version_to_download} on {ip}')
-                                              
-        # Define the API endpoint
-        url = f'https://{ip}/api/'
-
-        # Define the parameters for the install request
-        params_install = {
-            'type': 'op',
-            'cmd': f'<request><system><software><install><version>{version_to_download}</version></install></software></system></request>',
-            'key': api_key
-        }
-
-        # Send the install request
-        response = requests.get(url, params=params_install, verify=False)
-
-        # Check the response
-        if response.status_code == 200:
-            await self.create_firewall_status_log(job_id, ip, f'Successfully initiated software version {version_to_download}')
-        else:
-            print(f'Failed to install software version {version_to_download}')
-            await self.create_firewall_status_log(job_id, ip, f'Failed to install software version {version_to_download}')
-            return False
-        
-        params_check = {
-            'type': 'op',
-            'cmd': '<show><jobs><all></all></jobs></show>',
-            'key': api_key
-        }
-
-        for i in range(30):  # Try 10 times
-            response = requests.get(url, params=params_check, verify=False)
-            if response.status_code == 200:
-                root = ET.fromstring(response.text)
-                # entry = root.find(f".//versions/entry[version='{version_to_download}']")
-                # if entry is not None and entry.find('current').text == 'yes':
-                #     await self.create_firewall_status_log(job_id, ip, f'Successfully installed software version {version_to_download}')
-                #   
-                #   return True
-                job = root.find(".//job[type='SWInstall']")
-                if job is not None and job.find('status').text == 'FIN':
-                    print(f'Successfully installed software version {version_to_download}')
-                    return True
-            
-                await self.create_firewall_status_log(job_id, ip, f'Waiting for installation to complete...')
-                await asyncio.sleep(60)  # Wait for 60 seconds before checking again
-            else:
-                await self.create_firewall_status_log(job_id, ip, f'Invalid reponse')
-        else:
-            await self.create_firewall_status_log(job_id, ip, f'Installation did not complete after 10 minutes')
-        
-        return False
-    
-    async def reboot_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, f'Rebooting started on  {ip}')
-        
-        # Define the API endpoint
-        url = f'https://{ip}/api/'
-
-        # Define the parameters for the reboot request
-        params_reboot = {
-            'type': 'op',
-            'cmd': '<request><restart><system></system></restart></request>',
-            'key': api_key
-        }
-
-        # Send the reboot request
-        response = requests.get(url, params=params_reboot, verify=False)
-
-        # Check the response
-        if response.status_code == 200:
-            print('Successfully rebooted the firewall')
-            await self.create_firewall_status_log(job_id, ip, f'Successfully rebooted {ip}')
-        else:
-            print('Failed to reboot the firewall')
-            await self.create_firewall_status_log(job_id, ip, f'Failed to reboot {ip}')
-            return False  #todo: every time it return False show the error
-
-        # Define the parameters for the get request
-        params_get = {
-            'type': 'op',
-            'cmd': '<request><system><software><check></check></software></system></request>',
-            'key': api_key
-        }
-
-        # for i in range(10): 
-        #     await asyncio.sleep(60)
-        #     await self.create_firewall_status_log(job_id, ip, f'{ip} Waiting for firewall to reboot...')
-
-        online = False
-
-        # Wait for the firewall to come back online
-        for i in range(20):  # Try 20 times
-            try:
-                response = requests.get(url, params=params_get, verify=False)
-                if response.status_code == 200:
-                    await self.create_firewall_status_log(job_id, ip, f'{ip} is back online')
-                    online = True
-                    break
-            except requests.exceptions.RequestException:
-                # delay = ping(ip)
-                if delay is None:
-                    await self.create_firewall_status_log(job_id, ip, f'{ip} to down, ping failed...')
-                else:
-                    await self.create_firewall_status_log(job_id, ip, f'{ip} to up, Delay: {delay} seconds')
-                print('Waiting for firewall to reboot...')
-                await self.create_firewall_status_log(job_id, ip, f' Waiting for {ip} to reboot...')
-                await asyncio.sleep(60) # Wait for 60 seconds before checking again
-        if not online:
-            await self.create_firewall_status_log(job_id, ip, f'{ip} did not come back online after 20 minutes')
-            return False #sys.exit()  # Stop the script execution
-
-        # Check the installed software version
-        params_get_version = {
-            'type': 'op',
-            'cmd': '<show><system><info></info></system></show>',
-            'key': api_key
-        }
-
-        response = requests.get(url, params=params_get_version, verify=False)
-        if response.status_code == 200:
-            root = ET.fromstring(response.text)
-
-            # Find the sw-version element
-            sw_version = root.find(".//sw-version")
-
-            # Print the software version
-            if sw_version is not None and sw_version.text == version_to_download:
-                await self.create_firewall_status_log(job_id, ip, f'Successfully installed software version {version_to_download}')
-            else:
-                await self.create_firewall_status_log(job_id, ip, f'Failed to install software version {version_to_download}')
-                return False
-            # root = ET.fromstring(response.text)
-            # entry = root.find(f".//sw-version")
-            # if entry is not None and entry.text == version_to_download:
-            #     print(f'Successfully installed software version {version_to_download}')
-            #     await self.create_firewall_status_log(job_id, ip, f'Successfully installed software version {version_to_download}')
-            # else:
-            #     print(f'Failed to install software version {version_to_download}')
-            #     await self.create_firewall_status_log(job_id, ip, f'Failed to install software version {version_to_download}')
-            #     return False
-
-        await self.create_firewall_status_log(job_id, ip, f"{ip} rebooting completed.")
-        return True
-    
-    async def commit_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "commit started")
-        # await asyncio.sleep(10)
-        await self.create_firewall_status_log(job_id, ip, "commit completed")
-        return True
-    
-    async def ping_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "ping started")
-        # await asyncio.sleep(10)
-        await self.create_firewall_status_log(job_id, ip, "ping completed")
-        return True
-    
-    async def login_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "login started")
-        # await asyncio.sleep(10)
-        await self.create_firewall_status_log(job_id, ip, "login completed")
-        return True
-    
-    async def solar_wind_unmute_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "solar_wind_unmute started")
-        # await asyncio.sleep(10)
-        await self.create_firewall_status_log(job_id, ip, "solar_wind_unmute completed")
-        return True
-
-    async def updated_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
-        await self.create_firewall_status_log(job_id, ip, "ip_addtess updated successfully")
-        return True
+        self.progress_groups = [get_progress_group(job_id)] + ([get_log_group(job_id)] if logs else [])
+        for group in self.progress_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        # the upgrades may run on another node, which relays their progress here
+        await self.channel_layer.group_send(
+            settings.BROADCAST_WEBSOCKET_GROUP_NAME,
+            {"type": "consumer.subscribe", "groups": self.progress_groups, "origin_channel": self.channel_name},
+        )
 
-    async def process_firewall_status(self, firewall, result, group_name, ip, status_sequence, name, job_id, api_key, update_version, current_version):
-        for new_status in status_sequence:
-            await self.create_firewall_status_log(job_id, ip, f"{job_id} {ip} Task: {new_status.value.lower()}")
-            task_method = getattr(self, f"{new_status.value.lower()}_firewalls")
-            result[group_name][ip] = {"status": new_status.value, "name": name}
-            await self.send(text_data=json.dumps(result))
-
-            _result = await task_method(firewall, ip, job_id, api_key, update_version, current_version)
-            await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} result {_result}')
-            if _result:
-                # result[group_name][ip] = {"status": new_status.value, "name": name}
-                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} status change {new_status.value}')
-                firewall.status = new_status.value
-                await sync_to_async(firewall.save)()
-                await self.send(text_data=json.dumps(result))
-            else:
-                result[group_name][ip] = {"status": 'error', "name": name}
-                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} status change in else : erros')
-                
-                firewall.status = 'error'
-                await sync_to_async(firewall.save)()
-                await self.send(text_data=json.dumps(result))
-                error_occurred = True
-                break
-        await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} fianlly finished one ip')
-        
-        return not error_occurred
+    async def internal_message(self, event):
+        await self.send(event['text'])
 
-    @sync_to_async
-    def get_firewall_statuses(self, job_id):
-        from awx.main.models import UpdateFirewallStatus
-        statuses = UpdateFirewallStatus.objects.filter(job_id=job_id).order_by('-updated_at')
-        result = defaultdict(dict)
-        res = {status.ip_address: status.status for status in statuses}
-        for _status in statuses:
-            if _status.group_name:
-                result[_status.group_name][_status.ip_address] = {"status":_status.status, "name": _status.name}
-        return result, res
-
-    async def async_send_initial_status(self, job_id):
-        from awx.main.models import UpdateFirewallStatus
-        result, response_data  = await self.get_firewall_statuses(job_id)
-        await self.send(text_data=json.dumps(result))
-        tasks = []
-        for response in response_data.keys():
-            firewall = await sync_to_async(UpdateFirewallStatus.objects.get)(
-                job_id=job_id,
-                ip_address=response
-            )
-            if firewall.group_name not in result:
-                result[firewall.group_name] = {}
-
-            if firewall.status == FirewallStatus.WAITING.value:
-                status_sequence = [
-                    
-                    FirewallStatus.SOLAR_WIND_MUTE,
-                    FirewallStatus.BACKUP,
-                    FirewallStatus.CLEANUP,
-                    FirewallStatus.DOWNLOAD,
-                    FirewallStatus.INSTALL,
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-
-            elif firewall.status == FirewallStatus.SOLAR_WIND_MUTE.value:
-                status_sequence = [
-                    FirewallStatus.BACKUP,
-                    FirewallStatus.CLEANUP,
-                    FirewallStatus.DOWNLOAD,
-                    FirewallStatus.INSTALL,
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-
-            elif firewall.status == FirewallStatus.BACKUP.value:
-                status_sequence = [
-                    FirewallStatus.CLEANUP,
-                    FirewallStatus.DOWNLOAD,
-                    FirewallStatus.INSTALL,
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-            
-            elif firewall.status == FirewallStatus.CLEANUP.value:
-                status_sequence = [
-                    FirewallStatus.DOWNLOAD,
-                    FirewallStatus.INSTALL,
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-
-            elif firewall.status == FirewallStatus.DOWNLOAD.value:
-                status_sequence = [
-                    FirewallStatus.INSTALL,
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-            
-            elif firewall.status == FirewallStatus.INSTALL.value:
-                status_sequence = [
-                    FirewallStatus.REBOOT,
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-            
-            elif firewall.status == FirewallStatus.REBOOT.value:
-                status_sequence = [
-                    FirewallStatus.LOGIN,
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id, firewall.api_key, firewall.update_version, firewall.current_version))
-            
-            elif firewall.status == FirewallStatus.LOGIN.value:
-                status_sequence = [
-                    FirewallStatus.SOLAR_WIND_UNMUTE,
-                    FirewallStatus.UPDATED
-                ]
-                tasks.append(self.process_firewall_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name, job_id), firewall.api_key, firewall.update_version, firewall.current_version)
-            
-            elif firewall.status == FirewallStatus.SOLAR_WIND_UNMUTE.value:
-                status_sequence =FirewallStatus.UPDATED
-                tasks.append(self.change_next_status(firewall, result, firewall.group_name, response, status_sequence, firewall.name))
-            
-            elif firewall.status == FirewallStatus.ERROR.value:
-                pass
-        
-        if firewall.sequence:
-            await asyncio.gather(*tasks)
-        else:
-            for task in tasks:
-                await task
+    async def internal_messages(self, event):
+        for text in event['texts']:
+            await self.send(text)
 
     async def receive(self, text_data):
         from awx.main.models import UpdateFirewallStatus
+        from awx.main.tasks.firewall import get_job_progress, start_firewall_upgrades
+
         text_data_json = json.loads(text_data)
         job_id = text_data_json.get('job_id')
         sequence = text_data_json.get('sequence')
         ip_address = text_data_json.get('ip_address', [])
         update_version = text_data_json.get('update_version')
         api_key = text_data_json.get('api_key')
+        logs = bool(text_data_json.get('logs'))
 
         if ip_address and job_id:
             response_data = {}
             for _ip in ip_address:
                 group_name = _ip['parent']
                 child = _ip['child']
-                
+
                 if group_name not in response_data:
                     response_data[group_name] = {}
-                
-                for i in child:
-                    firewall_status, created = await sync_to_async(UpdateFirewallStatus.objects.get_or_create)(
-                        job_id=job_id,
-                        ip_address=i['ip'],
-                        defaults={'group_name': group_name, 'status': 'waiting', 'sequence': sequence, 'name': i['name'], 'api_key':api_key, 'update_version':update_version, 'current_version':i['current_version']}
-                    )
-                    response_data[group_name][i['ip']] = {"status":"waiting", "name":i['name']}
-            
-            await self.send(text_data=json.dumps(response_data))
-            tasks = []
-            for _ip in ip_address:
-                group_name = _ip['parent']
-                child = _ip['child']
 
                 for i in child:
                     firewall_status, created = await sync_to_async(UpdateFirewallStatus.objects.get_or_create)(
                         job_id=job_id,
                         ip_address=i['ip'],
+                        defaults={
+                            'group_name': group_name,
+                            'status': 'waiting',
+                            'sequence': sequence,
+                            'name': i['name'],
+                            'api_key': api_key,
+                            'update_version': update_version,
+                            'current_version': i['current_version'],
+                            # when known, saves finding it out before the rollout, see FirewallRollout
+                            'ha_peer': i.get('ha_peer'),
+                        },
                     )
-                    
-                    if not created:
-                        status_sequence = [
-                            FirewallStatus.SOLAR_WIND_MUTE,
-                            FirewallStatus.BACKUP,
-                            FirewallStatus.CLEANUP,
-                            FirewallStatus.DOWNLOAD,
-                            FirewallStatus.INSTALL,
-                            FirewallStatus.REBOOT,
-                            FirewallStatus.LOGIN,
-                            FirewallStatus.SOLAR_WIND_UNMUTE,
-                            FirewallStatus.UPDATED
-                        ]
-                        await self.create_firewall_status_log(job_id, i['ip'], f'{job_id} {i["ip"]} status change initiating the call process firewall')
-
-                        tasks.append(self.process_firewall_status(firewall_status, response_data, group_name, i['ip'], status_sequence, i['name'], job_id, api_key, update_version, i['current_version']))
-            
-            if sequence:
-                await self.create_firewall_status_log(job_id, i['ip'], f'{job_id} {i["ip"]} in sequence')
-                await asyncio.gather(*tasks)
-            else:
-                for task in tasks:
-                    await self.create_firewall_status_log(job_id, i['ip'], f'{job_id} {i["ip"]}  running task')
-                    await task
+                    response_data[group_name][i['ip']] = {"status": firewall_status.status, "name": i['name']}
+
+            await self.send(text_data=json.dumps(response_data))
+            await self.follow_progress(job_id, logs)
+            await sync_to_async(start_firewall_upgrades)(job_id)
         else:
-            await self.async_send_initial_status(job_id)
+            await self.follow_progress(job_id, logs)
+            await self.send(text_data=json.dumps(await sync_to_async(get_job_progress)(job_id)))
 
 
 def run_sync(func):
@@ -872,4 +348,36 @@ def emit_channel_notification(group, payload):
             group,
             {"type": "internal.message", "text": payload_dumped, "needs_relay": True},
         )
-    )
\ No newline at end of file
+    )
+
+
+def emit_channel_notifications(notifications):
+    """
+    Send a batch of (group, payload) notifications in a single event loop run.
+    With BROADCAST_WEBSOCKET_COALESCE_MESSAGES, payloads for the same group are
+    coalesced into one channel layer message, which consumers unpack into the
+    individual websocket messages.
+    """
+    texts_by_group = {}
+    for group, payload in notifications:
+        payload_dumped = _dump_payload(payload)
+        if payload_dumped is not None:
+            texts_by_group.setdefault(group, []).append(payload_dumped)
+    if not texts_by_group:
+        return
+
+    channel_layer = get_channel_layer()
+    coalesce = settings.BROADCAST_WEBSOCKET_COALESCE_MESSAGES
+
+    async def group_send(group, texts):
+        if len(texts) > 1 and coalesce:
+            await channel_layer.group_send(group, {"type": "internal.messages", "texts": texts, "needs_relay": True})
+            return
+        # one at a time, in order; the nodes that were not upgraded yet only know of internal.message
+        for text in texts:
+            await channel_layer.group_send(group, {"type": "internal.message", "text": text, "needs_relay": True})
+
+    async def group_send_all():
+        await asyncio.gather(*(group_send(group, texts) for group, texts in texts_by_group.items()))
+
+    run_sync(group_send_all())
@@ -59,6 +59,14 @@ class PubSub(object):
         with self.conn.cursor() as cur:
             cur.execute('SELECT pg_notify(%s, %s);', (channel, payload))
 
+    def notify_many(self, notifications):
+        """Send a list of (channel, payload) notifications with a single statement"""
+        if not notifications:
+            return
+        channels, payloads = zip(*notifications)
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT pg_notify(c, p) FROM unnest(%s::text[], %s::text[]) AS n(c, p);', (list(channels), list(payloads)))
+
     @staticmethod
     def current_notifies(conn):
         """
@@ -1,5 +1,6 @@
 import logging
 import os
+from fnmatch import fnmatchcase
 import random
 import signal
 import sys
@@ -48,7 +49,8 @@ class PoolWorker(object):
                   process that is forked will get() from this queue and handle
                   received messages in an endless loop
     - self.finished: this is a queue which the worker process uses to signal
-                     that it has finished processing a message
+                     that it has started (a (uuid, timestamp) tuple) or
+                     finished (the uuid) processing a message
 
     When a message is put() onto this worker, it is tracked in
     self.managed_tasks.
@@ -71,12 +73,19 @@ class PoolWorker(object):
         self.messages_sent = 0
         self.messages_finished = 0
         self.managed_tasks = collections.OrderedDict()
+        # seconds messages waited between time_ack and being started, and the
+        # worker took to start its first message, see AutoscalePool.pop_queue_waits
+        self.queue_waits = []
+        self.first_task_seconds = []
+        self.tasks_started = 0
+        self.spawned = None
         self.finished = MPQueue(queue_size) if self.track_managed_tasks else NoOpResultQueue()
         self.queue = MPQueue(queue_size)
         self.process = Process(target=target, args=(self.queue, self.finished) + args)
         self.process.daemon = True
 
     def start(self):
+        self.spawned = time.time()
         self.process.start()
 
     def put(self, body):
@@ -134,6 +143,19 @@ class PoolWorker(object):
         # if any tasks were finished, removed them from the managed tasks for
         # this worker
         for uuid in finished:
+            if isinstance(uuid, tuple):
+                # the task was started, record how long it was queued for
+                uuid, started = uuid
+                task = self.managed_tasks.get(uuid)
+                if isinstance(task, dict):
+                    task['started'] = started
+                    if 'time_ack' in task:
+                        self.queue_waits.append(started - task['time_ack'])
+                        if not self.tasks_started:
+                            # includes the start up of the worker, unless it was idle before the message arrived
+                            self.first_task_seconds.append(started - max(task['time_ack'], self.spawned))
+                self.tasks_started += 1
+                continue
             try:
                 del self.managed_tasks[uuid]
                 self.messages_finished += 1
@@ -305,6 +327,21 @@ class WorkerPool(object):
             logger.exception('could not kill {}'.format(worker.pid))
 
 
+def get_auto_max_workers():
+    """The maximum number of dispatcher workers, derived from the memory of the node"""
+    settings_absmem = getattr(settings, 'SYSTEM_TASK_ABS_MEM', None)
+    if settings_absmem is not None:
+        # There are 1073741824 bytes in a gigabyte. Convert bytes to gigabytes by dividing by 2**30
+        total_memory_gb = convert_mem_str_to_bytes(settings_absmem) // 2**30
+    else:
+        total_memory_gb = (psutil.virtual_memory().total >> 30) + 1  # noqa: round up
+
+    # Get same number as max forks based on memory, this function takes memory as bytes
+    # and add magic prime number of extra workers to ensure
+    # we have a few extra workers to run the heartbeat
+    return get_mem_effective_capacity(total_memory_gb * 2**30) + 7
+
+
 class AutoscalePool(WorkerPool):
     """
     An extended pool implementation that automatically scales workers up and
@@ -315,22 +352,13 @@ class AutoscalePool(WorkerPool):
 
     def __init__(self, *args, **kwargs):
         self.max_workers = kwargs.pop('max_workers', None)
+        # number of idle workers to keep ready for a burst of messages, so
+        # they do not wait for new workers to start up
+        self.spare_workers = kwargs.pop('spare_workers', 0)
         super(AutoscalePool, self).__init__(*args, **kwargs)
 
         if self.max_workers is None:
-            settings_absmem = getattr(settings, 'SYSTEM_TASK_ABS_MEM', None)
-            if settings_absmem is not None:
-                # There are 1073741824 bytes in a gigabyte. Convert bytes to gigabytes by dividing by 2**30
-                total_memory_gb = convert_mem_str_to_bytes(settings_absmem) // 2**30
-            else:
-                total_memory_gb = (psutil.virtual_memory().total >> 30) + 1  # noqa: round up
-
-            # Get same number as max forks based on memory, this function takes memory as bytes
-            self.max_workers = get_mem_effective_capacity(total_memory_gb * 2**30)
-
-            # add magic prime number of extra workers to ensure
-            # we have a few extra workers to run the heartbeat
-            self.max_workers += 7
+            self.max_workers = get_auto_max_workers()
 
         # max workers can't be less than min_workers
         self.max_workers = max(self.min_workers, self.max_workers)
@@ -344,7 +372,35 @@ class AutoscalePool(WorkerPool):
         self.scale_up_ct = 0
         self.worker_count_max = 0
 
+    def init_workers(self, target, *target_args):
+        super(AutoscalePool, self).init_workers(target, *target_args)
+        self.top_up_spare_workers()
+
+    def top_up_spare_workers(self):
+        idle = len([w for w in self.workers if w.idle])
+        for _ in range(self.spare_workers - idle):
+            if self.full:
+                break
+            self.up()
+
+    def pop_queue_waits(self):
+        queue_waits = []
+        for w in self.workers:
+            w.calculate_managed_tasks()
+            queue_waits.extend(w.queue_waits)
+            w.queue_waits = []
+        return queue_waits
+
+    def pop_first_task_seconds(self):
+        first_task_seconds = []
+        for w in self.workers:
+            w.calculate_managed_tasks()
+            first_task_seconds.extend(w.first_task_seconds)
+            w.first_task_seconds = []
+        return first_task_seconds
+
     def produce_subsystem_metrics(self, metrics_object):
+        metrics_object.set('dispatcher_pool_first_task_seconds', max(self.pop_first_task_seconds(), default=0.0))
         metrics_object.set('dispatcher_pool_scale_up_events', self.scale_up_ct)
         metrics_object.set('dispatcher_pool_active_task_count', sum(len(w.managed_tasks) for w in self.workers))
         metrics_object.set('dispatcher_pool_max_worker_count', self.worker_count_max)
@@ -364,6 +420,8 @@ class AutoscalePool(WorkerPool):
 
     @property
     def debug_meta(self):
+        if self.spare_workers:
+            return 'min={} max={} spare={}'.format(self.min_workers, self.max_workers, self.spare_workers)
         return 'min={} max={}'.format(self.min_workers, self.max_workers)
 
     @log_excess_runtime(logger)
@@ -382,6 +440,7 @@ class AutoscalePool(WorkerPool):
         django.db.utils.Error exceptions.  Act accordingly.
         """
         orphaned = []
+        idle = len([w for w in self.workers if w.idle])
         for w in self.workers[::]:
             if not w.alive:
                 # the worker process has exited
@@ -401,14 +460,16 @@ class AutoscalePool(WorkerPool):
                         logger.warning(f'Worker was told to quit but has not, pid={w.pid}')
                 orphaned.extend(w.orphaned_tasks)
                 self.workers.remove(w)
-            elif w.idle and len(self.workers) > self.min_workers:
+            elif w.idle and len(self.workers) > self.min_workers and idle > self.spare_workers:
                 # the process has an empty queue (it's idle) and we have
-                # more processes in the pool than we need (> min)
+                # more processes in the pool than we need (> min, and more
+                # idle ones than the spares)
                 # send this process a message so it will exit gracefully
                 # at the next opportunity
                 logger.debug('scaling down worker pid:{}'.format(w.pid))
                 w.quit()
                 self.workers.remove(w)
+                idle -= 1
             if w.alive:
                 # if we discover a task manager invocation that's been running
                 # too long, reap it (because otherwise it'll just hold the postgres
@@ -435,6 +496,8 @@ class AutoscalePool(WorkerPool):
             idx = random.choice(range(len(self.workers)))
             self.write(idx, m)
 
+        self.top_up_spare_workers()
+
     def add_bind_kwargs(self, body):
         bind_kwargs = body.pop('bind_kwargs', [])
         body.setdefault('kwargs', {})
@@ -476,16 +539,129 @@ class AutoscalePool(WorkerPool):
             for w in workers:
                 if not w.busy:
                     w.put(body)
+                    self.top_up_spare_workers()
                     break
             else:
                 task_name = 'unknown'
                 if isinstance(body, dict):
                     task_name = body.get('task')
                 logger.warning(f'Workers maxed, queuing {task_name}, load: {sum(len(w.managed_tasks) for w in self.workers)} / {len(self.workers)}')
-                return super(AutoscalePool, self).write(preferred_queue, body)
+                # queue it behind the fewest messages, rather than on whichever
+                # worker the uuid of the message happens to point to
+                least_loaded = min(range(len(self.workers)), key=lambda idx: len(self.workers[idx].managed_tasks))
+                return super(AutoscalePool, self).write(least_loaded, body)
         except Exception:
             for conn in connections.all():
                 # If the database connection has a hiccup, re-establish a new
                 # connection
                 conn.close_if_unusable_or_obsolete()
             logger.exception('failed to write inbound message')
+
+
+class TaskClassPool(object):
+    """
+    Splits the workers of the dispatcher into an AutoscalePool per class of
+    task (see settings.DISPATCHER_TASK_CLASSES), each with its own min and
+    max workers, so that e.g. long running jobs can not take every worker and
+    hold up short system tasks or the heartbeat.
+
+    A message goes to the pool of the first class with a task name pattern
+    matching its task, or to the pool of the last class.
+
+    All the classes share the memory-derived worker budget that a single
+    AutoscalePool would have: the classes with a max_workers count against
+    it, and the classes without one split what is left evenly (but get at
+    least their min_workers).
+
+    pool = TaskClassPool({
+        'jobs': {'tasks': ['awx.main.tasks.jobs.*'], 'min_workers': 1, 'max_workers': None, 'spare_workers': 2},
+        'system': {'tasks': ['*'], 'min_workers': 4, 'max_workers': 16},
+    })
+    """
+
+    def __init__(self, task_classes):
+        if not task_classes:
+            raise ValueError('at least one task class is required')
+        self.pools = {}
+        self.task_patterns = []
+        max_workers = self.split_max_workers(task_classes)
+        for name, options in task_classes.items():
+            pool = AutoscalePool(min_workers=options.get('min_workers'), max_workers=max_workers[name], spare_workers=options.get('spare_workers', 0))
+            pool.name = f'{pool.name} {name}'
+            self.pools[name] = pool
+            self.task_patterns.append((name, options.get('tasks', [])))
+        self.default_task_class = name
+        self.task_class_cache = {}
+
+    @staticmethod
+    def split_max_workers(task_classes):
+        """Return the max workers of each task class"""
+        max_workers = {name: options.get('max_workers') for name, options in task_classes.items()}
+        auto = [name for name, value in max_workers.items() if value is None]
+        if auto:
+            remaining = max(get_auto_max_workers() - sum(value for value in max_workers.values() if value is not None), 0)
+            for name in auto:
+                # AutoscalePool raises it to min_workers
+                max_workers[name] = max(remaining // len(auto), 1)
+        return max_workers
+
+    def __len__(self):
+        return sum(len(pool) for pool in self.pools.values())
+
+    @property
+    def workers(self):
+        return [w for pool in self.pools.values() for w in pool.workers]
+
+    def init_workers(self, target, *target_args):
+        for pool in self.pools.values():
+            pool.init_workers(target, *target_args)
+
+    def task_class(self, body):
+        task_name = (body.get('task') or '') if isinstance(body, dict) else ''
+        if task_name not in self.task_class_cache:
+            for name, patterns in self.task_patterns:
+                if any(fnmatchcase(task_name, pattern) for pattern in patterns):
+                    break
+            else:
+                name = self.default_task_class
+            self.task_class_cache[task_name] = name
+        return self.task_class_cache[task_name]
+
+    # the tasks running in every pool are reported to the heartbeat
+    add_bind_kwargs = AutoscalePool.add_bind_kwargs
+
+    def write(self, preferred_queue, body):
+        if isinstance(body, dict) and body.get('bind_kwargs'):
+            self.add_bind_kwargs(body)
+        return self.pools[self.task_class(body)].write(preferred_queue, body)
+
+    def debug(self, *args, **kwargs):
+        return '\n'.join(pool.debug(*args, **kwargs) for pool in self.pools.values())
+
+    def cleanup(self):
+        for pool in self.pools.values():
+            pool.cleanup()
+
+    def stop(self, signum):
+        for pool in self.pools.values():
+            pool.stop(signum)
+
+    def produce_subsystem_metrics(self, metrics_object):
+        workers, active, wait_avg, wait_max = {}, {}, {}, {}
+        for name, pool in self.pools.items():
+            workers[name] = len(pool.workers)
+            active[name] = sum(len(w.managed_tasks) for w in pool.workers)
+            queue_waits = pool.pop_queue_waits()
+            wait_avg[name] = sum(queue_waits) / len(queue_waits) if queue_waits else 0.0
+            wait_max[name] = max(queue_waits, default=0.0)
+        first_task_seconds = [seconds for pool in self.pools.values() for seconds in pool.pop_first_task_seconds()]
+        metrics_object.set('dispatcher_pool_first_task_seconds', max(first_task_seconds, default=0.0))
+        metrics_object.set('dispatcher_pool_scale_up_events', sum(pool.scale_up_ct for pool in self.pools.values()))
+        metrics_object.set('dispatcher_pool_active_task_count', sum(active.values()))
+        metrics_object.set('dispatcher_pool_max_worker_count', sum(pool.worker_count_max for pool in self.pools.values()))
+        metrics_object.set('dispatcher_pool_class_worker_count', workers)
+        metrics_object.set('dispatcher_pool_class_active_task_count', active)
+        metrics_object.set('dispatcher_pool_class_queue_wait_avg_seconds', wait_avg)
+        metrics_object.set('dispatcher_pool_class_queue_wait_max_seconds', wait_max)
+        for pool in self.pools.values():
+            pool.worker_count_max = len(pool.workers)
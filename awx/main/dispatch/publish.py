@@ -4,6 +4,7 @@ import json
 import time
 from uuid import uuid4
 
+from django.conf import settings
 from django_guid import get_guid
 
 from . import pg_bus_conn
@@ -16,6 +17,39 @@ def serialize_task(f):
     return '.'.join([f.__module__, f.__name__])
 
 
+def serialize_body(queue, obj):
+    """
+    Return the pg_notify payload for a task body.  Postgres limits payloads to
+    8000 bytes, so bodies larger than settings.DISPATCHER_CLAIM_CHECK_THRESHOLD
+    are stored in a DispatcherClaimCheck and the payload only refers to them (a
+    claim check), see AWXConsumerBase.redeem_claim_check.  Like the
+    notification, the claim check is committed with the current transaction.
+    """
+    from awx.main.models import DispatcherClaimCheck  # circular import
+
+    payload = json.dumps(obj)
+    threshold = settings.DISPATCHER_CLAIM_CHECK_THRESHOLD
+    if not threshold or len(payload.encode()) <= threshold:
+        return payload
+    stored = DispatcherClaimCheck.objects.create(payload=payload)
+    claim_check = {'uuid': obj['uuid'], 'task': obj.get('task'), 'claim_check': stored.pk}
+    if queue == 'tower_broadcast_all':
+        # every dispatcher redeems it, so it can only expire
+        claim_check['claim_check_shared'] = True
+    return json.dumps(claim_check)
+
+
+def apply_async_many(messages):
+    """
+    Publish a list of (queue, body) messages, the bodies coming from
+    get_async_body, with a single pg_notify statement.  Like apply_async,
+    dispatchers only receive them once the current transaction is committed.
+    """
+    if messages and not is_testing():
+        with pg_bus_conn() as conn:
+            conn.notify_many([(queue, serialize_body(queue, obj)) for queue, obj in messages])
+
+
 class task:
     """
     Used to decorate a function or class so that it can be run asynchronously
@@ -50,6 +84,10 @@ class task:
     def announce():
         print("Run this everywhere!")
 
+    # Many tasks can be published at once, see apply_async_many:
+
+    apply_async_many([(queue, add.get_async_body([i, i])) for i in range(100)])
+
     # The special parameter bind_kwargs tells the main dispatcher process to add certain kwargs
 
     @task(bind_kwargs=['dispatch_time'])
@@ -103,7 +141,7 @@ class task:
                     queue = queue()
                 if not is_testing():
                     with pg_bus_conn() as conn:
-                        conn.notify(queue, json.dumps(obj))
+                        conn.notify(queue, serialize_body(queue, obj))
                 return (obj, queue)
 
         # If the object we're wrapping *is* a class (e.g., RunJob), return
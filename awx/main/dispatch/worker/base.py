@@ -15,6 +15,7 @@ from datetime import timedelta
 
 from django import db
 from django.conf import settings
+from django.utils.timezone import now as tz_now
 
 from awx.main.dispatch.pool import WorkerPool
 from awx.main.dispatch.periodic import Scheduler
@@ -115,8 +116,31 @@ class AWXConsumerBase(object):
         self.pool.write(queue, body)
         self.total_messages += 1
 
+    def redeem_claim_check(self, body):
+        """Return the task body a pg_notify payload refers to, see awx.main.dispatch.publish.serialize_body"""
+        from awx.main.models import DispatcherClaimCheck  # circular import
+
+        claim_checks = DispatcherClaimCheck.objects.filter(pk=body['claim_check'])
+        payload = claim_checks.values_list('payload', flat=True).first()
+        if payload is None:
+            logger.error(f'Body of task {body.get("uuid")} {body.get("task")} is no longer stored in claim check {body["claim_check"]}, dropping it')
+            return None
+        if not body.get('claim_check_shared'):
+            claim_checks.delete()
+        return json.loads(payload)
+
+    def cleanup_claim_checks(self):
+        """Remove the claim checks no dispatcher redeemed, and those of broadcast tasks, once expired"""
+        from awx.main.models import DispatcherClaimCheck  # circular import
+
+        DispatcherClaimCheck.objects.filter(created__lt=tz_now() - timedelta(seconds=settings.DISPATCHER_CLAIM_CHECK_TTL)).delete()
+
     def process_task(self, body):
         """Routes the task details in body as either a control task or a task-task"""
+        if 'claim_check' in body:
+            body = self.redeem_claim_check(body)
+            if body is None:
+                return
         if 'control' in body:
             try:
                 return self.control(body)
@@ -178,6 +202,7 @@ class AWXConsumerPG(AWXConsumerBase):
         # NOTE: if we run out of database connections, it is important to still run cleanup
         # so that we scale down workers and free up connections
         schedule['pool_cleanup'] = {'control': self.pool.cleanup, 'schedule': timedelta(seconds=60)}
+        schedule['claim_check_cleanup'] = {'control': self.cleanup_claim_checks, 'schedule': timedelta(seconds=60)}
         # record subsystem metrics for the dispatcher
         schedule['metrics_gather'] = {'control': self.record_metrics, 'schedule': timedelta(seconds=20)}
         self.scheduler = Scheduler(schedule)
@@ -277,6 +302,10 @@ class BaseWorker(object):
         ppid = os.getppid()
         signal_handler = WorkerSignalHandler()
         set_connection_name('worker')  # set application_name to distinguish from other dispatcher processes
+        try:
+            self.warm_up()
+        except Exception:
+            logger.exception(f'Failed to warm up worker pid={os.getpid()}')
         while not signal_handler.kill_now:
             # if the parent PID changes, this process has been orphaned
             # via e.g., segfault or sigkill, we should exit too
@@ -296,6 +325,9 @@ class BaseWorker(object):
                     # If the database connection has a hiccup during the prior message, close it
                     # so we can establish a new connection
                     conn.close_if_unusable_or_obsolete()
+                if isinstance(body, dict) and 'uuid' in body and 'time_ack' in body:
+                    # lets the pool measure how long the message was queued for
+                    finished.put((body['uuid'], time.time()))
                 self.perform_work(body, *args)
             except Exception:
                 logger.exception(f'Unhandled exception in perform_work in worker pid={os.getpid()}')
@@ -308,6 +340,10 @@ class BaseWorker(object):
     def perform_work(self, body):
         raise NotImplementedError()
 
+    def warm_up(self):
+        """Called in the worker process before it reads its first message"""
+        pass
+
     def on_start(self):
         pass
 
@@ -1,27 +1,32 @@
-import json
+import collections
 import logging
 import os
 import signal
+import threading
 import time
 import datetime
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.functional import cached_property
 from django.utils.timezone import now as tz_now
 from django.db import transaction, connection as django_connection
 from django_guid import set_guid
 
+import msgpack
 import psutil
 
 import redis
 
-from awx.main.consumers import emit_channel_notification
+from awx.main.consumers import emit_channel_notifications
 from awx.main.models import JobEvent, AdHocCommandEvent, ProjectUpdateEvent, InventoryUpdateEvent, SystemJobEvent, UnifiedJob
-from awx.main.constants import ACTIVE_STATES
-from awx.main.models.events import emit_event_detail
+from awx.main.constants import ACTIVE_STATES, MINIMAL_EVENTS
+from awx.main.queue import get_callback_queue_names, decode_event
+from awx.main.models.events import event_batch_notification, event_detail_notification
 from awx.main.utils.profiling import AWXProfiler
 import awx.main.analytics.subsystem_metrics as s_metrics
 from .base import BaseWorker
+from .event_writers import BulkCreateEventWriter, get_event_writer
 
 logger = logging.getLogger('awx.main.commands.run_callback_receiver')
 
@@ -52,6 +57,202 @@ def job_stats_wrapup(job_identifier, event=None):
         logger.exception('Worker failed to save stats or emit notifications: Job {}'.format(job_identifier))
 
 
+def check_callback_queue_shards():
+    """Sharding needs a shard per worker at least, as a shard read by several workers would not keep the events of a job in order"""
+    shards = len(get_callback_queue_names())
+    if 1 < shards < settings.JOB_EVENT_WORKERS:
+        raise ImproperlyConfigured(f'CALLBACK_QUEUE_SHARDS ({shards}) must be 1 or at least JOB_EVENT_WORKERS ({settings.JOB_EVENT_WORKERS})')
+
+
+def stdout_bytes(event):
+    return len(event.stdout.encode('utf-8'))
+
+
+class AdaptiveFlushPolicy:
+    """
+    Decides when the callback receiver should flush its event buffer.
+
+    The batch size adapts between JOB_EVENT_BUFFER_MIN_BATCH and
+    JOB_EVENT_BUFFER_MAX_BATCH: while the redis queue has a backlog, batches
+    grow up to the size that can be inserted in JOB_EVENT_BUFFER_TARGET_SECONDS
+    (based on a moving average of the observed insert time per event); when
+    the queue is drained, buffered events are flushed right away so that
+    interactive jobs are not held back.  Independently of the batch size, the
+    buffer is flushed when its stdout reaches JOB_EVENT_BUFFER_MAX_BYTES or
+    when JOB_EVENT_BUFFER_SECONDS have passed since the last flush.
+    """
+
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.min_batch = settings.JOB_EVENT_BUFFER_MIN_BATCH
+        self.max_batch = max(self.min_batch, settings.JOB_EVENT_BUFFER_MAX_BATCH)
+        self.batch_size = self.min_batch
+        self.seconds_per_event = None
+        self.queue_depth = 0
+
+    def observe_insert(self, events, seconds):
+        if events <= 0:
+            return
+        sample = seconds / events
+        if self.seconds_per_event is None:
+            self.seconds_per_event = sample
+        else:
+            self.seconds_per_event += self.SMOOTHING * (sample - self.seconds_per_event)
+        self.update_batch_size()
+
+    def observe_queue_depth(self, depth):
+        self.queue_depth = depth
+        self.update_batch_size()
+
+    def update_batch_size(self):
+        size = max(self.queue_depth, self.min_batch)
+        if self.seconds_per_event:
+            size = min(size, int(settings.JOB_EVENT_BUFFER_TARGET_SECONDS / self.seconds_per_event))
+        self.batch_size = min(max(size, self.min_batch), self.max_batch)
+
+    def flush_reason(self, buff, buffered_bytes, since_last_flush):
+        """Return why the buffer should be flushed now, or None to keep buffering"""
+        if not any(buff.values()):
+            return None
+        if buffered_bytes >= settings.JOB_EVENT_BUFFER_MAX_BYTES:
+            return 'memory'
+        if any(len(events) >= self.batch_size for events in buff.values()):
+            return 'batch_size'
+        if since_last_flush > settings.JOB_EVENT_BUFFER_SECONDS:
+            return 'time'
+        if self.queue_depth == 0 and since_last_flush > settings.JOB_EVENT_QUEUE_DEPTH_INTERVAL:
+            return 'idle'
+        return None
+
+
+class EventBroadcaster:
+    """
+    Sends the websocket messages and runs the stats wrapup for saved events
+    on a separate thread, so that websocket fan-out does not hold back the
+    next batch insert.
+
+    Work is handed over through a queue bounded by
+    JOB_EVENT_BROADCAST_QUEUE_SIZE (0 processes everything inline).  The
+    thread drains the queue in batches, and the websocket messages of a batch
+    are sent in one go, with the events of a job coalesced into a single
+    channel layer message.  When the queue is full, websocket messages for
+    events outside of MINIMAL_EVENTS are dropped first; the UI catches up
+    with the job summary and the API.  Messages for minimal events, event
+    batches, job summaries and wrapups are never dropped, and block the
+    callback receiver if the queue is full of them.
+    """
+
+    def __init__(self, metrics):
+        self.maxsize = settings.JOB_EVENT_BROADCAST_QUEUE_SIZE
+        self.metrics = metrics  # only used when processing inline
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.thread = None
+        self.stopping = False
+
+    def event(self, event):
+        self.put(('event', event), priority=event.event in MINIMAL_EVENTS)
+
+    def summary(self, job_identifier, final_counter):
+        self.put(('summary', job_identifier, final_counter))
+
+    def wrapup(self, job_identifier, event=None):
+        self.put(('wrapup', job_identifier, event))
+
+    def event_batch(self, cls, job_identifier, batch):
+        self.put(('event_batch', cls, job_identifier, batch))
+
+    def put(self, item, priority=True):
+        if self.maxsize <= 0:
+            self.process([item], self.metrics)
+            return
+        with self.condition:
+            if self.thread is None:
+                # started lazily, so that the thread belongs to the forked worker process
+                self.thread = threading.Thread(target=self.run, name='callback-receiver-broadcast', daemon=True)
+                self.thread.start()
+            while len(self.items) >= self.maxsize:
+                if not priority:
+                    self.dropped += 1
+                    return
+                if not self.evict():
+                    self.condition.wait()
+            self.items.append((item, priority))
+            self.condition.notify_all()
+
+    def evict(self):
+        """Drop the oldest queued websocket message for a non-minimal event, returns False if there is none"""
+        for queued in self.items:
+            if not queued[1]:
+                self.items.remove(queued)
+                self.dropped += 1
+                return True
+        return False
+
+    def stop(self, timeout=10):
+        """Wait for queued work to be processed, and stop the thread"""
+        with self.condition:
+            if self.thread is None:
+                return
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def run(self):
+        metrics = s_metrics.Metrics(auto_pipe_execute=False)
+        while True:
+            with self.condition:
+                while not self.items and not self.stopping:
+                    self.condition.wait(timeout=1)
+                if not self.items:
+                    django_connection.close()
+                    return
+                batch = [item for item, priority in self.items]
+                self.items.clear()
+                dropped, self.dropped = self.dropped, 0
+                self.condition.notify_all()
+            metrics.inc('callback_receiver_broadcast_dropped', dropped)
+            metrics.set('callback_receiver_broadcast_queue_size', len(batch))
+            try:
+                # the wrapups use the database connection of this thread, reconnect after a database error
+                django_connection.close_if_unusable_or_obsolete()
+                self.process(batch, metrics)
+            except Exception:
+                logger.exception('Callback receiver failed to broadcast events')
+            if metrics.should_pipe_execute() is True:
+                metrics.pipe_execute()
+
+    def process(self, batch, metrics):
+        notifications = []
+        broadcast = 0
+        for item in batch:
+            kind = item[0]
+            if kind == 'event':
+                notification = event_detail_notification(item[1])
+                if notification:
+                    notifications.append(notification)
+                    broadcast += 1
+            elif kind == 'event_batch':
+                notification = event_batch_notification(*item[1:])
+                if notification:
+                    notifications.append(notification)
+            elif kind == 'summary':
+                # EOF events are sent when stdout for the running task is
+                # closed. don't actually persist them to the database; we
+                # just use them to report `summary` websocket events as an
+                # approximation for when a job is "done"
+                notifications.append(('jobs-summary', dict(group_name='jobs', unified_job_id=item[1], final_counter=item[2])))
+            elif kind == 'wrapup':
+                # the event messages of the job go out before its notifications
+                emit_channel_notifications(notifications)
+                notifications = []
+                job_stats_wrapup(item[1], event=item[2])
+        emit_channel_notifications(notifications)
+        metrics.inc('callback_receiver_events_broadcast', broadcast)
+
+
 class CallbackBrokerWorker(BaseWorker):
     """
     A worker implementation that deserializes callback event data and persists
@@ -65,17 +266,23 @@ class CallbackBrokerWorker(BaseWorker):
     INDIVIDUAL_EVENT_RETRIES = 3
     last_stats = time.time()
     last_flush = time.time()
+    last_queue_depth = 0
     total = 0
     last_event = ''
     prof = None
 
     def __init__(self):
         self.buff = {}
+        self.buffered_bytes = 0
+        self.flush_policy = AdaptiveFlushPolicy()
         self.redis = redis.Redis.from_url(settings.BROKER_URL)
         self.subsystem_metrics = s_metrics.Metrics(auto_pipe_execute=False)
         self.queue_pop = 0
-        self.queue_name = settings.CALLBACK_QUEUE
+        self.queue_names = get_callback_queue_names()
         self.prof = AWXProfiler("CallbackBrokerWorker")
+        self.writer = get_event_writer(settings.JOB_EVENT_WRITER)
+        self.fallback_writer = BulkCreateEventWriter()
+        self.broadcaster = EventBroadcaster(self.subsystem_metrics)
         for key in self.redis.keys('awx_callback_receiver_statistics_*'):
             self.redis.delete(key)
 
@@ -84,33 +291,67 @@ class CallbackBrokerWorker(BaseWorker):
         """This needs to be obtained after forking, or else it will give the parent process"""
         return os.getpid()
 
+    @staticmethod
+    def queues_for_worker(idx):
+        """
+        Return the callback queue names that the worker at the given pool
+        index is bound to.  Every shard is read by exactly one worker, so the
+        events of a job are always processed in order by the same process.
+        """
+        queues = get_callback_queue_names()
+        if len(queues) == 1:
+            return queues
+        check_callback_queue_shards()
+        workers = settings.JOB_EVENT_WORKERS
+        bound = queues[idx % workers :: workers]
+        if idx % workers == 0:
+            # drain any events published to the unsharded queue before sharding was enabled
+            bound.append(settings.CALLBACK_QUEUE)
+        return bound
+
     def read(self, queue):
         try:
-            res = self.redis.blpop(self.queue_name, timeout=1)
+            res = self.redis.blpop(self.queue_names, timeout=1)
+            if len(self.queue_names) > 1:
+                # blpop pops from the first non-empty key, rotate so that no shard is starved
+                self.queue_names.append(self.queue_names.pop(0))
             if res is None:
+                # the queues stayed empty for the whole timeout
+                self.flush_policy.observe_queue_depth(0)
                 return {'event': 'FLUSH'}
             self.total += 1
             self.queue_pop += 1
+            self.sample_queue_depth()
             self.subsystem_metrics.inc('callback_receiver_events_popped_redis', 1)
             self.subsystem_metrics.inc('callback_receiver_events_in_memory', 1)
-            return json.loads(res[1])
+            return decode_event(res[1])
         except redis.exceptions.RedisError:
             logger.exception("encountered an error communicating with redis")
             time.sleep(1)
-        except (json.JSONDecodeError, KeyError):
-            logger.exception("failed to decode JSON message from redis")
+        except (ValueError, KeyError, msgpack.UnpackException):
+            logger.exception("failed to decode message from redis")
         finally:
             self.record_statistics()
             self.record_read_metrics()
 
         return {'event': 'FLUSH'}
 
+    def sample_queue_depth(self):
+        if time.time() - self.last_queue_depth > settings.JOB_EVENT_QUEUE_DEPTH_INTERVAL:
+            pipe = self.redis.pipeline()
+            for queue_name in self.queue_names:
+                pipe.llen(queue_name)
+            self.flush_policy.observe_queue_depth(sum(pipe.execute()))
+            self.last_queue_depth = time.time()
+
     def record_read_metrics(self):
         if self.queue_pop == 0:
             return
         if self.subsystem_metrics.should_pipe_execute() is True:
-            queue_size = self.redis.llen(self.queue_name)
-            self.subsystem_metrics.set('callback_receiver_events_queue_size_redis', queue_size)
+            pipe = self.redis.pipeline()
+            for queue_name in get_callback_queue_names():
+                pipe.llen(queue_name)
+            self.subsystem_metrics.set('callback_receiver_events_queue_size_redis', sum(pipe.execute()))
             self.subsystem_metrics.pipe_execute()
             self.queue_pop = 0
 
@@ -139,24 +380,86 @@ class CallbackBrokerWorker(BaseWorker):
             filepath = self.prof.stop()
             logger.error(f'profiling is disabled, wrote {filepath}')
 
-    def work_loop(self, *args, **kw):
+    def work_loop(self, queue, finished, idx, *args):
         if settings.AWX_CALLBACK_PROFILE:
             signal.signal(signal.SIGUSR1, self.toggle_profiling)
-        return super(CallbackBrokerWorker, self).work_loop(*args, **kw)
+        self.queue_names = self.queues_for_worker(idx)
+        try:
+            return super(CallbackBrokerWorker, self).work_loop(queue, finished, idx, *args)
+        finally:
+            self.broadcaster.stop()
+
+    def write_events(self, writer, cls, events):
+        """Save a batch of events with the given writer, recording per-writer throughput"""
+        start = time.perf_counter()
+        writer.write(cls, events)
+        self.subsystem_metrics.inc(f'callback_receiver_events_insert_db_{writer.name}_seconds', time.perf_counter() - start)
+        self.subsystem_metrics.inc(f'callback_receiver_events_insert_db_{writer.name}', len(events))
+
+    def bisect_save(self, cls, events, saved_events, dropped_events):
+        """
+        Save a batch that failed to write as a whole by splitting it in halves,
+        so that a single bad event costs O(log n) batch inserts instead of one
+        INSERT per event.  Returns the number of events saved in batches and
+        individually; saved and abandoned events are appended to the given lists.
+        """
+        bulk_saved = singular_saved = 0
+        self.subsystem_metrics.inc('callback_receiver_batch_events_bisections', 1)
+        middle = len(events) // 2
+        for chunk in (events[:middle], events[middle:]):
+            if len(chunk) == 1:
+                status = self.save_event(chunk[0])
+                if status == 'saved':
+                    singular_saved += 1
+                    saved_events.append(chunk[0])
+                elif status == 'dropped':
+                    dropped_events.append(chunk[0])
+            elif chunk:
+                try:
+                    self.write_events(self.fallback_writer, cls, chunk)
+                    bulk_saved += len(chunk)
+                    saved_events.extend(chunk)
+                except Exception:
+                    django_connection.ensure_connection()
+                    chunk_bulk_saved, chunk_singular_saved = self.bisect_save(cls, chunk, saved_events, dropped_events)
+                    bulk_saved += chunk_bulk_saved
+                    singular_saved += chunk_singular_saved
+        return bulk_saved, singular_saved
+
+    def save_event(self, e):
+        """Save a single event, returns one of saved, retry or dropped"""
+        try:
+            e.save()
+            return 'saved'
+        except Exception as exc_indv:
+            retry_count = getattr(e, '_retry_count', 0) + 1
+            e._retry_count = retry_count
+
+            # special sanitization logic for postgres treatment of NUL 0x00 char
+            # This used to check the class of the exception but on the postgres3 upgrade it could appear
+            #   as either DataError or ValueError, so now lets just try if its there.
+            if (retry_count == 1) and ("\x00" in e.stdout):
+                e.stdout = e.stdout.replace("\x00", "")
+
+            if retry_count >= self.INDIVIDUAL_EVENT_RETRIES:
+                logger.error(f'Hit max retries ({retry_count}) saving individual Event error: {str(exc_indv)}\ndata:\n{e.__dict__}')
+                return 'dropped'
+            logger.info(f'Database Error Saving individual Event uuid={e.uuid} try={retry_count}, error: {str(exc_indv)}')
+            return 'retry'
 
     def flush(self, force=False):
         now = tz_now()
-        if force or (time.time() - self.last_flush) > settings.JOB_EVENT_BUFFER_SECONDS or any([len(events) >= 1000 for events in self.buff.values()]):
+        flush_reason = 'forced' if force else self.flush_policy.flush_reason(self.buff, self.buffered_bytes, time.time() - self.last_flush)
+        if flush_reason:
             metrics_bulk_events_saved = 0
             metrics_singular_events_saved = 0
             metrics_events_batch_save_errors = 0
-            metrics_events_broadcast = 0
             metrics_events_missing_created = 0
             metrics_total_job_event_processing_seconds = datetime.timedelta(seconds=0)
             for cls, events in self.buff.items():
                 if not events:
                     continue
-                logger.debug(f'{cls.__name__}.objects.bulk_create({len(events)})')
+                logger.debug(f'{cls.__name__} {self.writer.name}({len(events)})')
                 for e in events:
                     e.modified = now  # this can be set before created because now is set above on line 149
                     if not e.created:
@@ -165,59 +468,46 @@ class CallbackBrokerWorker(BaseWorker):
                     else:  # only calculate the seconds if the created time already has been set
                         metrics_total_job_event_processing_seconds += e.modified - e.created
                 metrics_duration_to_save = time.perf_counter()
-                saved_events = []
                 try:
-                    cls.objects.bulk_create(events)
+                    self.write_events(self.writer, cls, events)
                     metrics_bulk_events_saved += len(events)
                     saved_events = events
                     self.buff[cls] = []
+                    self.flush_policy.observe_insert(len(events), time.perf_counter() - metrics_duration_to_save)
                 except Exception as exc:
                     # If the database is flaking, let ensure_connection throw a general exception
                     # will be caught by the outer loop, which goes into a proper sleep and retry loop
                     django_connection.ensure_connection()
-                    logger.warning(f'Error in events bulk_create, will try indiviually, error: {str(exc)}')
-                    # if an exception occurs, we should re-attempt to save the
-                    # events one-by-one, because something in the list is
-                    # broken/stale
+                    logger.warning(f'Error in events {self.writer.name}, will bisect the batch, error: {str(exc)}')
+                    # if an exception occurs, something in the list is broken/stale;
+                    # split the batch in halves with the fallback writer until the
+                    # offending events are isolated and can be retried one-by-one
                     metrics_events_batch_save_errors += 1
-                    for e in events.copy():
-                        try:
-                            e.save()
-                            metrics_singular_events_saved += 1
-                            events.remove(e)
-                            saved_events.append(e)  # Importantly, remove successfully saved events from the buffer
-                        except Exception as exc_indv:
-                            retry_count = getattr(e, '_retry_count', 0) + 1
-                            e._retry_count = retry_count
-
-                            # special sanitization logic for postgres treatment of NUL 0x00 char
-                            # This used to check the class of the exception but on the postgres3 upgrade it could appear
-                            #   as either DataError or ValueError, so now lets just try if its there.
-                            if (retry_count == 1) and ("\x00" in e.stdout):
-                                e.stdout = e.stdout.replace("\x00", "")
-
-                            if retry_count >= self.INDIVIDUAL_EVENT_RETRIES:
-                                logger.error(f'Hit max retries ({retry_count}) saving individual Event error: {str(exc_indv)}\ndata:\n{e.__dict__}')
-                                events.remove(e)
-                            else:
-                                logger.info(f'Database Error Saving individual Event uuid={e.uuid} try={retry_count}, error: {str(exc_indv)}')
+                    saved_events, dropped_events = [], []
+                    bulk_saved, singular_saved = self.bisect_save(cls, events, saved_events, dropped_events)
+                    metrics_bulk_events_saved += bulk_saved
+                    metrics_singular_events_saved += singular_saved
+                    # Importantly, remove successfully saved (or abandoned) events from the buffer
+                    done = set(id(e) for e in saved_events + dropped_events)
+                    self.buff[cls] = [e for e in events if id(e) not in done]
 
                 metrics_duration_to_save = time.perf_counter() - metrics_duration_to_save
                 for e in saved_events:
                     if not getattr(e, '_skip_websocket_message', False):
-                        metrics_events_broadcast += 1
-                        emit_event_detail(e)
+                        self.broadcaster.event(e)
                     if getattr(e, '_notification_trigger_event', False):
-                        job_stats_wrapup(getattr(e, e.JOB_REFERENCE), event=e)
+                        self.broadcaster.wrapup(getattr(e, e.JOB_REFERENCE), event=e)
             self.last_flush = time.time()
+            self.buffered_bytes = sum(stdout_bytes(e) for events in self.buff.values() for e in events)
             # only update metrics if we saved events
             if (metrics_bulk_events_saved + metrics_singular_events_saved) > 0:
+                self.subsystem_metrics.inc(f'callback_receiver_flush_reason_{flush_reason}', 1)
+                self.subsystem_metrics.set('callback_receiver_batch_size', self.flush_policy.batch_size)
                 self.subsystem_metrics.inc('callback_receiver_batch_events_errors', metrics_events_batch_save_errors)
                 self.subsystem_metrics.inc('callback_receiver_events_insert_db_seconds', metrics_duration_to_save)
                 self.subsystem_metrics.inc('callback_receiver_events_insert_db', metrics_bulk_events_saved + metrics_singular_events_saved)
                 self.subsystem_metrics.observe('callback_receiver_batch_events_insert_db', metrics_bulk_events_saved)
                 self.subsystem_metrics.inc('callback_receiver_events_in_memory', -(metrics_bulk_events_saved + metrics_singular_events_saved))
-                self.subsystem_metrics.inc('callback_receiver_events_broadcast', metrics_events_broadcast)
                 self.subsystem_metrics.set(
                     'callback_receiver_event_processing_avg_seconds',
                     metrics_total_job_event_processing_seconds.total_seconds()
@@ -248,14 +538,10 @@ class CallbackBrokerWorker(BaseWorker):
                             set_guid(body['guid'])
                         final_counter = body.get('final_counter', 0)
                         logger.info('Starting EOF event processing for Job {}'.format(job_identifier))
-                        # EOF events are sent when stdout for the running task is
-                        # closed. don't actually persist them to the database; we
-                        # just use them to report `summary` websocket events as an
-                        # approximation for when a job is "done"
-                        emit_channel_notification('jobs-summary', dict(group_name='jobs', unified_job_id=job_identifier, final_counter=final_counter))
+                        self.broadcaster.summary(job_identifier, final_counter)
 
                         if notification_trigger_event:
-                            job_stats_wrapup(job_identifier)
+                            self.broadcaster.wrapup(job_identifier)
                     except Exception:
                         logger.exception('Worker failed to perform EOF tasks: Job {}'.format(job_identifier))
                     finally:
@@ -263,6 +549,12 @@ class CallbackBrokerWorker(BaseWorker):
                         set_guid('')
                     return
 
+                if body.get('event') == 'event_batch':
+                    # sent in place of rate limited websocket messages, see RunnerCallback.event_handler
+                    self.broadcaster.event_batch(cls, job_identifier, body)
+                    self.subsystem_metrics.inc('callback_receiver_events_in_memory', -1)
+                    return
+
                 skip_websocket_message = body.pop('skip_websocket_message', False)
 
                 event = cls.create_from_data(**body)
@@ -274,6 +566,7 @@ class CallbackBrokerWorker(BaseWorker):
                     event._notification_trigger_event = True
 
                 self.buff.setdefault(cls, []).append(event)
+                self.buffered_bytes += stdout_bytes(event)
 
             retries = 0
             while retries <= self.MAX_RETRIES:
@@ -285,6 +578,7 @@ class CallbackBrokerWorker(BaseWorker):
                     if retries >= self.MAX_RETRIES:
                         logger.exception('Worker could not re-establish database connectivity, giving up on one or more events.')
                         self.buff = {}
+                        self.buffered_bytes = 0
                         return
                     delay = 60 * retries
                     logger.warning(f'Database Error Flushing Job Events, retry #{retries + 1} in {delay} seconds: {str(exc)}')
@@ -0,0 +1,96 @@
+import logging
+
+from django.db import connection
+
+logger = logging.getLogger('awx.main.commands.run_callback_receiver')
+
+__all__ = ['BulkCreateEventWriter', 'CopyEventWriter', 'get_event_writer']
+
+
+class BulkCreateEventWriter:
+    """
+    Persists a batch of buffered events with a single multi-row INSERT via
+    the Django ORM.  This is the historical callback receiver write path, and
+    it is always used as the fallback when another writer fails.
+    """
+
+    name = 'bulk_create'
+
+    def write(self, cls, events):
+        cls.objects.bulk_create(events)
+
+
+class CopyEventWriter(BulkCreateEventWriter):
+    """
+    Streams a batch of buffered events into the (partitioned) event table
+    using `COPY ... FROM STDIN`, which avoids the parse/plan overhead of very
+    large INSERT statements.
+
+    COPY does not hand back generated primary keys, and saved events need
+    them for their websocket messages, so ids are reserved from the table's
+    sequence before the rows are streamed.  On databases other than postgres
+    (e.g., sqlite in tests), or if the sequence can not be found, this falls
+    back to bulk_create.
+    """
+
+    name = 'copy'
+
+    SEQUENCE_SQL = (
+        "SELECT COALESCE(pg_get_serial_sequence(%s, 'id'), substring(column_default from 'nextval\\(''([^'']+)''')) "
+        "FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'id'"
+    )
+
+    def __init__(self):
+        self.sequences = {}
+
+    def get_sequence(self, cls):
+        table = cls._meta.db_table
+        if table not in self.sequences:
+            with connection.cursor() as cursor:
+                cursor.execute(self.SEQUENCE_SQL, [table, table])
+                row = cursor.fetchone()
+            self.sequences[table] = row[0] if row else None
+            if self.sequences[table] is None:
+                logger.warning(f'Could not find id sequence for {table}, events will be saved with bulk_create')
+        return self.sequences[table]
+
+    def write(self, cls, events):
+        if connection.vendor != 'postgresql':
+            return super(CopyEventWriter, self).write(cls, events)
+        sequence = self.get_sequence(cls)
+        if sequence is None:
+            return super(CopyEventWriter, self).write(cls, events)
+
+        fields = cls._meta.concrete_fields
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(f.column) for f in fields)
+        needs_pk = [e for e in events if e.pk is None]
+        with connection.cursor() as cursor:
+            if needs_pk:
+                cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [sequence, len(needs_pk)])
+                for e, (pk,) in zip(needs_pk, cursor.fetchall()):
+                    e.pk = pk
+            try:
+                with cursor.copy(f'COPY {qn(cls._meta.db_table)} ({columns}) FROM STDIN') as copy:
+                    for e in events:
+                        copy.write_row([f.get_db_prep_save(f.pre_save(e, True), connection) for f in fields])
+            except Exception:
+                # the reserved ids are simply skipped; clear them so that a
+                # retry through the fallback path inserts (rather than updates)
+                for e in needs_pk:
+                    e.pk = None
+                raise
+
+        for e in events:
+            e._state.adding = False
+            e._state.db = connection.alias
+
+
+EVENT_WRITERS = {writer.name: writer for writer in (BulkCreateEventWriter, CopyEventWriter)}
+
+
+def get_event_writer(name):
+    if name not in EVENT_WRITERS:
+        logger.error(f'Unknown callback receiver event writer {name}, using {BulkCreateEventWriter.name}')
+        name = BulkCreateEventWriter.name
+    return EVENT_WRITERS[name]()
@@ -7,6 +7,7 @@ import time
 
 from kubernetes.config import kube_config
 
+from django import db
 from django.conf import settings
 from django_guid import set_guid
 
@@ -137,6 +138,16 @@ class TaskWorker(BaseWorker):
             self.perform_work(callback)
         return result
 
+    def warm_up(self):
+        """
+        Connect to the database and load the settings from it, through the
+        redis cache, so the first task this worker runs does not wait for it.
+        Imported modules are inherited from the dispatcher when forking.
+        """
+        settings.__clean_on_fork__()
+        db.connection.ensure_connection()
+        settings._awx_conf_settings._preload_cache()
+
     def on_start(self):
         dispatch_startup()
 
@@ -0,0 +1,81 @@
+# Copyright (c) 2015 Ansible, Inc.
+# All Rights Reserved.
+
+# Python
+import datetime
+import logging
+
+# Django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+# AWX
+from awx.main.constants import ACTIVE_STATES
+from awx.main.models import Job, AdHocCommand, ProjectUpdate, InventoryUpdate, SystemJob, UnifiedJobEventArchive
+
+
+class Command(BaseCommand):
+    """
+    Management command to move the events of old jobs into compressed archives.
+
+    Only the stdout views and downloads and the event lists of each job read
+    archived events; the event detail and children views, the host and group
+    event lists and the play and task counts of the job serializers treat
+    them as if they had been removed by cleanup_jobs.  This is why it is not
+    a system job: run it when you would otherwise run cleanup_jobs.
+    """
+
+    help = 'Move the events of jobs/updates finished more than N days ago into compressed per-job archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', dest='days', type=int, default=30, metavar='N', help='Compact the events of jobs/updates finished more than N days ago. Defaults to 30.'
+        )
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False, help='Dry run mode (show jobs whose events would be compacted)')
+
+    def init_logging(self):
+        log_levels = dict(enumerate([logging.ERROR, logging.INFO, logging.DEBUG, 0]))
+        self.logger = logging.getLogger('awx.main.commands.compact_job_events')
+        self.logger.setLevel(log_levels.get(self.verbosity, 0))
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(handler)
+        self.logger.propagate = False
+
+    def compact(self, job_class):
+        jobs = job_class.objects.filter(finished__lt=self.cutoff, event_archive__isnull=True).exclude(status__in=ACTIVE_STATES).order_by('pk')
+        compacted = events = stdout_length = archived_bytes = 0
+        for job in jobs.iterator():
+            if self.dry_run:
+                self.logger.info('would compact the events of {} {}'.format(job_class.__name__, job.pk))
+                compacted += 1
+                continue
+            archive = UnifiedJobEventArchive.archive(job)
+            self.logger.debug('compacted {} events of {} {} into {} bytes'.format(archive.event_count, job_class.__name__, job.pk, archive.compressed_length))
+            compacted += 1
+            events += archive.event_count
+            stdout_length += archive.stdout_length
+            archived_bytes += archive.compressed_length
+        return compacted, events, stdout_length, archived_bytes
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        self.init_logging()
+        self.days = int(options.get('days', 30))
+        self.dry_run = bool(options.get('dry_run', False))
+        try:
+            self.cutoff = now() - datetime.timedelta(days=self.days)
+        except OverflowError:
+            raise CommandError('--days specified is too large. Try something less than 99999 (about 270 years).')
+
+        for job_class in (Job, AdHocCommand, ProjectUpdate, InventoryUpdate, SystemJob):
+            compacted, events, stdout_length, archived_bytes = self.compact(job_class)
+            if self.dry_run:
+                self.logger.log(99, '{}: {} would be compacted.'.format(job_class.__name__, compacted))
+            else:
+                self.logger.log(
+                    99,
+                    '{}: {} compacted, {} events archived, {} characters of stdout stored in {} bytes.'.format(
+                        job_class.__name__, compacted, events, stdout_length, archived_bytes
+                    ),
+                )
@@ -1,11 +1,13 @@
 # Copyright (c) 2015 Ansible, Inc.
 # All Rights Reserved.
 
-from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
 
 from awx.main.dispatch.control import Control
 from awx.main.dispatch.worker import AWXConsumerRedis, CallbackBrokerWorker
+from awx.main.dispatch.worker.callback import check_callback_queue_shards
+from awx.main.queue import get_callback_queue_names
 
 
 class Command(BaseCommand):
@@ -24,12 +26,16 @@ class Command(BaseCommand):
         if options.get('status'):
             print(Control('callback_receiver').status())
             return
+        try:
+            check_callback_queue_shards()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
         consumer = None
         try:
             consumer = AWXConsumerRedis(
                 'callback_receiver',
                 CallbackBrokerWorker(),
-                queues=[getattr(settings, 'CALLBACK_QUEUE', '')],
+                queues=get_callback_queue_names(),
             )
             consumer.run()
         except KeyboardInterrupt:
@@ -8,7 +8,7 @@ from django.core.management.base import BaseCommand
 
 from awx.main.dispatch import get_task_queuename
 from awx.main.dispatch.control import Control
-from awx.main.dispatch.pool import AutoscalePool
+from awx.main.dispatch.pool import AutoscalePool, TaskClassPool
 from awx.main.dispatch.worker import AWXConsumerPG, TaskWorker
 
 logger = logging.getLogger('awx.main.dispatch')
@@ -64,7 +64,11 @@ class Command(BaseCommand):
 
         try:
             queues = ['tower_broadcast_all', 'tower_settings_change', get_task_queuename()]
-            consumer = AWXConsumerPG('dispatcher', TaskWorker(), queues, AutoscalePool(min_workers=4), schedule=settings.CELERYBEAT_SCHEDULE)
+            if settings.DISPATCHER_TASK_CLASSES:
+                pool = TaskClassPool(settings.DISPATCHER_TASK_CLASSES)
+            else:
+                pool = AutoscalePool(min_workers=4)
+            consumer = AWXConsumerPG('dispatcher', TaskWorker(), queues, pool, schedule=settings.CELERYBEAT_SCHEDULE)
             consumer.run()
         except KeyboardInterrupt:
             logger.debug('Terminating Task Dispatcher')
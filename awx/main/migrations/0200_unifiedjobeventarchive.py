@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0199_alter_updatefirewallstatus_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnifiedJobEventArchive',
+            fields=[
+                (
+                    'unified_job',
+                    models.OneToOneField(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name='event_archive',
+                        serialize=False,
+                        to='main.unifiedjob',
+                    ),
+                ),
+                ('created', models.DateTimeField(default=None, editable=False)),
+                ('event_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('stdout_length', models.BigIntegerField(default=0, editable=False, help_text='Total length of the stdout of the archived events.')),
+                ('compressed_length', models.BigIntegerField(default=0, editable=False, help_text='Total size of the compressed chunks of the archive.')),
+                ('compression', models.CharField(choices=[('gzip', 'gzip')], default='gzip', editable=False, max_length=16)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UnifiedJobEventArchiveChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_index', models.PositiveIntegerField(editable=False)),
+                ('event_count', models.PositiveIntegerField(editable=False)),
+                ('first_counter', models.PositiveIntegerField(editable=False)),
+                ('last_counter', models.PositiveIntegerField(editable=False)),
+                ('data', models.BinaryField()),
+                (
+                    'archive',
+                    models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='main.unifiedjobeventarchive'),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['archive', 'first_index'], name='main_unifie_archive_0e6483_idx'),
+                    models.Index(fields=['archive', 'first_counter'], name='main_unifie_archive_0c80cf_idx'),
+                ],
+            },
+        ),
+    ]
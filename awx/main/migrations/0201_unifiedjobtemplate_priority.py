@@ -0,0 +1,20 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0200_unifiedjobeventarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unifiedjobtemplate',
+            name='priority',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Jobs of templates with a higher priority are started first. With fair-share scheduling, this only orders them among the jobs of the same organization. Only system administrators can change it.',
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0201_unifiedjobtemplate_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='updatefirewallstatus',
+            name='ha_peer',
+            field=models.CharField(default=None, max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name='updatefirewallstatus',
+            name='wave',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='updatefirewallstatus',
+            name='started_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0202_updatefirewallstatus_rollout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskManagerChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('unified_job_id', models.PositiveIntegerField(editable=False)),
+            ],
+        ),
+    ]
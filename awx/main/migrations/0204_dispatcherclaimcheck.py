@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:35
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0203_taskmanagerchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatcherClaimCheck',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('payload', models.TextField(editable=False)),
+            ],
+        ),
+        # claim checks only hold messages in flight, which a crash loses anyway
+        migrations.RunSQL("ALTER TABLE main_dispatcherclaimcheck SET UNLOGGED;", "ALTER TABLE main_dispatcherclaimcheck SET LOGGED;"),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0204_dispatcherclaimcheck'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='updatefirewallstatus',
+            name='in_progress',
+            field=models.CharField(blank=True, default='', max_length=24),
+        ),
+    ]
@@ -39,6 +39,8 @@ from awx.main.models.events import (  # noqa
     JobEvent,
     ProjectUpdateEvent,
     SystemJobEvent,
+    UnifiedJobEventArchive,
+    UnifiedJobEventArchiveChunk,
     UnpartitionedAdHocCommandEvent,
     UnpartitionedInventoryUpdateEvent,
     UnpartitionedJobEvent,
@@ -54,6 +56,8 @@ from awx.main.models.ha import (  # noqa
     InstanceLink,
     InstanceGroup,
     TowerScheduleState,
+    TaskManagerChange,
+    DispatcherClaimCheck,
 )
 from awx.main.models.rbac import (  # noqa
     Role,
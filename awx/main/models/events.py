@@ -2,13 +2,16 @@
 
 import datetime
 from datetime import timezone
+import gzip
+import json
 import logging
 from collections import defaultdict
 import time
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models, DatabaseError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction, DatabaseError
 from django.db.models.functions import Cast
 from django.utils.dateparse import parse_datetime
 from django.utils.text import Truncator
@@ -28,7 +31,15 @@ analytics_logger = logging.getLogger('awx.analytics.job_events')
 
 logger = logging.getLogger('awx.main.models.events')
 
-__all__ = ['JobEvent', 'ProjectUpdateEvent', 'AdHocCommandEvent', 'InventoryUpdateEvent', 'SystemJobEvent']
+__all__ = [
+    'JobEvent',
+    'ProjectUpdateEvent',
+    'AdHocCommandEvent',
+    'InventoryUpdateEvent',
+    'SystemJobEvent',
+    'UnifiedJobEventArchive',
+    'UnifiedJobEventArchiveChunk',
+]
 
 
 def sanitize_event_keys(kwargs, valid_keys):
@@ -61,8 +72,38 @@ def create_host_status_counts(event_data):
 
 
 def emit_event_detail(event):
+    notification = event_detail_notification(event)
+    if notification:
+        consumers.emit_channel_notification(*notification)
+
+
+def event_batch_notification(cls, job_identifier, batch):
+    """
+    Return the websocket notification for an event_batch message, which
+    announces events whose own websocket messages were skipped by the
+    rate limit, or None if it should not be sent
+    """
+    if settings.UI_LIVE_UPDATES_ENABLED is False:
+        return None
+    group = camelcase_to_underscore(cls.__name__) + 's'
+    return (
+        '-'.join([group, str(job_identifier)]),
+        {
+            cls.JOB_REFERENCE.replace('_id', ''): job_identifier,
+            'group_name': group,
+            'event': 'event_batch',
+            'counters': batch.get('counters', []),
+            'stdout_lines': batch.get('stdout_lines', []),
+            'start_line': batch.get('start_line'),
+            'end_line': batch.get('end_line'),
+        },
+    )
+
+
+def event_detail_notification(event):
+    """Return the (group, payload) websocket notification for a saved event, or None if it should not be sent"""
     if settings.UI_LIVE_UPDATES_ENABLED is False and event.event not in MINIMAL_EVENTS:
-        return
+        return None
     cls = event.__class__
     relation = {
         JobEvent: 'job_id',
@@ -78,7 +119,7 @@ def emit_event_detail(event):
         url = '/api/v2/ad_hoc_command_events/{}'.format(event.id)
     group = camelcase_to_underscore(cls.__name__) + 's'
     timestamp = event.created.isoformat()
-    consumers.emit_channel_notification(
+    return (
         '-'.join([group, str(getattr(event, relation))]),
         {
             'id': event.id,
@@ -965,3 +1006,251 @@ class UnpartitionedSystemJobEvent(SystemJobEvent):
 
 
 UnpartitionedSystemJobEvent._meta.db_table = '_unpartitioned_' + SystemJobEvent._meta.db_table  # noqa
+
+
+class EventArchiveJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # unlike DjangoJSONEncoder, keep microseconds
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(EventArchiveJSONEncoder, self).default(o)
+
+
+class UnifiedJobEventArchive(models.Model):
+    """
+    Cold storage for the events of a finished unified job.
+
+    The compact_job_events management command moves the events of old jobs
+    out of the (partitioned) event tables into an archive per job.  The events
+    are stored in counter order, in chunks of up to
+    JOB_EVENT_ARCHIVE_CHUNK_SIZE events; each chunk is a gzip-compressed
+    JSON lines blob, with one object per event, keyed by column, and records
+    the counter range and position of its events so that a page of events
+    only decompresses the chunks that hold it.  The event list views, the
+    stdout views and stdout downloads read archived events transparently;
+    see UnifiedJob.get_event_archive().  Everything else that reads the
+    event tables, such as UnifiedJob.get_event_queryset(), the event detail
+    and children views, the host and group event lists and the play and
+    task counts of the job serializers, does not; to these, archived events
+    look like events removed by cleanup_jobs.
+    """
+
+    class Meta:
+        app_label = 'main'
+
+    COMPRESSION_CHOICES = [
+        ('gzip', 'gzip'),
+    ]
+
+    unified_job = models.OneToOneField(
+        'UnifiedJob',
+        related_name='event_archive',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        editable=False,
+    )
+    created = models.DateTimeField(
+        default=None,
+        editable=False,
+    )
+    event_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+    )
+    stdout_length = models.BigIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Total length of the stdout of the archived events.'),
+    )
+    compressed_length = models.BigIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Total size of the compressed chunks of the archive.'),
+    )
+    compression = models.CharField(
+        max_length=16,
+        choices=COMPRESSION_CHOICES,
+        default='gzip',
+        editable=False,
+    )
+
+    @classmethod
+    def archive(cls, unified_job):
+        """
+        Move the events of a finished unified job into a new archive.  The
+        archive is written and the events deleted in one transaction; only
+        one chunk of events is held in memory at a time.
+        """
+        fields = unified_job.event_class._meta.concrete_fields
+        attnames = [f.attname for f in fields]
+        event_qs = unified_job.get_event_queryset()
+        with transaction.atomic():
+            archive = cls.objects.create(unified_job=unified_job, created=now())
+            rows = []
+            for row in event_qs.order_by('counter', 'pk').values_list(*attnames).iterator(chunk_size=settings.JOB_EVENT_ARCHIVE_CHUNK_SIZE):
+                rows.append(dict(zip(attnames, row)))
+                if len(rows) >= settings.JOB_EVENT_ARCHIVE_CHUNK_SIZE:
+                    archive.add_chunk(rows)
+                    rows = []
+            if rows:
+                archive.add_chunk(rows)
+            archive.save(update_fields=['event_count', 'stdout_length', 'compressed_length'])
+            event_qs.delete()
+        return archive
+
+    def add_chunk(self, rows):
+        """Append a chunk with the given events, which follow the ones already archived"""
+        data = b''.join(json.dumps(row, cls=EventArchiveJSONEncoder).encode('utf-8') + b'\n' for row in rows)
+        data = gzip.compress(data, compresslevel=settings.JOB_EVENT_ARCHIVE_COMPRESSLEVEL)
+        UnifiedJobEventArchiveChunk.objects.create(
+            archive=self,
+            first_index=self.event_count,
+            event_count=len(rows),
+            first_counter=rows[0]['counter'],
+            last_counter=rows[-1]['counter'],
+            data=data,
+        )
+        self.event_count += len(rows)
+        self.compressed_length += len(data)
+        self.stdout_length += sum(len(row['stdout']) for row in rows)
+
+    def iter_rows(self):
+        """Yield the archived events as dicts of column values (as encoded in JSON), ordered by counter"""
+        for chunk in self.chunks.order_by('first_index').iterator():
+            yield from chunk.iter_rows()
+
+    def get_events(self, event_class):
+        """Return the archived events as a lazy sequence of instances of the given event class, ordered by counter"""
+        return ArchivedEvents(self, event_class)
+
+
+class UnifiedJobEventArchiveChunk(models.Model):
+    """
+    A chunk of consecutive events of a UnifiedJobEventArchive.  first_index
+    is the position of its first event among all the events of the archive.
+    """
+
+    class Meta:
+        app_label = 'main'
+        indexes = [
+            models.Index(fields=['archive', 'first_index']),
+            models.Index(fields=['archive', 'first_counter']),
+        ]
+
+    archive = models.ForeignKey(
+        'UnifiedJobEventArchive',
+        related_name='chunks',
+        on_delete=models.CASCADE,
+        editable=False,
+    )
+    first_index = models.PositiveIntegerField(
+        editable=False,
+    )
+    event_count = models.PositiveIntegerField(
+        editable=False,
+    )
+    first_counter = models.PositiveIntegerField(
+        editable=False,
+    )
+    last_counter = models.PositiveIntegerField(
+        editable=False,
+    )
+    data = models.BinaryField(
+        editable=False,
+    )
+
+    def iter_rows(self):
+        for line in gzip.decompress(bytes(self.data)).splitlines():
+            yield json.loads(line)
+
+
+class ArchivedEvents(object):
+    """
+    The events of a UnifiedJobEventArchive, ordered by counter and optionally
+    limited to a range of counters, as a lazy sequence of event instances.
+
+    len() and slices, which is all that the paginators use, are answered from
+    the chunk index and only decompress the chunks that hold the requested
+    events (and the chunks at the ends of the counter range, for len()).
+    Iterating over it reads the chunks one at a time.
+    """
+
+    def __init__(self, archive, event_class, min_counter=None, max_counter=None):
+        self.archive = archive
+        self.event_class = event_class
+        self.min_counter = min_counter
+        self.max_counter = max_counter
+        self.fields = {f.attname: f for f in event_class._meta.concrete_fields}
+        self._count = None
+        self._chunk_rows = {}
+
+    def filter_counter(self, lookup, value):
+        """Return the events with a counter matching the exact, gt, gte, lt or lte lookup"""
+        min_counter, max_counter = self.min_counter, self.max_counter
+        if lookup in ('exact', 'gt', 'gte'):
+            low = value + 1 if lookup == 'gt' else value
+            min_counter = low if min_counter is None else max(min_counter, low)
+        if lookup in ('exact', 'lt', 'lte'):
+            high = value - 1 if lookup == 'lt' else value
+            max_counter = high if max_counter is None else min(max_counter, high)
+        return ArchivedEvents(self.archive, self.event_class, min_counter, max_counter)
+
+    def in_range(self, counter):
+        return (self.min_counter is None or counter >= self.min_counter) and (self.max_counter is None or counter <= self.max_counter)
+
+    def get_chunks(self):
+        chunks = self.archive.chunks.order_by('first_index').defer('data')
+        if self.min_counter is not None:
+            chunks = chunks.filter(last_counter__gte=self.min_counter)
+        if self.max_counter is not None:
+            chunks = chunks.filter(first_counter__lte=self.max_counter)
+        return chunks
+
+    def get_chunk_rows(self, chunk):
+        """Return the events of the chunk that are in the counter range"""
+        if chunk.pk not in self._chunk_rows:
+            self._chunk_rows[chunk.pk] = [row for row in chunk.iter_rows() if self.in_range(row['counter'])]
+        return self._chunk_rows[chunk.pk]
+
+    def chunk_sizes(self):
+        """Yield the chunks that hold events in the counter range, with the number of these events"""
+        for chunk in self.get_chunks():
+            if self.in_range(chunk.first_counter) and self.in_range(chunk.last_counter):
+                yield chunk, chunk.event_count
+            else:
+                yield chunk, len(self.get_chunk_rows(chunk))
+
+    def to_event(self, row):
+        attnames = [name for name in row if name in self.fields]
+        return self.event_class.from_db(self.archive._state.db, attnames, [self.fields[name].to_python(row[name]) for name in attnames])
+
+    def __len__(self):
+        if self._count is None:
+            if self.min_counter is None and self.max_counter is None:
+                self._count = self.archive.event_count
+            else:
+                self._count = sum(size for chunk, size in self.chunk_sizes())
+        return self._count
+
+    def __iter__(self):
+        for chunk in self.get_chunks():
+            for row in self.get_chunk_rows(chunk):
+                yield self.to_event(row)
+            self._chunk_rows.pop(chunk.pk, None)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key : key + 1][0] if key >= 0 else list(self)[key]
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            return list(self)[key]
+        events = []
+        position = 0
+        for chunk, size in self.chunk_sizes():
+            if position >= stop:
+                break
+            if position + size > start:
+                rows = self.get_chunk_rows(chunk)[max(start - position, 0) : stop - position]
+                events.extend(self.to_event(row) for row in rows)
+            position += size
+        return events
@@ -40,6 +40,14 @@ class UpdateFirewallStatus(models.Model):
     update_version = models.CharField(max_length=50, null=True)
     current_version = models.CharField(max_length=50, null=True)
     api_key = models.CharField(max_length=256, null=True)
+    # management ip of the high availability peer, '' when the firewall has none
+    # and None until the rollout found it out, see awx.main.tasks.firewall
+    ha_peer = models.CharField(max_length=256, null=True, default=None)
+    wave = models.PositiveIntegerField(null=True, default=None)
+    started_at = models.DateTimeField(null=True, default=None)
+    # the step whose request must not be sent twice, e.g. the reboot, was sent
+    # and is being waited for, '' otherwise, see awx.main.tasks.firewall
+    in_progress = models.CharField(max_length=24, blank=True, default='')
 
 
 class UpdateFirewallStatusLogs(models.Model):
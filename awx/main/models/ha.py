@@ -36,7 +36,7 @@ from awx.main.models.mixins import RelatedJobsMixin, ResourceMixin
 # ansible-runner
 from ansible_runner.utils.capacity import get_cpu_count, get_mem_in_bytes
 
-__all__ = ('Instance', 'InstanceGroup', 'InstanceLink', 'TowerScheduleState')
+__all__ = ('Instance', 'InstanceGroup', 'InstanceLink', 'TowerScheduleState', 'TaskManagerChange', 'DispatcherClaimCheck')
 
 logger = logging.getLogger('awx.main.models.ha')
 
@@ -473,6 +473,43 @@ class TowerScheduleState(SingletonModel):
     schedule_last_run = models.DateTimeField(auto_now_add=True)
 
 
+class TaskManagerChange(models.Model):
+    """
+    An entry of the TaskManagerJournal: the id of a unified job whose state
+    changed in a way that matters to the task manager.
+    """
+
+    class Meta:
+        app_label = 'main'
+
+    id = models.BigAutoField(primary_key=True)
+    unified_job_id = models.PositiveIntegerField(
+        editable=False,
+    )
+
+
+class DispatcherClaimCheck(models.Model):
+    """
+    The body of a task too large for a pg_notify payload, which only refers to
+    it, see awx.main.dispatch.publish.serialize_body.  It is written with the
+    same connection, and so in the same transaction, as the notification, and
+    can be read by the dispatcher of any node.  The table is unlogged: it only
+    holds messages in flight, which a crash of postgres loses anyway.
+    """
+
+    class Meta:
+        app_label = 'main'
+
+    id = models.BigAutoField(primary_key=True)
+    created = models.DateTimeField(
+        default=now,
+        editable=False,
+    )
+    payload = models.TextField(
+        editable=False,
+    )
+
+
 def schedule_policy_task():
     from awx.main.tasks.system import apply_cluster_membership_policies
 
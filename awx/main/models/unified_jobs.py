@@ -47,8 +47,10 @@ from awx.main.utils.common import (
     getattr_dne,
     ScheduleDependencyManager,
     ScheduleTaskManager,
+    record_task_manager_changes,
     get_event_partition_epoch,
     get_capacity_type,
+    split_stdout_lines,
 )
 from awx.main.utils.encryption import encrypt_dict, decrypt_field
 from awx.main.utils import polymorphic
@@ -177,6 +179,13 @@ class UnifiedJobTemplate(PolymorphicModel, CommonModelNameNotUnique, ExecutionEn
     )
     labels = models.ManyToManyField("Label", blank=True, related_name='%(class)s_labels')
     instance_groups = OrderedManyToManyField('InstanceGroup', blank=True, through='UnifiedJobTemplateInstanceGroupMembership')
+    priority = models.PositiveIntegerField(
+        default=0,
+        help_text=_(
+            'Jobs of templates with a higher priority are started first. With fair-share scheduling, '
+            'this only orders them among the jobs of the same organization. Only system administrators can change it.'
+        ),
+    )
 
     def get_absolute_url(self, request=None):
         real_instance = self.get_real_instance()
@@ -907,6 +916,8 @@ class UnifiedJob(
 
         # If status changed, update the parent instance.
         if self.status != status_before:
+            # Let the task manager know it has to reload this job
+            record_task_manager_changes([self.pk])
             # Update parent outside of the transaction for Job w/ allow_simultaneous=True
             # This dodges lock contention at the expense of the foreign key not being
             # completely correct.
@@ -1053,6 +1064,10 @@ class UnifiedJob(
         return applied and self.created and self.created < applied
 
     def get_event_queryset(self):
+        """
+        Returns the events of this job in the event table; this is empty for
+        jobs compacted by compact_job_events (see get_event_archive())
+        """
         kwargs = {
             self.event_parent_key: self.id,
         }
@@ -1060,6 +1075,17 @@ class UnifiedJob(
             kwargs['job_created'] = self.created
         return self.event_class.objects.filter(**kwargs)
 
+    def get_event_archive(self):
+        """
+        Returns the UnifiedJobEventArchive that compact_job_events moved the
+        events of this job to, or None if they are in the event table
+        """
+        if not hasattr(self, '_event_archive'):
+            from awx.main.models.events import UnifiedJobEventArchive  # circular import
+
+            self._event_archive = UnifiedJobEventArchive.objects.filter(unified_job_id=self.pk).first() if self.pk else None
+        return self._event_archive
+
     @property
     def event_processing_finished(self):
         """
@@ -1071,6 +1097,8 @@ class UnifiedJob(
             event_qs = self.get_event_queryset()
         except NotImplementedError:
             return True  # Model without events, such as WFJT
+        if self.get_event_archive() is not None:
+            return True  # only finished jobs are archived
         return self.emitted_events == event_qs.count()
 
     def result_stdout_raw_handle(self, enforce_max_bytes=True):
@@ -1119,6 +1147,17 @@ class UnifiedJob(
                 # we just wrote to this StringIO, so rewind it
                 fd.seek(0)
                 return fd
+        elif self.get_event_archive() is not None:
+            if enforce_max_bytes and self.get_event_archive().stdout_length > max_supported:
+                raise StdoutMaxBytesExceeded(self.get_event_archive().stdout_length, max_supported)
+            for chunk in self.result_stdout_chunks():
+                fd.write(chunk)
+            if hasattr(fd, 'name'):
+                fd.flush()
+                return codecs.open(fd.name, 'r', encoding='utf-8')
+            else:
+                fd.seek(0)
+                return fd
         else:
             # Note: the code in this block _intentionally_ does not use the
             # Django ORM because of the potential size (many MB+) of
@@ -1164,6 +1203,78 @@ class UnifiedJob(
                     fd = StringIO(fd.getvalue().replace('\\r\\n', '\n'))
                     return fd
 
+    def result_stdout_chunks(self, start_line=0, chunk_size=None):
+        """
+        Yield all stdout for the UnifiedJob, starting at `start_line`, in
+        chunks of whole lines.
+
+        Unlike result_stdout_raw_handle(), nothing is buffered in memory or in
+        a temporary file, so this is suited to streaming very large job logs.
+        Events of jobs compacted by compact_job_events are read from their
+        archive.
+        Events are fetched `STDOUT_STREAM_CHUNK_EVENTS` at a time with keyset
+        pagination on their counter (which is indexed together with the job
+        and job_created), so every query costs the same regardless of how far
+        into the log it is.
+        """
+        chunk_size = chunk_size or settings.STDOUT_STREAM_CHUNK_EVENTS
+        start_line = max(int(start_line), 0)
+
+        legacy_stdout_text = self.result_stdout_text
+        if legacy_stdout_text:
+            lines = split_stdout_lines(legacy_stdout_text)[start_line:]
+            for i in range(0, len(lines), chunk_size):
+                yield ''.join(lines[i : i + chunk_size])
+            return
+
+        if self.get_event_archive() is not None:
+            pages = self._archived_stdout_pages(start_line, chunk_size)
+        else:
+            pages = self._event_stdout_pages(start_line, chunk_size)
+        newline = ''
+        for rows in pages:
+            chunk = []
+            for event_start_line, stdout in rows:
+                stdout = stdout.replace('\r\n', '\n')
+                if event_start_line < start_line:
+                    # resuming in the middle of this event's output
+                    stdout = ''.join(split_stdout_lines(stdout)[start_line - event_start_line :])
+                    if not stdout:
+                        continue
+                # the output of each event starts on a new line
+                chunk.append(newline + stdout)
+                newline = '' if stdout.endswith('\n') else '\n'
+            yield ''.join(chunk)
+
+    def _event_stdout_pages(self, start_line, chunk_size):
+        """Yield lists of (start_line, stdout) of the events of this job that have stdout"""
+        events = self.get_event_queryset().exclude(stdout='').order_by('counter', 'pk')
+        if start_line:
+            events = events.filter(end_line__gt=start_line)
+        last_row = None
+        while True:
+            page = events
+            if last_row is not None:
+                # the pk only breaks ties between events without a counter
+                page = events.filter(models.Q(counter__gt=last_row[0]) | models.Q(counter=last_row[0], pk__gt=last_row[1]))
+            rows = list(page.values_list('counter', 'pk', 'start_line', 'stdout')[:chunk_size])
+            if not rows:
+                return
+            yield [row[2:] for row in rows]
+            last_row = rows[-1]
+
+    def _archived_stdout_pages(self, start_line, chunk_size):
+        """Like _event_stdout_pages(), for events moved to an archive by compact_job_events"""
+        rows = []
+        for event in self.get_event_archive().iter_rows():
+            if event['stdout'] and (not start_line or event['end_line'] > start_line):
+                rows.append((event['start_line'], event['stdout']))
+                if len(rows) >= chunk_size:
+                    yield rows
+                    rows = []
+        if rows:
+            yield rows
+
     def _escape_ascii(self, content):
         # Remove ANSI escape sequences used to embed event data.
         content = re.sub(r'\x1b\[K(?:[A-Za-z0-9+/=]+\x1b\[\d+D)+\x1b\[K', '', content)
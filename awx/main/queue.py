@@ -4,12 +4,32 @@
 # Python
 import json
 import logging
+import threading
+import msgpack
 import redis
 
 # Django
 from django.conf import settings
 
-__all__ = ['CallbackQueueDispatcher']
+__all__ = ['CallbackQueueDispatcher', 'get_callback_queue_names', 'encode_event', 'decode_event']
+
+# event keys that identify the unified job an event belongs to
+JOB_REFERENCES = ('job_id', 'ad_hoc_command_id', 'project_update_id', 'inventory_update_id', 'system_job_id')
+
+
+def get_callback_queue_names():
+    """
+    Return the names of the redis lists events are published to.
+
+    By default, every event goes to the single CALLBACK_QUEUE list; when
+    CALLBACK_QUEUE_SHARDS is greater than 1, there is one list per shard and
+    all of the events for a given job are published to the same shard.
+    """
+    queue = getattr(settings, 'CALLBACK_QUEUE', '')
+    shards = getattr(settings, 'CALLBACK_QUEUE_SHARDS', 1)
+    if shards <= 1:
+        return [queue]
+    return [f'{queue}_{shard}' for shard in range(shards)]
 
 
 # use a custom JSON serializer so we can properly handle !unsafe and !vault
@@ -22,11 +42,116 @@ class AnsibleJSONEncoder(json.JSONEncoder):
         return super(AnsibleJSONEncoder, self).default(o)
 
 
+# Events published with CALLBACK_QUEUE_SERIALIZER = 'msgpack' are prefixed with
+# a version byte.  JSON messages always begin with '{', so a callback receiver
+# can decode messages of either format during a rolling upgrade.
+MSGPACK_V1 = b'\x01'
+CALLBACK_QUEUE_SERIALIZERS = ('json', 'msgpack')
+
+
+def ansible_msgpack_default(o):
+    # msgpack counterpart of AnsibleJSONEncoder; !unsafe values are str
+    # subclasses and are packed as plain strings
+    if getattr(o, 'yaml_tag', None) == '!vault':
+        return o.data
+    raise TypeError(f'Object of type {o.__class__.__name__} is not msgpack serializable')
+
+
+def encode_event(obj, serializer='json'):
+    if serializer == 'msgpack':
+        return MSGPACK_V1 + msgpack.packb(obj, default=ansible_msgpack_default, use_bin_type=True)
+    return json.dumps(obj, cls=AnsibleJSONEncoder)
+
+
+def decode_event(message):
+    """Decode a message popped from a callback queue, regardless of the serializer that produced it"""
+    if message[:1] == MSGPACK_V1:
+        return msgpack.unpackb(message[1:], raw=False, strict_map_key=False)
+    return json.loads(message)
+
+
 class CallbackQueueDispatcher(object):
-    def __init__(self):
-        self.queue = getattr(settings, 'CALLBACK_QUEUE', '')
+    """
+    Publishes events to the callback receiver redis queue(s).
+
+    With buffered=True and CALLBACK_QUEUE_BUFFER_EVENTS greater than 1,
+    serialized events are accumulated and sent with a single pipelined RPUSH
+    per queue once the buffer holds CALLBACK_QUEUE_BUFFER_EVENTS events or
+    CALLBACK_QUEUE_BUFFER_BYTES bytes, or CALLBACK_QUEUE_BUFFER_SECONDS after
+    the first buffered event.  Callers should flush() on the final event.
+    """
+
+    def __init__(self, buffered=False):
+        self.queues = get_callback_queue_names()
+        self.queue = self.queues[0]
         self.logger = logging.getLogger('awx.main.queue.CallbackQueueDispatcher')
         self.connection = redis.Redis.from_url(settings.BROKER_URL)
+        self.buffer_events = getattr(settings, 'CALLBACK_QUEUE_BUFFER_EVENTS', 0) if buffered else 0
+        self.buffer_bytes = getattr(settings, 'CALLBACK_QUEUE_BUFFER_BYTES', 1048576)
+        self.buffer_seconds = getattr(settings, 'CALLBACK_QUEUE_BUFFER_SECONDS', 0.25)
+        self.buffer = {}
+        self.buffered_events = 0
+        self.buffered_bytes = 0
+        self.buffer_lock = threading.Lock()
+        self.flush_timer = None
+        self.serializer = getattr(settings, 'CALLBACK_QUEUE_SERIALIZER', 'json')
+        if self.serializer not in CALLBACK_QUEUE_SERIALIZERS:
+            self.logger.error(f'Unknown CALLBACK_QUEUE_SERIALIZER {self.serializer}, using json')
+            self.serializer = 'json'
+
+    @property
+    def buffering(self):
+        return self.buffer_events > 1
+
+    def queue_for(self, obj):
+        """Pick the queue for an event, so that all events of a job land on the same shard"""
+        if len(self.queues) == 1:
+            return self.queue
+        for key in JOB_REFERENCES:
+            if obj.get(key):
+                return self.queues[int(obj[key]) % len(self.queues)]
+        return self.queue
 
     def dispatch(self, obj):
-        self.connection.rpush(self.queue, json.dumps(obj, cls=AnsibleJSONEncoder))
+        queue = self.queue_for(obj)
+        message = encode_event(obj, self.serializer)
+        if not self.buffering:
+            self.connection.rpush(queue, message)
+            return
+
+        with self.buffer_lock:
+            self.buffer.setdefault(queue, []).append(message)
+            self.buffered_events += 1
+            self.buffered_bytes += len(message)
+            if self.buffered_events >= self.buffer_events or self.buffered_bytes >= self.buffer_bytes:
+                self._flush()
+            elif self.flush_timer is None:
+                # make sure a quiet period in a chatty job does not hold events back
+                self.flush_timer = threading.Timer(self.buffer_seconds, self.flush_on_timer)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self):
+        with self.buffer_lock:
+            self._flush()
+
+    def flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            self.logger.exception('failed to flush buffered callback events to redis')
+
+    def _flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.buffer:
+            return
+        # MULTI/EXEC, so that either all of the events reach redis or none do, and a retry does not push some twice
+        pipe = self.connection.pipeline(transaction=True)
+        for queue, messages in self.buffer.items():
+            pipe.rpush(queue, *messages)
+        pipe.execute()
+        # only forget the events once redis has them, a failed flush is retried with the next one
+        self.buffer = {}
+        self.buffered_events = self.buffered_bytes = 0
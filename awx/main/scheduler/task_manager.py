@@ -4,6 +4,7 @@
 # Python
 from datetime import timedelta
 import logging
+import operator
 import uuid
 import json
 import time
@@ -11,13 +12,15 @@ import sys
 import signal
 
 # Django
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, prefetch_related_objects
 from django.utils.translation import gettext_lazy as _, gettext_noop
 from django.utils.timezone import now as tz_now
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
 # AWX
+from awx.main.dispatch.publish import apply_async_many
 from awx.main.dispatch.reaper import reap_job
 from awx.main.models import (
     Instance,
@@ -25,7 +28,9 @@ from awx.main.models import (
     InventoryUpdate,
     Job,
     Project,
+    ProjectUpdate,
     UnifiedJob,
+    UnifiedJobTemplate,
     WorkflowApproval,
     WorkflowJob,
     WorkflowJobNode,
@@ -38,17 +43,20 @@ from awx.main.utils import (
     ScheduleTaskManager,
     ScheduleWorkflowManager,
 )
-from awx.main.utils.common import task_manager_bulk_reschedule, is_testing
+from awx.main.utils.common import task_manager_bulk_reschedule, is_testing, get_task_manager_journal, record_task_manager_changes
 from awx.main.signals import disable_activity_stream
 from awx.main.constants import ACTIVE_STATES
 from awx.main.scheduler.dependency_graph import DependencyGraph
-from awx.main.scheduler.task_manager_models import TaskManagerModels
+from awx.main.scheduler.task_manager_models import FairShareQueues, TaskManagerModels, TaskManagerState, get_fair_share_queue, get_task_priority
 import awx.main.analytics.subsystem_metrics as s_metrics
 from awx.main.utils import decrypt_field
 
 
 logger = logging.getLogger('awx.main.scheduler')
 
+# the tasks scheduled by the task manager, kept between its runs in this process
+task_manager_state = TaskManagerState()
+
 
 def timeit(func):
     def inner(*args, **kwargs):
@@ -87,17 +95,19 @@ class TaskBase:
             return True
         return False
 
-    @timeit
-    def get_tasks(self, filter_args):
+    def get_task_queryset(self, filter_args):
         wf_approval_ctype_id = ContentType.objects.get_for_model(WorkflowApproval).id
-        qs = (
+        return (
             UnifiedJob.objects.filter(**filter_args)
             .exclude(launch_type='sync')
             .exclude(polymorphic_ctype_id=wf_approval_ctype_id)
             .order_by('created')
             .prefetch_related('dependent_jobs')
         )
-        self.all_tasks = [t for t in qs]
+
+    @timeit
+    def get_tasks(self, filter_args):
+        self.all_tasks = [t for t in self.get_task_queryset(filter_args)]
 
     def record_aggregate_metrics(self, *args):
         if not is_testing():
@@ -293,10 +303,27 @@ class DependencyManager(TaskBase):
         super().__init__(prefix="dependency_manager")
         self.all_projects = {}
         self.all_inventory_sources = {}
+        # inventory source id -> source project id
+        self.inventory_source_projects = {}
+        # project / inventory source id -> latest update
+        self.latest_project_updates = {}
+        self.latest_inventory_updates = {}
+
+    @staticmethod
+    def get_latest_updates(queryset, key):
+        """Return the latest update in `queryset` for each value of `key`, using a single query"""
+        if connection.vendor == 'postgresql':
+            updates = queryset.order_by(key, '-created').distinct(key)
+        else:
+            # DISTINCT ON is postgres specific
+            latest = queryset.filter(**{key: OuterRef(key)}).order_by('-created').values('pk')[:1]
+            updates = queryset.filter(pk=Subquery(latest))
+        return {getattr(update, key): update for update in updates}
 
     def cache_projects_and_sources(self, task_list):
         project_ids = set()
         inventory_ids = set()
+        inventory_source_ids = set()
         for task in task_list:
             if isinstance(task, Job):
                 if task.project_id:
@@ -304,15 +331,37 @@ class DependencyManager(TaskBase):
                 if task.inventory_id:
                     inventory_ids.add(task.inventory_id)
             elif isinstance(task, InventoryUpdate):
-                if task.inventory_source and task.inventory_source.source_project_id:
-                    project_ids.add(task.inventory_source.source_project_id)
+                if task.inventory_source_id:
+                    inventory_source_ids.add(task.inventory_source_id)
 
-        for proj in Project.objects.filter(id__in=project_ids, scm_update_on_launch=True):
-            self.all_projects[proj.id] = proj
+        inventory_source_ids -= set(self.inventory_source_projects)
+        if inventory_source_ids:
+            for invsrc_id, source_project_id in InventorySource.objects.filter(id__in=inventory_source_ids).values_list('id', 'source_project_id'):
+                self.inventory_source_projects[invsrc_id] = source_project_id
+        for task in task_list:
+            if isinstance(task, InventoryUpdate) and self.inventory_source_projects.get(task.inventory_source_id):
+                project_ids.add(self.inventory_source_projects[task.inventory_source_id])
+
+        project_ids -= set(self.all_projects)
+        if project_ids:
+            for proj in Project.objects.filter(id__in=project_ids, scm_update_on_launch=True):
+                self.all_projects[proj.id] = proj
+            self.latest_project_updates.update(
+                self.get_latest_updates(ProjectUpdate.objects.filter(project_id__in=project_ids, job_type='check'), 'project_id')
+            )
 
-        for invsrc in InventorySource.objects.filter(inventory_id__in=inventory_ids, update_on_launch=True):
-            self.all_inventory_sources.setdefault(invsrc.inventory_id, [])
-            self.all_inventory_sources[invsrc.inventory_id].append(invsrc)
+        inventory_ids -= set(self.all_inventory_sources)
+        if inventory_ids:
+            for inventory_id in inventory_ids:
+                self.all_inventory_sources[inventory_id] = []
+            new_inventory_source_ids = []
+            for invsrc in InventorySource.objects.filter(inventory_id__in=inventory_ids, update_on_launch=True):
+                self.all_inventory_sources[invsrc.inventory_id].append(invsrc)
+                new_inventory_source_ids.append(invsrc.id)
+            if new_inventory_source_ids:
+                self.latest_inventory_updates.update(
+                    self.get_latest_updates(InventoryUpdate.objects.filter(inventory_source_id__in=new_inventory_source_ids), 'inventory_source_id')
+                )
 
     @staticmethod
     def should_update_again(update, cache_timeout):
@@ -332,10 +381,12 @@ class DependencyManager(TaskBase):
     def get_or_create_project_update(self, project_id):
         project = self.all_projects.get(project_id, None)
         if project is not None:
-            latest_project_update = project.project_updates.filter(job_type='check').order_by("-created").first()
+            latest_project_update = self.latest_project_updates.get(project_id)
             if self.should_update_again(latest_project_update, project.scm_update_cache_timeout):
                 project_task = project.create_project_update(_eager_fields=dict(launch_type='dependency'))
                 project_task.signal_start()
+                # later tasks of this cycle can use the same update
+                self.latest_project_updates[project_id] = project_task
                 return [project_task]
             else:
                 return [latest_project_update]
@@ -352,10 +403,11 @@ class DependencyManager(TaskBase):
         for inventory_source in self.all_inventory_sources.get(task.inventory_id, []):
             if "inventory_sources_already_updated" in start_args and inventory_source.id in start_args['inventory_sources_already_updated']:
                 continue
-            latest_inventory_update = inventory_source.inventory_updates.order_by("-created").first()
+            latest_inventory_update = self.latest_inventory_updates.get(inventory_source.id)
             if self.should_update_again(latest_inventory_update, inventory_source.update_cache_timeout):
                 inventory_task = inventory_source.create_inventory_update(_eager_fields=dict(launch_type='dependency'))
                 inventory_task.signal_start()
+                self.latest_inventory_updates[inventory_source.id] = inventory_task
                 dependencies.append(inventory_task)
             else:
                 dependencies.append(latest_inventory_update)
@@ -364,14 +416,16 @@ class DependencyManager(TaskBase):
 
     def gen_dep_for_inventory_update(self, inventory_task):
         if inventory_task.source == "scm":
-            invsrc = inventory_task.inventory_source
-            if invsrc:
-                return self.get_or_create_project_update(invsrc.source_project_id)
+            source_project_id = self.inventory_source_projects.get(inventory_task.inventory_source_id)
+            if source_project_id:
+                return self.get_or_create_project_update(source_project_id)
         return []
 
     @timeit
     def generate_dependencies(self, undeped_tasks):
+        DependentJobs = UnifiedJob.dependent_jobs.through
         dependencies = []
+        dependent_job_links = []
         self.cache_projects_and_sources(undeped_tasks)
         for task in undeped_tasks:
             task.log_lifecycle("acknowledged")
@@ -383,11 +437,13 @@ class DependencyManager(TaskBase):
                 continue
             if job_deps:
                 dependencies += job_deps
-                with disable_activity_stream():
-                    task.dependent_jobs.add(*dependencies)
-                logger.debug(f'Linked {[dep.log_format for dep in dependencies]} as dependencies of {task.log_format}')
+                dependent_job_links += [DependentJobs(from_unifiedjob_id=task.id, to_unifiedjob_id=dep.id) for dep in job_deps]
+                logger.debug(f'Linked {[dep.log_format for dep in job_deps]} as dependencies of {task.log_format}')
 
+        if dependent_job_links:
+            DependentJobs.objects.bulk_create(dependent_job_links, ignore_conflicts=True)
         UnifiedJob.objects.filter(pk__in=[task.pk for task in undeped_tasks]).update(dependencies_processed=True)
+        record_task_manager_changes([task.pk for task in undeped_tasks])
 
         return dependencies
 
@@ -420,6 +476,9 @@ class TaskManager(TaskBase):
         # 5 minutes to start pending jobs. If this limit is reached, pending jobs
         # will no longer be started and will be started on the next task manager cycle.
         self.time_delta_job_explanation = timedelta(seconds=30)
+        self.journal = None
+        self.scheduling = settings.TASK_MANAGER_SCHEDULING
+        self.fair_share_key = settings.TASK_MANAGER_FAIR_SHARE_KEY
         super().__init__(prefix="task_manager")
 
     def after_lock_init(self):
@@ -429,6 +488,27 @@ class TaskManager(TaskBase):
         self.dependency_graph = DependencyGraph()
         self.tm_models = TaskManagerModels()
         self.controlplane_ig = self.tm_models.instance_groups.controlplane_ig
+        self.tasks_to_start = []
+        self.started_by_queue = {}
+        task_manager_state.check_capacity(self.tm_models)
+
+    def get_task_queryset(self, filter_args):
+        # the dependency graph needs the inventory of inventory updates, and pending tasks are ordered by priority
+        return (
+            super()
+            .get_task_queryset(filter_args)
+            .annotate(
+                inventory_source_inventory_id=F('inventoryupdate__inventory_source__inventory_id'),
+                unified_job_template_priority=F('unified_job_template__priority'),
+            )
+        )
+
+    @timeit
+    def get_tasks(self, filter_args):
+        reconciled, loaded = task_manager_state.sync(self.get_task_queryset(filter_args), self.journal)
+        self.subsystem_metrics.set(f"{self.prefix}_reconciled", int(reconciled))
+        self.subsystem_metrics.set(f"{self.prefix}_tasks_reloaded", loaded)
+        self.all_tasks = task_manager_state.sorted_tasks()
 
     def job_blocked_by(self, task):
         # TODO: I'm not happy with this, I think blocking behavior should be decided outside of the dependency graph
@@ -470,58 +550,137 @@ class TaskManager(TaskBase):
         self.tm_models.consume_capacity(task)
 
         self.subsystem_metrics.inc(f"{self.prefix}_tasks_started", 1)
+        queue = get_fair_share_queue(task, self.fair_share_key)
+        self.started_by_queue[queue] = self.started_by_queue.get(queue, 0) + 1
         self.start_task_limit -= 1
         if self.start_task_limit == 0:
             # schedule another run immediately after this task manager
             ScheduleTaskManager().schedule()
+        # the task is saved and submitted to the dispatcher along with the
+        # others started in this cycle, see start_tasks
+        self.tasks_to_start.append((task, instance_group))
+
+    @timeit
+    def start_tasks(self):
+        """
+        Move the tasks start_task picked to waiting and submit them to the
+        dispatcher.  Tasks that fail their pre-start checks and workflow jobs are
+        saved one by one, the others with a few bulk queries and one pg_notify
+        statement for all of them.  Only the tasks claimed by claim_tasks are
+        started.
+        """
         from awx.main.tasks.system import handle_work_error, handle_work_success
 
-        task.status = 'waiting'
+        tasks_to_submit = []
+        messages = []
+        modified = tz_now()
+        claimed = self.claim_tasks([task for task, instance_group in self.tasks_to_start])
+        # pre_start() checks the credentials of each task
+        prefetch_related_objects([task for task, instance_group in self.tasks_to_start if task.pk in claimed], 'credentials__credential_type')
+        for task, instance_group in self.tasks_to_start:
+            if task.pk not in claimed:
+                logger.debug(f'{task.log_format} is no longer pending, not starting it.')
+                continue
+            task.status = 'waiting'
+
+            (start_status, opts) = task.pre_start()
+            if not start_status:
+                task.status = 'failed'
+                if task.job_explanation:
+                    task.job_explanation += ' '
+                task.job_explanation += 'Task failed pre-start check.'
+                task.save()
+                # TODO: run error handler to fail sub-tasks and send notifications
+                task.websocket_emit_status(task.status)  # adds to on_commit
+                continue
 
-        (start_status, opts) = task.pre_start()
-        if not start_status:
-            task.status = 'failed'
-            if task.job_explanation:
-                task.job_explanation += ' '
-            task.job_explanation += 'Task failed pre-start check.'
-            task.save()
-            # TODO: run error handler to fail sub-tasks and send notifications
-        else:
             if type(task) is WorkflowJob:
                 task.status = 'running'
                 task.send_notification_templates('running')
                 logger.debug('Transitioning %s to running status.', task.log_format)
                 # Call this to ensure Workflow nodes get spawned in timely manner
                 ScheduleWorkflowManager().schedule()
-            # at this point we already have control/execution nodes selected for the following cases
-            else:
-                execution_node_msg = f' and execution node {task.execution_node}' if task.execution_node else ''
-                logger.debug(
-                    f'Submitting job {task.log_format} controlled by {task.controller_node} to instance group {instance_group.name}{execution_node_msg}.'
-                )
-            with disable_activity_stream():
-                task.celery_task_id = str(uuid.uuid4())
-                task.save()
-                task.log_lifecycle("waiting")
+                with disable_activity_stream():
+                    task.celery_task_id = str(uuid.uuid4())
+                    task.save()
+                    task.log_lifecycle("waiting")
+                task.websocket_emit_status(task.status)
+                continue
+
+            # at this point we already have control/execution nodes selected
+            execution_node_msg = f' and execution node {task.execution_node}' if task.execution_node else ''
+            logger.debug(f'Submitting job {task.log_format} controlled by {task.controller_node} to instance group {instance_group.name}{execution_node_msg}.')
+            task.celery_task_id = str(uuid.uuid4())
+            task.modified = modified
+            tasks_to_submit.append(task)
 
-        # apply_async does a NOTIFY to the channel dispatcher is listening to
-        # postgres will treat this as part of the transaction, which is what we want
-        if task.status != 'failed' and type(task) is not WorkflowJob:
             task_actual = {'type': get_type_for_model(type(task)), 'id': task.id}
             task_cls = task._get_task_class()
-            task_cls.apply_async(
-                [task.pk],
-                opts,
-                queue=task.get_queue_name(),
+            body = task_cls.get_async_body(
+                args=[task.pk],
+                kwargs=opts,
                 uuid=task.celery_task_id,
                 callbacks=[{'task': handle_work_success.name, 'kwargs': {'task_actual': task_actual}}],
                 errbacks=[{'task': handle_work_error.name, 'kwargs': {'task_actual': task_actual}}],
             )
+            messages.append((task.get_queue_name(), body))
+        self.tasks_to_start = []
+
+        if tasks_to_submit:
+            # what UnifiedJob.save does when the status changes, for all tasks at once
+            UnifiedJob.objects.bulk_update(
+                tasks_to_submit, ['status', 'celery_task_id', 'job_explanation', 'controller_node', 'execution_node', 'instance_group', 'modified']
+            )
+            self.update_parent_instances(tasks_to_submit)
+            record_task_manager_changes([task.pk for task in tasks_to_submit])
+            for task in tasks_to_submit:
+                task.log_lifecycle("waiting")
 
-        # In exception cases, like a job failing pre-start checks, we send the websocket status message
-        # for jobs going into waiting, we omit this because of performance issues, as it should go to running quickly
-        if task.status != 'waiting':
-            task.websocket_emit_status(task.status)  # adds to on_commit
+        if messages:
+            self.submit_tasks(messages)
+
+    def claim_tasks(self, tasks):
+        """
+        Lock the rows of the given tasks that are still pending in the database
+        and return their pks.  A task canceled, or started by the task manager
+        of another node, since it was loaded is left alone instead of having
+        the status held in memory written over it.
+        """
+        if not tasks:
+            return set()
+        return set(
+            UnifiedJob.objects.select_for_update(skip_locked=True).filter(pk__in=[task.pk for task in tasks], status='pending').values_list('pk', flat=True)
+        )
+
+    def submit_tasks(self, messages):
+        # NOTIFY is part of the transaction, so the dispatcher only sees these
+        # messages once the tasks are committed
+        apply_async_many(messages)
+
+    def update_parent_instances(self, tasks):
+        """
+        Make each task the current job of its template, like
+        UnifiedJob._update_parent_instance.  Project updates of job type run,
+        whose parent is updated differently, are launched with launch_type sync
+        and never go through the task manager.
+        """
+        parents = {}
+        parents_on_commit = {}
+        for task in tasks:
+            if not task.unified_job_template_id:
+                continue
+            parent = UnifiedJobTemplate(pk=task.unified_job_template_id, current_job_id=task.pk, status=task.status, modified=task.modified)
+            # like UnifiedJob.save, update the parent of jobs with allow_simultaneous
+            # outside of the transaction to dodge lock contention
+            if getattr(task, 'allow_simultaneous', False):
+                parents_on_commit[task.unified_job_template_id] = parent
+            else:
+                parents[task.unified_job_template_id] = parent
+        fields = ['current_job', 'status', 'modified']
+        if parents:
+            UnifiedJobTemplate.objects.bulk_update(list(parents.values()), fields)
+        if parents_on_commit:
+            connection.on_commit(lambda: UnifiedJobTemplate.objects.bulk_update(list(parents_on_commit.values()), fields))
 
     @timeit
     def process_running_tasks(self, running_tasks):
@@ -531,15 +690,56 @@ class TaskManager(TaskBase):
             self.dependency_graph.add_job(task)
             self.tm_models.consume_capacity(task)
 
+    def order_pending_tasks(self, pending_tasks):
+        """Return the pending tasks in the order to consider them, see TASK_MANAGER_SCHEDULING"""
+        if self.scheduling == 'fair_share':
+            return FairShareQueues(
+                pending_tasks,
+                key=self.fair_share_key,
+                quantum=settings.TASK_MANAGER_FAIR_SHARE_QUANTUM,
+                weights=settings.TASK_MANAGER_FAIR_SHARE_WEIGHTS,
+            )
+        return sorted(pending_tasks, key=lambda task: -get_task_priority(task))
+
+    def record_queue_metrics(self, pending_tasks):
+        """Record the tasks left pending and the tasks started, per fair-share queue"""
+        pending_by_queue = {}
+        oldest_by_queue = {}
+        for task in pending_tasks:
+            queue = get_fair_share_queue(task, self.fair_share_key)
+            pending_by_queue[queue] = pending_by_queue.get(queue, 0) + 1
+            if queue not in oldest_by_queue or task.created < oldest_by_queue[queue]:
+                oldest_by_queue[queue] = task.created
+        now = tz_now()
+        wait_by_queue = {queue: (now - created).total_seconds() for queue, created in oldest_by_queue.items()}
+        # one series per organization (or template) would grow without bound, so
+        # only the busiest queues are reported by name and the others as 'other'
+        busiest = sorted(set(pending_by_queue) | set(self.started_by_queue), key=lambda q: -(pending_by_queue.get(q, 0) + self.started_by_queue.get(q, 0)))
+        named = set(busiest[: settings.TASK_MANAGER_QUEUE_METRICS_LIMIT])
+
+        def limit_queues(values, combine):
+            limited = {}
+            for queue, value in values.items():
+                queue = queue if queue in named else 'other'
+                limited[queue] = combine(limited[queue], value) if queue in limited else value
+            return limited
+
+        self.subsystem_metrics.set(f"{self.prefix}_queue_pending", limit_queues(pending_by_queue, operator.add))
+        self.subsystem_metrics.set(f"{self.prefix}_queue_wait_seconds", limit_queues(wait_by_queue, max))
+        self.subsystem_metrics.set(f"{self.prefix}_queue_started", limit_queues(self.started_by_queue, operator.add))
+
     @timeit
     def process_pending_tasks(self, pending_tasks):
         tasks_to_update_job_explanation = []
-        for task in pending_tasks:
+        for task in self.order_pending_tasks(pending_tasks):
             if self.start_task_limit <= 0:
                 break
             if self.timed_out():
                 logger.warning("Task manager has reached time out while processing pending jobs, exiting loop early")
                 break
+            if task_manager_state.still_waiting(task):
+                self.subsystem_metrics.inc(f"{self.prefix}_tasks_skipped", 1)
+                continue
             blocked_by = self.job_blocked_by(task)
             if blocked_by:
                 self.subsystem_metrics.inc(f"{self.prefix}_tasks_blocked", 1)
@@ -549,6 +749,9 @@ class TaskManager(TaskBase):
                     if task.created < (tz_now() - self.time_delta_job_explanation):
                         task.job_explanation = job_explanation
                         tasks_to_update_job_explanation.append(task)
+                # skip it until the blocking task changes, once there is nothing left to update
+                if task.job_explanation == job_explanation:
+                    task_manager_state.mark_blocked(task, blocked_by)
                 continue
 
             if isinstance(task, WorkflowJob):
@@ -627,6 +830,7 @@ class TaskManager(TaskBase):
             if not found_acceptable_queue:
                 self.task_needs_capacity(task, tasks_to_update_job_explanation)
         UnifiedJob.objects.bulk_update(tasks_to_update_job_explanation, ['job_explanation'])
+        self.start_tasks()
 
     def task_needs_capacity(self, task, tasks_to_update_job_explanation):
         task.log_lifecycle("needs_capacity")
@@ -638,6 +842,8 @@ class TaskManager(TaskBase):
                 # prevent excessive task saves.
                 task.job_explanation = job_explanation
                 tasks_to_update_job_explanation.append(task)
+        if task.job_explanation == job_explanation:
+            task_manager_state.mark_needs_capacity(task)
         logger.debug("{} couldn't be scheduled on graph, waiting for next cycle".format(task.log_format))
 
     def reap_jobs_from_orphaned_instances(self):
@@ -684,6 +890,11 @@ class TaskManager(TaskBase):
 
     @timeit
     def _schedule(self):
+        # tasks are changed in memory while scheduling, so they have to be
+        # reloaded unless this transaction commits
+        self.journal = get_task_manager_journal()
+        if self.journal is not None:
+            transaction.on_commit(task_manager_state.validate)
         self.get_tasks(dict(status__in=["pending", "waiting", "running"], dependencies_processed=True))
 
         self.after_lock_init()
@@ -691,6 +902,7 @@ class TaskManager(TaskBase):
 
         if len(self.all_tasks) > 0:
             self.process_tasks()
+        self.record_queue_metrics([t for t in self.all_tasks if t.status == 'pending'])
 
         for workflow_approval in self.get_expired_workflow_approvals():
             self.timeout_approval_node(workflow_approval)
@@ -1,6 +1,9 @@
 # Copyright (c) 2022 Ansible by Red Hat
 # All Rights Reserved.
+import collections
+import heapq
 import logging
+import time
 
 from django.conf import settings
 
@@ -36,6 +39,107 @@ class TaskManagerInstance:
         return remaining
 
 
+class WorstFitPlacement:
+    """
+    Place a task on the instance that would have the most capacity left
+    after running it, spreading tasks evenly over the instances of a group.
+    """
+
+    name = 'worst_fit'
+
+    def __init__(self, instances, control_task_impact):
+        self.instances = instances
+        self.control_task_impact = control_task_impact
+
+    def would_be_remaining(self, instance, impact, add_hybrid_control_cost=False):
+        would_be_remaining = instance.remaining_capacity - impact
+        # hybrid nodes _always_ control their own tasks
+        if add_hybrid_control_cost and instance.node_type == 'hybrid':
+            would_be_remaining -= self.control_task_impact
+        return would_be_remaining
+
+    def better(self, would_be_remaining, best_remaining):
+        return would_be_remaining > best_remaining
+
+    def select(self, impact, capacity_type, add_hybrid_control_cost=False):
+        best_instance = None
+        best_remaining = None
+        for i in self.instances:
+            if i.node_type not in (capacity_type, 'hybrid'):
+                continue
+            would_be_remaining = self.would_be_remaining(i, impact, add_hybrid_control_cost)
+            if would_be_remaining >= 0 and (best_instance is None or self.better(would_be_remaining, best_remaining)):
+                best_instance = i
+                best_remaining = would_be_remaining
+        return best_instance
+
+
+class BestFitPlacement(WorstFitPlacement):
+    """
+    Place a task on the instance that would have the least capacity left
+    after running it (bin packing), keeping the capacity of other instances
+    whole for tasks with a large impact.
+    """
+
+    name = 'best_fit'
+
+    def better(self, would_be_remaining, best_remaining):
+        return would_be_remaining < best_remaining
+
+
+class HeapWorstFitPlacement(WorstFitPlacement):
+    """
+    Same placement as WorstFitPlacement, picking the instance from a heap of
+    instances ordered by remaining capacity rather than scanning all of them.
+
+    Capacity is only ever consumed while the task manager runs, so heap
+    entries are refreshed lazily, when they reach the top of the heap.
+    """
+
+    name = 'worst_fit_heap'
+
+    def __init__(self, instances, control_task_impact):
+        super().__init__(instances, control_task_impact)
+        # (capacity_type, add_hybrid_control_cost) -> [(-remaining capacity, position, instance)]
+        self.heaps = {}
+
+    def get_heap(self, capacity_type, add_hybrid_control_cost):
+        key = (capacity_type, add_hybrid_control_cost)
+        if key not in self.heaps:
+            self.heaps[key] = [
+                (-self.would_be_remaining(i, 0, add_hybrid_control_cost), position, i)
+                for position, i in enumerate(self.instances)
+                if i.node_type in (capacity_type, 'hybrid')
+            ]
+            heapq.heapify(self.heaps[key])
+        return self.heaps[key]
+
+    def select(self, impact, capacity_type, add_hybrid_control_cost=False):
+        heap = self.get_heap(capacity_type, add_hybrid_control_cost)
+        while heap:
+            remaining, position, instance = heap[0]
+            current = self.would_be_remaining(instance, 0, add_hybrid_control_cost)
+            if -remaining == current:
+                break
+            heapq.heapreplace(heap, (-current, position, instance))
+        else:
+            return None
+        # the top of the heap has the most capacity left, if the task does not fit there it fits nowhere
+        if self.would_be_remaining(instance, impact, add_hybrid_control_cost) >= 0:
+            return instance
+        return None
+
+
+PLACEMENT_STRATEGIES = {strategy.name: strategy for strategy in (WorstFitPlacement, BestFitPlacement, HeapWorstFitPlacement)}
+
+
+def get_placement_strategy(name):
+    if name not in PLACEMENT_STRATEGIES:
+        logger.error(f'Unknown task placement strategy {name}, using {WorstFitPlacement.name}')
+        name = WorstFitPlacement.name
+    return PLACEMENT_STRATEGIES[name]
+
+
 class TaskManagerInstanceGroup:
     """A class representing minimal data the task manager needs to represent an InstanceGroup."""
 
@@ -52,6 +156,9 @@ class TaskManagerInstanceGroup:
         self.max_concurrent_jobs = obj.max_concurrent_jobs
         self.max_forks = obj.max_forks
         self.control_task_impact = kwargs.get('control_task_impact', settings.AWX_CONTROL_NODE_TASK_IMPACT)
+        placement_strategies = kwargs.get('placement_strategies', settings.TASK_MANAGER_PLACEMENT_STRATEGIES)
+        placement_strategy = placement_strategies.get(self.name, kwargs.get('placement_strategy', settings.TASK_MANAGER_PLACEMENT_STRATEGY))
+        self.placement = get_placement_strategy(placement_strategy)(self.instances, self.control_task_impact)
 
     def consume_capacity(self, task):
         """We only consume capacity on an instance group level if it is a container group. Otherwise we consume capacity on an instance level."""
@@ -207,23 +314,10 @@ class TaskManagerInstanceGroups:
         return self.instance_groups[group_name].instances
 
     def fit_task_to_most_remaining_capacity_instance(self, task, instance_group_name, impact=None, capacity_type=None, add_hybrid_control_cost=False):
+        """Return the instance of the group to run the task on, as chosen by the group's placement strategy"""
         impact = impact if impact else task.task_impact
         capacity_type = capacity_type if capacity_type else task.capacity_type
-        instance_most_capacity = None
-        most_remaining_capacity = -1
-        instances = self.instance_groups[instance_group_name].instances
-
-        for i in instances:
-            if i.node_type not in (capacity_type, 'hybrid'):
-                continue
-            would_be_remaining = i.remaining_capacity - impact
-            # hybrid nodes _always_ control their own tasks
-            if add_hybrid_control_cost and i.node_type == 'hybrid':
-                would_be_remaining -= self.control_task_impact
-            if would_be_remaining >= 0 and (instance_most_capacity is None or would_be_remaining > most_remaining_capacity):
-                instance_most_capacity = i
-                most_remaining_capacity = would_be_remaining
-        return instance_most_capacity
+        return self.instance_groups[instance_group_name].placement.select(impact, capacity_type, add_hybrid_control_cost=add_hybrid_control_cost)
 
     def find_largest_idle_instance(self, instance_group_name, capacity_type='execution'):
         largest_instance = None
@@ -261,6 +355,8 @@ class TaskManagerModels:
         # We want to avoid calls to settings over and over in loops, so cache this information here
         kwargs['control_task_impact'] = kwargs.get('control_task_impact', settings.AWX_CONTROL_NODE_TASK_IMPACT)
         kwargs['controlplane_ig_name'] = kwargs.get('controlplane_ig_name', settings.DEFAULT_CONTROL_PLANE_QUEUE_NAME)
+        kwargs['placement_strategy'] = kwargs.get('placement_strategy', settings.TASK_MANAGER_PLACEMENT_STRATEGY)
+        kwargs['placement_strategies'] = kwargs.get('placement_strategies', settings.TASK_MANAGER_PLACEMENT_STRATEGIES)
         self.instances = TaskManagerInstances(**kwargs)
         self.instance_groups = TaskManagerInstanceGroups(task_manager_instances=self.instances, **kwargs)
 
@@ -307,3 +403,198 @@ class TaskManagerModels:
                 ig = self.instance_groups.pk_ig_map[task.instance_group_id]
                 if ig.is_container_group:
                     self.instance_groups[ig.name].consume_capacity(task)
+
+
+def get_task_priority(task):
+    # annotated by TaskManager.get_task_queryset, ad hoc commands have no template
+    return getattr(task, 'unified_job_template_priority', None) or 0
+
+
+def get_fair_share_queue(task, key='organization'):
+    """Return the name of the fair-share queue of a task, e.g. organization-1"""
+    if key == 'template':
+        return f'template-{task.unified_job_template_id}'
+    return f'organization-{task.organization_id}'
+
+
+class FairShareQueues:
+    """
+    Orders pending tasks by deficit round robin over a queue per organization
+    (or per template), so that one of them launching many tasks does not hold
+    back the others.  On each of its turns a queue gets `quantum` times its
+    weight of credit, and gives out tasks for as long as it covers their
+    impact; the rest of the credit is kept for its next turn.  Tasks of
+    templates with a higher priority come first in their queue.
+    """
+
+    def __init__(self, tasks, key='organization', quantum=100, weights=None):
+        weights = weights or {}
+        self.queues = dict()
+        for task in sorted(tasks, key=lambda task: -get_task_priority(task)):
+            self.queues.setdefault(get_fair_share_queue(task, key), []).append(task)
+        # credit each queue gets on its turns
+        self.credit = dict()
+        for name in self.queues:
+            weight = weights.get(name, 1)
+            if weight <= 0:
+                logger.warning(f'Ignoring fair-share weight {weight} of {name}, weights have to be positive')
+                weight = 1
+            # at least 1, to give out at least one task every few turns
+            self.credit[name] = max(quantum * weight, 1)
+
+    @staticmethod
+    def cost(task):
+        # workflow jobs have no impact, but still take a turn
+        return max(task.task_impact, 1)
+
+    def __iter__(self):
+        queues = {name: collections.deque(tasks) for name, tasks in self.queues.items()}
+        deficit = dict.fromkeys(queues, 0)
+        turns = collections.deque(queues)
+        while turns:
+            name = turns.popleft()
+            queue = queues[name]
+            deficit[name] += self.credit[name]
+            while queue and self.cost(queue[0]) <= deficit[name]:
+                task = queue.popleft()
+                deficit[name] -= self.cost(task)
+                yield task
+            if queue:
+                turns.append(name)
+
+
+class TaskManagerState:
+    """
+    The tasks the task manager schedules, kept in memory between its runs.
+
+    Instead of reloading every pending, waiting and running task on each run,
+    only the tasks recorded in the TaskManagerJournal as having changed (and
+    the tasks depending on them) are reloaded.  All of them are reloaded every
+    TASK_MANAGER_RECONCILE_INTERVAL seconds, when the journal was trimmed past
+    the position last read, or when the previous run did not commit.
+
+    It also remembers why pending tasks could not start, so that they are not
+    evaluated again until what they were waiting on changes: either the task
+    blocking them, or the capacity available (a task that was using some
+    changed, or instances/instance groups did).
+    """
+
+    def __init__(self):
+        self.valid = False
+        self.reconciled = 0
+        self.journal_position = None
+        self.tasks = dict()
+        # pk of a task -> pks of the tasks it is a dependency of
+        self.dependents = dict()
+        # pk of a pending task -> pk of the task blocking it
+        self.blocked_by = dict()
+        # pk of a task -> pks of the pending tasks it blocks
+        self.blocking = dict()
+        # pk of a pending task -> capacity generation at which it did not fit
+        self.needs_capacity = dict()
+        self.capacity_generation = 0
+        self.capacity_fingerprint = None
+
+    def sync(self, queryset, journal=None):
+        """
+        Bring the tasks up to date with `queryset` (the tasks the task manager
+        schedules), and return whether all of them were reloaded plus the
+        number of tasks loaded.  The state stays invalid until validate() is
+        called, once the changes made to the tasks in memory are committed.
+        """
+        valid, self.valid = self.valid, False
+        changes = None
+        if valid and journal is not None and time.monotonic() - self.reconciled < settings.TASK_MANAGER_RECONCILE_INTERVAL:
+            changes = journal.read(self.journal_position)
+        if changes is None:
+            return True, self.reconcile(queryset, journal)
+        task_ids, self.journal_position = changes
+        return False, self.update(queryset, task_ids)
+
+    def reconcile(self, queryset, journal=None):
+        # take the position first, anything recorded while loading is reloaded next time
+        self.journal_position = None
+        if journal is not None:
+            journal.trim()
+            self.journal_position = journal.position()
+        self.reconciled = time.monotonic() if self.journal_position is not None else 0
+        self.tasks = dict()
+        self.dependents = dict()
+        self.blocked_by = dict()
+        self.blocking = dict()
+        self.needs_capacity = dict()
+        self.capacity_generation += 1
+        for task in queryset.all():
+            self.add(task)
+        return len(self.tasks)
+
+    def update(self, queryset, task_ids):
+        if not task_ids:
+            return 0
+        # dependents have the status of their dependencies prefetched
+        reload_ids = set(task_ids)
+        for pk in task_ids:
+            reload_ids.update(self.dependents.get(pk, ()))
+        for pk in task_ids:
+            for blocked_pk in self.blocking.pop(pk, ()):
+                self.blocked_by.pop(blocked_pk, None)
+        for pk in reload_ids:
+            self.forget(pk)
+        loaded = 0
+        for task in queryset.filter(pk__in=reload_ids):
+            self.add(task)
+            loaded += 1
+        return loaded
+
+    def add(self, task):
+        self.tasks[task.pk] = task
+        for dependency in task.dependent_jobs.all():
+            self.dependents.setdefault(dependency.pk, set()).add(task.pk)
+
+    def forget(self, pk):
+        task = self.tasks.pop(pk, None)
+        if task is None:
+            return
+        if task.status in ('waiting', 'running'):
+            # whatever it was using may be available now
+            self.capacity_generation += 1
+        for dependency in task.dependent_jobs.all():
+            self.dependents.get(dependency.pk, set()).discard(pk)
+        blocker_pk = self.blocked_by.pop(pk, None)
+        if blocker_pk is not None:
+            self.blocking.get(blocker_pk, set()).discard(pk)
+        self.needs_capacity.pop(pk, None)
+
+    def sorted_tasks(self):
+        return sorted(self.tasks.values(), key=lambda task: (task.created, task.pk))
+
+    def check_capacity(self, tm_models):
+        """Start a new capacity generation if instances or instance groups changed"""
+        fingerprint = (
+            tuple(sorted((i.hostname, i.node_type, i.capacity) for i in tm_models.instances.instances_by_hostname.values())),
+            tuple(
+                sorted(
+                    (ig.name, ig.is_container_group, ig.max_concurrent_jobs, ig.max_forks, ig.instance_hostnames)
+                    for ig in tm_models.instance_groups.instance_groups.values()
+                )
+            ),
+        )
+        if fingerprint != self.capacity_fingerprint:
+            self.capacity_fingerprint = fingerprint
+            self.capacity_generation += 1
+
+    def mark_blocked(self, task, blocked_by):
+        self.blocked_by[task.pk] = blocked_by.pk
+        self.blocking.setdefault(blocked_by.pk, set()).add(task.pk)
+
+    def mark_needs_capacity(self, task):
+        self.needs_capacity[task.pk] = self.capacity_generation
+
+    def still_waiting(self, task):
+        """Return True if nothing `task` was waiting on changed since it was last evaluated"""
+        if task.pk in self.blocked_by:
+            return True
+        return self.needs_capacity.get(task.pk) == self.capacity_generation
+
+    def validate(self):
+        self.valid = True
@@ -1 +1 @@
-from . import host_metrics, jobs, receptor, system  # noqa
+from . import firewall, host_metrics, jobs, receptor, system  # noqa
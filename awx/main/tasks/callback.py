@@ -1,6 +1,7 @@
 import json
 import time
 import logging
+import threading
 from collections import deque
 
 # Django
@@ -18,6 +19,50 @@ from awx.main.queue import CallbackQueueDispatcher
 logger = logging.getLogger('awx.main.tasks.callback')
 
 
+class WebsocketEventBatch:
+    """
+    Accumulates the events whose websocket messages were skipped by the rate
+    limit in RunnerCallback.event_handler, so that they can be announced with
+    a single event_batch message carrying their counter ranges and the tail
+    of their stdout.
+    """
+
+    def __init__(self, stdout_lines):
+        self.counters = []
+        self.stdout_lines = deque(maxlen=stdout_lines)
+        self.start_line = self.end_line = None
+
+    def __bool__(self):
+        return bool(self.counters)
+
+    def add(self, event_data):
+        counter = event_data.get('counter')
+        if counter is not None:
+            if self.counters and self.counters[-1][1] + 1 == counter:
+                self.counters[-1][1] = counter
+            else:
+                self.counters.append([counter, counter])
+        if event_data.get('stdout'):
+            self.stdout_lines.extend(event_data['stdout'].splitlines())
+        if self.start_line is None:
+            self.start_line = event_data.get('start_line')
+        self.end_line = event_data.get('end_line', self.end_line)
+
+    def pop(self):
+        """Return the event_batch message for the accumulated events, and start a new batch"""
+        message = {
+            'event': 'event_batch',
+            'counters': self.counters,
+            'stdout_lines': list(self.stdout_lines),
+            'start_line': self.start_line,
+            'end_line': self.end_line,
+        }
+        self.counters = []
+        self.stdout_lines.clear()
+        self.start_line = self.end_line = None
+        return message
+
+
 class RunnerCallback:
     def __init__(self, model=None):
         self.parent_workflow_job_id = None
@@ -25,7 +70,7 @@ class RunnerCallback:
         self.guid = get_guid()
         self.job_created = None
         self.recent_event_timings = deque(maxlen=settings.MAX_WEBSOCKET_EVENT_RATE)
-        self.dispatcher = CallbackQueueDispatcher()
+        self.dispatcher = CallbackQueueDispatcher(buffered=True)
         self.safe_env = {}
         self.event_ct = 0
         self.model = model
@@ -33,6 +78,8 @@ class RunnerCallback:
         self.wrapup_event_dispatched = False
         self.artifacts_processed = False
         self.extra_update_fields = {}
+        self.websocket_event_batch_lock = threading.Lock()
+        self.websocket_event_batch_timer = None
 
     def update_model(self, pk, _attempt=0, **updates):
         return update_model(self.model, pk, _attempt=0, _max_attempts=self.update_attempts, **updates)
@@ -45,6 +92,13 @@ class RunnerCallback:
     def event_data_key(self):
         return self.instance.event_class.JOB_REFERENCE
 
+    @cached_property
+    def websocket_event_batch(self):
+        job_type = self.event_data_key.removesuffix('_id')
+        if settings.WEBSOCKET_EVENT_COALESCING.get(job_type, 'skip') == 'batch':
+            return WebsocketEventBatch(settings.WEBSOCKET_EVENT_BATCH_STDOUT_LINES)
+        return None
+
     def delay_update(self, skip_if_already_set=False, **kwargs):
         """Stash fields that should be saved along with the job status change"""
         for key, value in kwargs.items():
@@ -156,17 +210,21 @@ class RunnerCallback:
             else:
                 event_data.setdefault('event_data', {})
                 event_data['skip_websocket_message'] = True
+                if self.websocket_event_batch is not None:
+                    self.add_to_websocket_event_batch(event_data)
 
         elif self.recent_event_timings.maxlen:
             self.recent_event_timings.append(time.time())
 
-        if event_data.get('event', '') == self.wrapup_event_type:
-            self.wrapup_event_dispatched = True
-
         event_data.setdefault(self.event_data_key, self.instance.id)
         self.dispatcher.dispatch(event_data)
         self.event_ct += 1
 
+        if event_data.get('event', '') == self.wrapup_event_type:
+            self.wrapup_event_dispatched = True
+            # the wrapup event triggers stats and notifications, do not hold it in the buffer
+            self.dispatcher.flush()
+
         '''
         Handle artifacts
         '''
@@ -175,10 +233,40 @@ class RunnerCallback:
 
         return False
 
+    def add_to_websocket_event_batch(self, event_data):
+        with self.websocket_event_batch_lock:
+            self.websocket_event_batch.add(event_data)
+            if self.websocket_event_batch_timer is None:
+                # the batch goes out WEBSOCKET_EVENT_BATCH_INTERVAL after its first event, even if no other event follows
+                self.websocket_event_batch_timer = threading.Timer(settings.WEBSOCKET_EVENT_BATCH_INTERVAL, self.dispatch_websocket_event_batch_on_timer)
+                self.websocket_event_batch_timer.daemon = True
+                self.websocket_event_batch_timer.start()
+
+    def dispatch_websocket_event_batch(self):
+        with self.websocket_event_batch_lock:
+            if self.websocket_event_batch_timer is not None:
+                self.websocket_event_batch_timer.cancel()
+                self.websocket_event_batch_timer = None
+            if not self.websocket_event_batch:
+                return
+            # like EOF, event_batch messages are only relayed to websockets by the callback receiver, not saved
+            event_data = self.websocket_event_batch.pop()
+            event_data[self.event_data_key] = self.instance.id
+            event_data['guid'] = self.guid
+            self.dispatcher.dispatch(event_data)
+
+    def dispatch_websocket_event_batch_on_timer(self):
+        try:
+            self.dispatch_websocket_event_batch()
+        except Exception:
+            logger.exception('failed to dispatch websocket event batch')
+
     def finished_callback(self, runner_obj):
         """
         Ansible runner callback triggered on finished run
         """
+        if self.websocket_event_batch is not None:
+            self.dispatch_websocket_event_batch()
         event_data = {
             'event': 'EOF',
             'final_counter': self.event_ct,
@@ -186,6 +274,7 @@ class RunnerCallback:
         }
         event_data.setdefault(self.event_data_key, self.instance.id)
         self.dispatcher.dispatch(event_data)
+        self.dispatcher.flush()
         if self.wrapup_event_type == 'EOF':
             self.wrapup_event_dispatched = True
 
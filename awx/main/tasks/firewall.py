@@ -0,0 +1,659 @@
+"""
+Upgrades of firewalls, started from the UpdateFirewallsConsumer websocket.
+
+The firewalls of a job are upgraded by one upgrade_firewalls dispatcher task,
+which runs their upgrades concurrently in an event loop, starting each one
+when FirewallRollout schedules it.  An upgrade walks the steps of
+UPGRADE_STEPS and saves the last one it completed in
+UpdateFirewallStatus.status; a task that dies with its dispatcher is
+dispatched again by resume_firewall_upgrades, on any node, and carries on
+from there.  The install and reboot steps also save in
+UpdateFirewallStatus.in_progress that their request was sent, so that a
+resumed step waits for it to finish instead of sending it again.  The websocket only follows the progress the task sends to the
+group of the job.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+from collections import Counter, defaultdict
+from enum import Enum
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from awx.main.dispatch import get_task_queuename
+from awx.main.dispatch.publish import task
+from awx.main.models import UpdateFirewallBackupFile, UpdateFirewallStatus, UpdateFirewallStatusLogs
+from awx.main.utils.panos import PanosError, get_async_client
+from awx.main.utils.pglock import advisory_lock
+
+logger = logging.getLogger('awx.main.tasks.firewall')
+
+
+class FirewallStatus(Enum):
+    WAITING = "waiting"
+    SOLAR_WIND_MUTE = "solar_wind_mute"
+    BACKUP = "backup"
+    CLEANUP = "cleanup"
+    DOWNLOAD = "download"
+    INSTALL = "install"
+    REBOOT = "reboot"
+    LOGIN = "login"
+    SOLAR_WIND_UNMUTE = "solar_wind_unmute"
+    UPDATED = "updated"
+    ERROR = "error"
+    STOP = "stop"
+
+
+UPGRADE_STEPS = [
+    FirewallStatus.SOLAR_WIND_MUTE,
+    FirewallStatus.BACKUP,
+    FirewallStatus.CLEANUP,
+    FirewallStatus.DOWNLOAD,
+    FirewallStatus.INSTALL,
+    FirewallStatus.REBOOT,
+    FirewallStatus.LOGIN,
+    FirewallStatus.SOLAR_WIND_UNMUTE,
+    FirewallStatus.UPDATED,
+]
+
+FINISHED_STATUSES = (FirewallStatus.UPDATED.value, FirewallStatus.ERROR.value, FirewallStatus.STOP.value)
+
+
+def get_remaining_steps(status):
+    """The steps left to upgrade a firewall whose last completed step is `status`"""
+    if status == FirewallStatus.WAITING.value:
+        return list(UPGRADE_STEPS)
+    completed = [step.value for step in UPGRADE_STEPS]
+    if status not in completed:
+        return []
+    return UPGRADE_STEPS[completed.index(status) + 1 :]
+
+
+def get_progress_group(job_id):
+    return f'firewall_upgrade-{job_id}'
+
+
+def get_log_group(job_id):
+    return f'firewall_upgrade_logs-{job_id}'
+
+
+def get_job_progress(job_id):
+    """The status of each firewall of the job, by group, as sent to the websocket"""
+    result = defaultdict(dict)
+    for firewall in UpdateFirewallStatus.objects.filter(job_id=job_id).order_by('-updated_at'):
+        if firewall.group_name:
+            result[firewall.group_name][firewall.ip_address] = {"status": firewall.status, "name": firewall.name}
+    return result
+
+
+async def send_job_progress(job_id, firewall=None, status=None):
+    """Send the progress of the job to the websockets following it, with `firewall` at `status` if given"""
+    result = await sync_to_async(get_job_progress)(job_id)
+    if firewall is not None:
+        result[firewall.group_name][firewall.ip_address] = {"status": status, "name": firewall.name}
+    await get_channel_layer().group_send(
+        get_progress_group(job_id),
+        {"type": "internal.message", "text": json.dumps(result), "needs_relay": True},
+    )
+
+
+def get_upgrade_lock_name(job_id):
+    return f'firewall_upgrade_{job_id}'
+
+
+def get_dispatched_key(job_id):
+    return f'firewall_upgrade_dispatched_{job_id}'
+
+
+def assign_waves(firewalls, percentages):
+    """Split the firewalls into waves, wave n reaching percentages[n] percent of them"""
+    wave = 0
+    for i, firewall in enumerate(firewalls):
+        while wave < len(percentages) - 1 and i >= math.ceil(len(firewalls) * percentages[wave] / 100):
+            wave += 1
+        firewall.wave = wave
+
+
+class FirewallRollout:
+    """
+    Decides which firewalls of a job to upgrade next.
+
+    The firewalls are upgraded in the waves of FIREWALL_UPGRADE_WAVES, each
+    one starting when the previous one finished, at most
+    FIREWALL_UPGRADE_MAX_CONCURRENT_PER_GROUP of a group at a time (or one
+    at a time if the job is not upgraded in `sequence`), and never both
+    peers of a high availability pair at once.  The rollout halts when more
+    than FIREWALL_UPGRADE_MAX_FAILURE_RATE of the finished upgrades failed.
+    When each wave started and finished is written to the logs of the job,
+    under the ROLLOUT_LOG ip address.
+    """
+
+    ROLLOUT_LOG = 'rollout'
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.firewalls = list(UpdateFirewallStatus.objects.filter(job_id=job_id).order_by('pk'))
+
+    def log(self, text):
+        UpdateFirewallStatusLogs.objects.create(job_id=self.job_id, ip_address=self.ROLLOUT_LOG, text=text[:250])
+
+    def logged(self, prefix):
+        return UpdateFirewallStatusLogs.objects.filter(job_id=self.job_id, ip_address=self.ROLLOUT_LOG, text__startswith=prefix).exists()
+
+    def plan(self):
+        assign_waves(self.firewalls, settings.FIREWALL_UPGRADE_WAVES)
+        UpdateFirewallStatus.objects.bulk_update(self.firewalls, ['wave'])
+        sizes = Counter(firewall.wave for firewall in self.firewalls)
+        self.log(f'planned {len(self.firewalls)} firewalls in waves of ' + ', '.join(str(sizes[wave]) for wave in sorted(sizes)))
+
+    def log_wave_finished(self, wave):
+        prefix = f'wave {wave + 1} finished'
+        if self.logged(prefix):
+            return
+        firewalls = [f for f in self.firewalls if f.wave == wave]
+        started = min(f.started_at or f.created_at for f in firewalls)
+        finished = max(f.updated_at for f in firewalls)
+        statuses = Counter(f.status for f in firewalls)
+        self.log(f'{prefix} in {(finished - started).total_seconds():.0f}s: ' + ', '.join(f'{statuses[s]} {s}' for s in FINISHED_STATUSES if statuses[s]))
+
+    def halt(self, pending, failure_rate):
+        UpdateFirewallStatus.objects.filter(pk__in=[f.pk for f in pending]).update(status=FirewallStatus.STOP.value)
+        self.log(f'halted, {failure_rate:.0%} of the upgrades failed, {len(pending)} firewalls stopped')
+        async_to_sync(send_job_progress)(self.job_id)
+
+    def start(self, firewall):
+        firewall.started_at = now()
+        firewall.save(update_fields=['started_at'])
+
+    def schedule(self, exclude=()):
+        """
+        The firewalls to upgrade now: the ones started before whose upgrade is
+        not running, e.g. because its task died, unless in `exclude`, and the
+        next ones of the rollout.
+        """
+        if not self.firewalls:
+            return []
+        if any(firewall.wave is None for firewall in self.firewalls):
+            self.plan()
+
+        finished, in_flight, pending = [], [], []
+        for firewall in self.firewalls:
+            if firewall.status in FINISHED_STATUSES:
+                finished.append(firewall)
+            elif firewall.started_at or firewall.status != FirewallStatus.WAITING.value:
+                in_flight.append(firewall)
+            else:
+                pending.append(firewall)
+
+        resumed = [firewall for firewall in in_flight if firewall.pk not in exclude]
+
+        failed = sum(f.status == FirewallStatus.ERROR.value for f in finished)
+        upgraded = sum(f.status == FirewallStatus.UPDATED.value for f in finished)
+        if pending and failed and failed / (failed + upgraded) > settings.FIREWALL_UPGRADE_MAX_FAILURE_RATE:
+            self.halt(pending, failed / (failed + upgraded))
+            return resumed
+
+        waves = sorted({f.wave for f in self.firewalls})
+        unfinished = in_flight + pending
+        wave = min((f.wave for f in unfinished), default=None)
+        for finished_wave in waves:
+            if wave is None or finished_wave < wave:
+                self.log_wave_finished(finished_wave)
+        if wave is None:
+            return resumed
+
+        sequence = self.firewalls[0].sequence
+        limit = settings.FIREWALL_UPGRADE_MAX_CONCURRENT_PER_GROUP if sequence else 1
+        busy_groups = Counter(f.group_name for f in in_flight)
+        # both ends of the pairs, so that a pair is found even if only one of its peers knows of the other
+        busy_ips = {f.ip_address for f in in_flight} | {f.ha_peer for f in in_flight if f.ha_peer}
+        wave_started = any(f.wave == wave for f in in_flight)
+        started_wave = []
+        for firewall in pending:
+            if not sequence and in_flight:
+                break
+            # the high availability peers of the firewalls are found out before they are upgraded
+            if firewall.ha_peer is None or firewall.wave != wave or busy_groups[firewall.group_name] >= limit:
+                continue
+            if firewall.ip_address in busy_ips or firewall.ha_peer in busy_ips:
+                continue
+            self.start(firewall)
+            in_flight.append(firewall)
+            busy_groups[firewall.group_name] += 1
+            busy_ips.update({firewall.ip_address, firewall.ha_peer} - {''})
+            started_wave.append(firewall)
+        if started_wave and not wave_started:
+            self.log(f'wave {wave + 1} started, {sum(f.wave == wave for f in self.firewalls)} firewalls')
+        return resumed + started_wave
+
+
+def start_firewall_upgrades(job_id):
+    """
+    Dispatch the task upgrading the firewalls of the job, unless it was
+    dispatched in the last FIREWALL_UPGRADE_DISPATCH_TIMEOUT seconds and did
+    not start yet, so that tasks waiting for a worker do not pile up.
+    """
+    if cache.add(get_dispatched_key(job_id), True, timeout=settings.FIREWALL_UPGRADE_DISPATCH_TIMEOUT):
+        upgrade_firewalls.apply_async([job_id])
+
+
+async def get_ha_peer(client, firewall):
+    """The management ip of the high availability peer of the firewall, or ''"""
+    try:
+        response = await client.op(firewall.ip_address, firewall.api_key, '<show><high-availability><all/></high-availability></show>')
+        root = response.xml()
+    except PanosError as e:
+        text = f'{firewall.job_id} {firewall.ip_address} high availability peer unknown: {e}'[:250]
+        await sync_to_async(UpdateFirewallStatusLogs.objects.create)(job_id=firewall.job_id, ip_address=firewall.ip_address, text=text)
+        return ''
+    if root.findtext('./result/enabled') != 'yes':
+        return ''
+    return (root.findtext('./result/group/peer-info/mgmt-ip') or '').split('/')[0]
+
+
+class FirewallUpgrades:
+    """
+    Runs the upgrades of the firewalls of a job concurrently, sharing one
+    client and log buffer, until none is left to upgrade.  The firewalls are
+    started as FirewallRollout schedules them, at first and each time an
+    upgrade finishes, each one at most once, so that an upgrade that did not
+    finish is left to the next task rather than replayed right away.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.client = None
+        self.log_buffer = FirewallLogBuffer(job_id)
+        self.started = set()
+
+    async def find_ha_peers(self):
+        """Find out the high availability peer of the firewalls that were not given one, before they are upgraded"""
+        firewalls = await sync_to_async(list)(UpdateFirewallStatus.objects.filter(job_id=self.job_id, ha_peer__isnull=True))
+        if not firewalls:
+            return
+        for firewall, ha_peer in zip(firewalls, await asyncio.gather(*(get_ha_peer(self.client, firewall) for firewall in firewalls))):
+            firewall.ha_peer = ha_peer
+        await sync_to_async(UpdateFirewallStatus.objects.bulk_update)(firewalls, ['ha_peer'])
+
+    def schedule(self):
+        firewalls = FirewallRollout(self.job_id).schedule(exclude=self.started)
+        self.started.update(firewall.pk for firewall in firewalls)
+        return firewalls
+
+    async def run(self):
+        self.client = get_async_client()
+        running = set()
+        try:
+            while True:
+                await self.find_ha_peers()
+                for firewall in await sync_to_async(self.schedule)():
+                    running.add(asyncio.create_task(FirewallUpgrade(firewall, self.client, self.log_buffer).run()))
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for upgrade in done:
+                    if upgrade.exception() is not None:
+                        logger.error(f'Upgrade of a firewall of job {self.job_id} failed', exc_info=upgrade.exception())
+        finally:
+            try:
+                await self.log_buffer.flush()
+            finally:
+                await self.client.close()
+
+
+@task(queue=get_task_queuename)
+def upgrade_firewalls(job_id):
+    cache.delete(get_dispatched_key(job_id))
+    with advisory_lock(get_upgrade_lock_name(job_id), wait=False) as acquired:
+        if not acquired:
+            logger.debug(f'The firewalls of job {job_id} are already being upgraded')
+            return
+        asyncio.run(FirewallUpgrades(job_id).run())
+
+
+@task(queue=get_task_queuename)
+def resume_firewall_upgrades():
+    """Dispatch again the upgrades of the jobs whose task died, e.g. because its dispatcher was restarted"""
+    for job_id in UpdateFirewallStatus.objects.exclude(status__in=FINISHED_STATUSES).values_list('job_id', flat=True).distinct():
+        with advisory_lock(get_upgrade_lock_name(job_id), wait=False) as free:
+            pass
+        if free:
+            start_firewall_upgrades(job_id)
+
+
+class FirewallLogBuffer:
+    """
+    Buffers the log lines of the upgrades of a job, written to the database
+    with a single bulk_create once FIREWALL_LOG_BATCH_SIZE of them are
+    buffered or FIREWALL_LOG_FLUSH_INTERVAL seconds after the first one.  Each
+    line is also sent right away to the websockets following the logs of the
+    job, so they do not wait for the database.  Failing to write or send the
+    logs does not fail the upgrades: the lines are kept for the next flush.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.logs = []
+        self.flusher = None
+
+    async def write(self, ip, text):
+        log = UpdateFirewallStatusLogs(job_id=self.job_id, ip_address=ip, text=text[:250], created_at=now())
+        self.logs.append(log)
+        if len(self.logs) >= settings.FIREWALL_LOG_BATCH_SIZE:
+            await self.try_flush()
+        elif self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_later())
+        message = {"log": {"ip_address": ip, "text": log.text, "created_at": log.created_at.isoformat()}}
+        try:
+            await get_channel_layer().group_send(
+                get_log_group(self.job_id),
+                {"type": "internal.message", "text": json.dumps(message), "needs_relay": True},
+            )
+        except Exception:
+            logger.exception(f'Failed to send the logs of job {self.job_id}')
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.FIREWALL_LOG_FLUSH_INTERVAL)
+        self.flusher = None
+        await self.try_flush()
+
+    async def try_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f'Failed to write {len(self.logs)} logs of job {self.job_id}, retrying with the next ones')
+
+    async def flush(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        logs, self.logs = self.logs, []
+        if not logs:
+            return
+        try:
+            await sync_to_async(UpdateFirewallStatusLogs.objects.bulk_create)(logs)
+        except Exception:
+            self.logs[:0] = logs
+            raise
+
+
+class FirewallUpgrade:
+    """
+    Walks the remaining upgrade steps of a firewall.  A step that fails, or
+    raises, sets the firewall to ERROR, so that the upgrade is never replayed
+    past a step that went wrong.  The steps whose request must not be sent
+    twice mark it as sent first, see send_once.
+    """
+
+    def __init__(self, firewall, panos, log_buffer):
+        self.firewall = firewall
+        self.panos = panos
+        self.log_buffer = log_buffer
+
+    @staticmethod
+    def write_file(filename, content):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as file:
+            file.write(content)
+
+    async def send_progress(self, status):
+        try:
+            await send_job_progress(self.firewall.job_id, self.firewall, status)
+        except Exception:
+            logger.exception(f'Failed to send the progress of job {self.firewall.job_id}')
+
+    async def set_status(self, status):
+        self.firewall.status = status.value
+        self.firewall.in_progress = ''
+        await sync_to_async(self.firewall.save)()
+        await self.send_progress(self.firewall.status)
+
+    async def run(self):
+        try:
+            return await self.process_firewall_status()
+        except Exception:
+            logger.exception(f'Upgrade of firewall {self.firewall.ip_address} of job {self.firewall.job_id} failed')
+            await self.set_status(FirewallStatus.ERROR)
+            return False
+
+    async def process_firewall_status(self):
+        firewall = self.firewall
+        job_id, ip = firewall.job_id, firewall.ip_address
+        for new_status in get_remaining_steps(firewall.status):
+            await sync_to_async(firewall.refresh_from_db)(fields=['status'])
+            if firewall.status == FirewallStatus.STOP.value:
+                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} stopped')
+                await self.send_progress(firewall.status)
+                return False
+            await self.create_firewall_status_log(job_id, ip, f"{job_id} {ip} Task: {new_status.value}")
+            task_method = getattr(self, f"{new_status.value}_firewalls")
+            await self.send_progress(new_status.value)
+
+            try:
+                _result = await task_method(firewall, ip, job_id, firewall.api_key, firewall.update_version, firewall.current_version)
+            except PanosError as e:
+                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} not reachable: {e}'[:250])
+                _result = False
+            except Exception as e:
+                logger.exception(f'Step {new_status.value} of the upgrade of firewall {ip} of job {job_id} failed')
+                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} {new_status.value} failed: {e}'[:250])
+                _result = False
+            await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} result {_result}')
+            if not _result:
+                await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} status change {FirewallStatus.ERROR.value}')
+                await self.set_status(FirewallStatus.ERROR)
+                return False
+            await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} status change {new_status.value}')
+            await self.set_status(new_status)
+        await self.create_firewall_status_log(job_id, ip, f'{job_id} {ip} finished')
+        return True
+
+    async def export_and_save(self, params, filename, job_id, ip):
+        """Export from the firewall and save the answer to `filename` and the database"""
+        response = await self.panos.request(ip, params)
+        if response.status_code != 200:
+            await self.create_firewall_status_log(job_id, ip, f'Failed to save {filename}, status {response.status_code}')
+            return False
+        await sync_to_async(UpdateFirewallBackupFile.objects.create)(job_id=job_id, ip_address=ip, file_name=filename, xml_content=response.content)
+        await sync_to_async(self.write_file)(filename, response.content)
+        await self.create_firewall_status_log(job_id, ip, f'Saved {filename}')
+        return True
+
+    async def create_firewall_status_log(self, job_id, ip, text):
+        await self.log_buffer.write(ip, text)
+
+    async def send_once(self, step, ip, params):
+        """
+        Send the request of `step` unless an earlier task already sent it, in
+        which case return None and the step only waits for it to finish.  The
+        request is marked as sent before it is sent, so that it is never sent
+        twice; if the task dies in between, the step times out waiting.
+        """
+        firewall = self.firewall
+        if firewall.in_progress == step.value:
+            await self.create_firewall_status_log(firewall.job_id, ip, f'{step.value} was already requested, waiting for it to complete')
+            return None
+        firewall.in_progress = step.value
+        await sync_to_async(firewall.save)(update_fields=['in_progress'])
+        return await self.panos.request(ip, params, idempotent=False)
+
+    @staticmethod
+    def is_downloaded(root, version):
+        entry = root.find(f".//versions/entry[version='{version}']")
+        return entry is not None and entry.findtext('downloaded') == 'yes'
+
+    async def download_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, "downloading started")
+
+        params_get = {'type': 'op', 'cmd': '<request><system><software><check></check></software></system></request>', 'key': api_key}
+        response = await self.panos.request(ip, params_get)
+        if response.status_code != 200:
+            await self.create_firewall_status_log(job_id, ip, 'Failed to retrieve software versions')
+            return False
+
+        await self.create_firewall_status_log(job_id, ip, "Successfully retrieved the current software versions")
+        if self.is_downloaded(response.xml(), version_to_download):
+            await self.create_firewall_status_log(job_id, ip, f'Software version {version_to_download} is already downloaded')
+        else:
+            params_download = {
+                'type': 'op',
+                'cmd': f'<request><system><software><download><version>{version_to_download}</version></download></software></system></request>',
+                'key': api_key,
+            }
+            response = await self.panos.request(ip, params_download, idempotent=False)
+            if response.status_code == 200:
+                await self.create_firewall_status_log(job_id, ip, f'Started downloading the targeted software version: {version_to_download}')
+            else:
+                await self.create_firewall_status_log(job_id, ip, f'Failed to start download of software version {version_to_download}')
+
+            # wait up to 15 minutes for the download to complete
+            for i in range(15):
+                response = await self.panos.request(ip, params_get)
+                if response.status_code == 200 and self.is_downloaded(response.xml(), version_to_download):
+                    await self.create_firewall_status_log(job_id, ip, f'Successfully downloaded software version {version_to_download}')
+                    break
+                await self.create_firewall_status_log(job_id, ip, 'Waiting for download to complete...')
+                await asyncio.sleep(60)
+            else:
+                await self.create_firewall_status_log(job_id, ip, 'Maximum tries reached and software download failed after 15 minutes')
+                return False
+        await self.create_firewall_status_log(job_id, ip, "downloading completed")
+        return True
+
+    async def solar_wind_mute_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, "solar_wind_mute started")
+        await self.create_firewall_status_log(job_id, ip, "This module is not implemented yet.")
+        await self.create_firewall_status_log(job_id, ip, "solar_wind_mute completed")
+        return True
+
+    async def backup_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, "backup started")
+        params_config = {'type': 'export', 'category': 'configuration', 'action': 'save', 'key': api_key}
+        params_device_state = {'type': 'export', 'category': 'device-state', 'action': 'save', 'key': api_key}
+
+        config_saved = await self.export_and_save(params_config, f'backup_file/{ip}_{current_version}_config_backup.xml', job_id, ip)
+        device_state_saved = await self.export_and_save(params_device_state, f'backup_file/{ip}_{current_version}_device_state_cfg.tgz', job_id, ip)
+        if config_saved and device_state_saved:
+            await self.create_firewall_status_log(job_id, ip, "Successfully downloaded all backup files")
+            return True
+        await self.create_firewall_status_log(job_id, ip, "Backup files are not downloading")
+        return False
+
+    async def cleanup_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, f'Removing all the old software from {ip}')
+
+        params_get = {'type': 'op', 'cmd': '<request><system><software><check></check></software></system></request>', 'key': api_key}
+        response = await self.panos.request(ip, params_get)
+        if response.status_code != 200:
+            await self.create_firewall_status_log(job_id, ip, 'Failed to retrieve software versions')
+            return True
+
+        await self.create_firewall_status_log(job_id, ip, f'Successfully retrieved software versions for {ip}')
+        for entry in response.xml().findall('.//versions/entry'):
+            version = entry.findtext('version')
+            if entry.findtext('downloaded') != 'yes' or entry.findtext('current') != 'no':
+                continue
+            params_delete = {
+                'type': 'op',
+                'cmd': f'<request><system><software><delete><version>{version}</version></delete></software></system></request>',
+                'key': api_key,
+            }
+            response = await self.panos.request(ip, params_delete, idempotent=False)
+            if response.status_code == 200:
+                await self.create_firewall_status_log(job_id, ip, f'Successfully deleted software version {version}')
+            else:
+                await self.create_firewall_status_log(job_id, ip, f"Failed to delete software version {version}")
+
+        await self.create_firewall_status_log(job_id, ip, 'Successfully deleted all the old software versions')
+        return True
+
+    async def install_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, f'Installing {version_to_download} on {ip}')
+
+        params_install = {
+            'type': 'op',
+            'cmd': f'<request><system><software><install><version>{version_to_download}</version></install></software></system></request>',
+            'key': api_key,
+        }
+        response = await self.send_once(FirewallStatus.INSTALL, ip, params_install)
+        if response is not None:
+            if response.status_code != 200:
+                await self.create_firewall_status_log(job_id, ip, f'Failed to install software version {version_to_download}')
+                return False
+            await self.create_firewall_status_log(job_id, ip, f'Successfully initiated software version {version_to_download}')
+
+        # wait up to 30 minutes for the install job to finish
+        params_check = {'type': 'op', 'cmd': '<show><jobs><all></all></jobs></show>', 'key': api_key}
+        for i in range(30):
+            response = await self.panos.request(ip, params_check)
+            if response.status_code == 200:
+                job = response.xml().find(".//job[type='SWInstall']")
+                if job is not None and job.findtext('status') == 'FIN':
+                    await self.create_firewall_status_log(job_id, ip, f'Successfully installed software version {version_to_download}')
+                    return True
+                await self.create_firewall_status_log(job_id, ip, 'Waiting for installation to complete...')
+                await asyncio.sleep(60)
+            else:
+                await self.create_firewall_status_log(job_id, ip, f'Invalid response, status {response.status_code}')
+        await self.create_firewall_status_log(job_id, ip, 'Installation did not complete after 30 minutes')
+        return False
+
+    async def reboot_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, f'Rebooting started on {ip}')
+
+        params_reboot = {'type': 'op', 'cmd': '<request><restart><system></system></restart></request>', 'key': api_key}
+        response = await self.send_once(FirewallStatus.REBOOT, ip, params_reboot)
+        if response is not None:
+            if response.status_code != 200:
+                await self.create_firewall_status_log(job_id, ip, f'Failed to reboot {ip}')
+                return False
+            await self.create_firewall_status_log(job_id, ip, f'Successfully rebooted {ip}')
+
+        # wait up to 20 minutes for the firewall to come back online
+        params_get = {'type': 'op', 'cmd': '<request><system><software><check></check></software></system></request>', 'key': api_key}
+        for i in range(20):
+            try:
+                response = await self.panos.request(ip, params_get)
+                if response.status_code == 200:
+                    await self.create_firewall_status_log(job_id, ip, f'{ip} is back online')
+                    break
+            except PanosError:
+                pass
+            await self.create_firewall_status_log(job_id, ip, f'{ip} is down, waiting for it to reboot...')
+            await asyncio.sleep(60)
+        else:
+            await self.create_firewall_status_log(job_id, ip, f'{ip} did not come back online after 20 minutes')
+            return False
+
+        params_get_version = {'type': 'op', 'cmd': '<show><system><info></info></system></show>', 'key': api_key}
+        response = await self.panos.request(ip, params_get_version)
+        if response.status_code == 200:
+            if response.xml().findtext(".//sw-version") == version_to_download:
+                await self.create_firewall_status_log(job_id, ip, f'Successfully installed software version {version_to_download}')
+            else:
+                await self.create_firewall_status_log(job_id, ip, f'Failed to install software version {version_to_download}')
+                return False
+
+        await self.create_firewall_status_log(job_id, ip, f"{ip} rebooting completed.")
+        return True
+
+    async def login_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, "login started")
+        await self.create_firewall_status_log(job_id, ip, "login completed")
+        return True
+
+    async def solar_wind_unmute_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, "solar_wind_unmute started")
+        await self.create_firewall_status_log(job_id, ip, "solar_wind_unmute completed")
+        return True
+
+    async def updated_firewalls(self, firewall, ip, job_id, api_key, version_to_download, current_version):
+        await self.create_firewall_status_log(job_id, ip, f"{ip} updated successfully")
+        return True
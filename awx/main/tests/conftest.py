@@ -20,6 +20,9 @@ from django.conf import settings
 
 def pytest_addoption(parser):
     parser.addoption("--genschema", action="store_true", default=False, help="execute schema validator")
+    parser.addoption(
+        "--scheduler-benchmark-scale", type=int, default=1, help="multiply the backlog of the task manager benchmarks, and print their report, when above 1"
+    )
 
 
 def pytest_configure(config):
@@ -1,7 +1,7 @@
 import pytest
 
 from awx.api.versioning import reverse
-from awx.main.models import AdHocCommand, AdHocCommandEvent, JobEvent
+from awx.main.models import AdHocCommand, AdHocCommandEvent, JobEvent, UnifiedJobEventArchive
 
 
 @pytest.mark.django_db
@@ -131,3 +131,43 @@ def test_job_job_events_children_summary_is_tree(get, organization_factory, job_
     assert response.data["meta_event_nested_uuid"] == {}
     assert response.data["event_processing_finished"] == True
     assert response.data["is_tree"] == False
+
+
+@pytest.mark.django_db
+def test_job_events_from_archive(get, organization_factory, job_template_factory):
+    objs = organization_factory("org", superusers=['admin'])
+    jt = job_template_factory("jt", organization=objs.organization, inventory='test_inv', project='test_proj').job_template
+    job = jt.create_unified_job()
+    JobEvent.create_from_data(job_id=job.pk, uuid='uuid1', parent_uuid='', event="playbook_on_start", counter=1, stdout='start', job_created=job.created).save()
+    JobEvent.create_from_data(
+        job_id=job.pk, uuid='uuid2', parent_uuid='uuid1', event="playbook_on_play_start", counter=2, stdout='play', start_line=1, job_created=job.created
+    ).save()
+    JobEvent.create_from_data(
+        job_id=job.pk, uuid='uuid3', parent_uuid='uuid2', event="playbook_on_task_start", counter=3, stdout='', start_line=2, job_created=job.created
+    ).save()
+    job.emitted_events = 3
+    job.status = "successful"
+    job.save()
+    UnifiedJobEventArchive.archive(job)
+    assert job.get_event_queryset().count() == 0
+
+    url = reverse('api:job_job_events_list', kwargs={'pk': job.pk})
+    response = get(url, user=objs.superusers.admin, expect=200)
+    assert response.data['count'] == 3
+    assert [e['uuid'] for e in response.data['results']] == ['uuid1', 'uuid2', 'uuid3']
+    assert response.data['results'][1]['parent_uuid'] == 'uuid1'
+
+    response = get(url + '?counter__gte=2&order_by=counter&page_size=1&page=2', user=objs.superusers.admin, expect=200)
+    assert response.data['count'] == 2
+    assert [e['uuid'] for e in response.data['results']] == ['uuid3']
+
+    response = get(url + '?not__stdout=&order_by=-counter', user=objs.superusers.admin, expect=200)
+    assert [e['counter'] for e in response.data['results']] == [2, 1]
+    response = get(url + '?counter__gt=1&search=pla', user=objs.superusers.admin, expect=200)
+    assert [e['counter'] for e in response.data['results']] == [2]
+    get(url + '?event_data__foo=1', user=objs.superusers.admin, expect=400)
+
+    url = reverse('api:job_job_events_children_summary', kwargs={'pk': job.pk})
+    response = get(url, user=objs.superusers.admin, expect=200)
+    assert response.data["event_processing_finished"] == True
+    assert response.data["children_summary"] == {1: {"rowNumber": 0, "numChildren": 2}, 2: {"rowNumber": 1, "numChildren": 1}}
@@ -189,6 +189,21 @@ def test_edit_nonsenstive(patch, job_template_factory, alice):
     assert res.data['name'] == 'updated'
 
 
+@pytest.mark.django_db
+def test_edit_priority(patch, job_template_factory, alice, admin_user):
+    jt = job_template_factory('jt', organization='org1', project='prj', inventory='inv', credential='cred').job_template
+    jt.organization.admin_role.members.add(alice)
+    url = reverse('api:job_template_detail', kwargs={'pk': jt.id})
+
+    # only superusers can change the priority, which orders the jobs of all organizations
+    res = patch(url, {'priority': 10}, alice, expect=400)
+    assert res.data['priority'] == ['Only system administrators can change the priority.']
+    patch(url, {'priority': 10}, admin_user, expect=200)
+    patch(url, {'name': 'updated', 'priority': 10}, alice, expect=200)
+    jt.refresh_from_db()
+    assert jt.priority == 10
+
+
 @pytest.fixture
 def jt_copy_edit(job_template_factory, project):
     objects = job_template_factory('copy-edit-job-template', project=project)
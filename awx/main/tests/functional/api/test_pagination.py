@@ -105,3 +105,39 @@ class TestUnifiedJobEventPagination:
     @pytest.mark.django_db
     def test_adhoc_command(self, get, admin, ad_hoc_command):
         self._test_unified_job(get, admin, ad_hoc_command, 'ad_hoc_command_id', 'ad_hoc_command_ad_hoc_command_events_list')
+
+
+@pytest.mark.django_db
+def test_job_events_cursor_pagination(get, admin, job_template):
+    job = job_template.create_unified_job()
+    for i in range(20):
+        job.event_class.create_from_data(job_id=job.pk, counter=20 - i, job_created=job.created).save()
+
+    url = reverse('api:job_job_events_list', kwargs={'pk': job.pk}) + '?cursor=&page_size=7&order_by=-counter'
+    counters = []
+    while url:
+        resp = get(url, user=admin, expect=200)
+        assert 'count' not in resp.data
+        assert len(resp.data['results']) <= 7
+        counters.extend(e['counter'] for e in resp.data['results'])
+        url = resp.data['next']
+    assert counters == list(range(1, 21))
+
+
+@pytest.mark.django_db
+def test_pagination_count_estimate(get, admin, inventory, settings):
+    for i in range(5):
+        Host(name='host-{}'.format(i), inventory=inventory).save()
+    url = reverse('api:host_list') + '?count_estimate&page_size=2'
+
+    # no estimate on sqlite
+    assert get(url, user=admin, expect=200).data['count'] == 5
+
+    settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD = 100
+    with patch('awx.api.pagination.estimate_count', return_value=1000):
+        resp = get(url + '&page=3', user=admin, expect=200)
+        assert resp.data['count'] == 1000
+        assert len(resp.data['results']) == 1
+        assert get(url + '&page=10', user=admin, expect=200).data['results'] == []
+    with patch('awx.api.pagination.estimate_count', return_value=10):
+        assert get(url, user=admin, expect=200).data['count'] == 5
@@ -25,6 +25,7 @@ from awx.main.models import (
     InventoryUpdateEvent,
     SystemJob,
     SystemJobEvent,
+    UnifiedJobEventArchive,
 )
 
 
@@ -89,14 +90,14 @@ def test_ansi_stdout_filtering(sqlite_copy, Parent, Child, relation, view, downl
     # ansi codes in ?format=txt should get filtered
     fmt = "?format={}".format("txt_download" if download else "txt")
     response = get(url + fmt, user=admin, expect=200)
-    assert smart_str(response.content).splitlines() == ['Testing %d' % i for i in range(3)]
+    assert smart_str(response.getvalue()).splitlines() == ['Testing %d' % i for i in range(3)]
     has_download_header = response.has_header('Content-Disposition')
     assert has_download_header if download else not has_download_header
 
     # ask for ansi and you'll get it
     fmt = "?format={}".format("ansi_download" if download else "ansi")
     response = get(url + fmt, user=admin, expect=200)
-    assert smart_str(response.content).splitlines() == ['\x1B[0;36mTesting %d\x1B[0m' % i for i in range(3)]
+    assert smart_str(response.getvalue()).splitlines() == ['\x1B[0;36mTesting %d\x1B[0m' % i for i in range(3)]
     has_download_header = response.has_header('Content-Disposition')
     assert has_download_header if download else not has_download_header
 
@@ -201,7 +202,7 @@ def test_max_bytes_display(sqlite_copy, Parent, Child, relation, view, fmt, get,
     )
 
     response = get(url + '?format={}_download'.format(fmt), user=admin, expect=200)
-    assert smart_str(response.content) == large_stdout
+    assert smart_str(response.getvalue()) == large_stdout
 
 
 @pytest.mark.django_db
@@ -218,7 +219,7 @@ def test_legacy_result_stdout_text_fallback(Cls, view, fmt, get, admin):
     url = reverse(view, kwargs={'pk': job.pk})
 
     response = get(url + '?format={}'.format(fmt), user=admin, expect=200)
-    assert smart_str(response.content) == 'LEGACY STDOUT!'
+    assert smart_str(response.getvalue()) == 'LEGACY STDOUT!'
 
 
 @pytest.mark.django_db
@@ -241,7 +242,7 @@ def test_legacy_result_stdout_with_max_bytes(Cls, view, fmt, get, admin):
     )
 
     response = get(url + '?format={}'.format(fmt + '_download'), user=admin, expect=200)
-    assert smart_str(response.content) == large_stdout
+    assert smart_str(response.getvalue()) == large_stdout
 
 
 @pytest.mark.django_db
@@ -263,7 +264,7 @@ def test_text_with_unicode_stdout(sqlite_copy, Parent, Child, relation, view, ge
     url = reverse(view, kwargs={'pk': job.pk}) + '?format=' + fmt
 
     response = get(url, user=admin, expect=200)
-    assert smart_str(response.content).splitlines() == ['オ%d' % i for i in range(3)]
+    assert smart_str(response.getvalue()).splitlines() == ['オ%d' % i for i in range(3)]
 
 
 @pytest.mark.django_db
@@ -278,3 +279,74 @@ def test_unicode_with_base64_ansi(sqlite_copy, get, admin):
     response = get(url, user=admin, expect=200)
     content = base64.b64decode(json.loads(smart_str(response.content))['content'])
     assert smart_str(content).splitlines() == ['オ%d' % i for i in range(3)]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('fmt', ['txt_download', 'ansi_download'])
+def test_stdout_download_is_streamed(get, admin, fmt, settings):
+    settings.STDOUT_STREAM_CHUNK_EVENTS = 2
+    created = tz_now()
+    job = Job(created=created)
+    job.save()
+    for i in range(5):
+        JobEvent(
+            job=job, stdout='\x1B[0;36mTesting {}\x1B[0m\r\nline {}'.format(i, i), start_line=i * 2, end_line=i * 2 + 2, counter=i + 1, job_created=created
+        ).save()
+    url = reverse('api:job_stdout', kwargs={'pk': job.pk}) + '?format=' + fmt
+
+    response = get(url, user=admin, expect=200)
+    assert response.streaming
+    assert response['Accept-Ranges'] == 'lines'
+    lines = smart_str(response.getvalue()).splitlines()
+    if fmt == 'txt_download':
+        assert lines == [line for i in range(5) for line in ('Testing {}'.format(i), 'line {}'.format(i))]
+    else:
+        assert lines[0] == '\x1B[0;36mTesting 0\x1B[0m'
+        assert len(lines) == 10
+
+
+@pytest.mark.django_db
+def test_stdout_download_resume(get, admin):
+    created = tz_now()
+    job = Job(created=created)
+    job.save()
+    for i in range(5):
+        JobEvent(job=job, stdout='Testing {}a\r\nTesting {}b'.format(i, i), start_line=i * 2, end_line=i * 2 + 2, counter=i + 1, job_created=created).save()
+    url = reverse('api:job_stdout', kwargs={'pk': job.pk}) + '?format=txt_download'
+
+    response = get(url + '&start_line=3', user=admin, expect=200)
+    assert smart_str(response.getvalue()).splitlines() == ['Testing 1b', 'Testing 2a', 'Testing 2b', 'Testing 3a', 'Testing 3b', 'Testing 4a', 'Testing 4b']
+
+    response = get(url, user=admin, expect=206, HTTP_RANGE='lines=8-')
+    assert response['Content-Range'] == 'lines 8-*/*'
+    assert smart_str(response.getvalue()).splitlines() == ['Testing 4a', 'Testing 4b']
+
+
+@pytest.mark.django_db
+def test_stdout_download_resume_counts_newlines_only():
+    created = tz_now()
+    job = Job(created=created)
+    job.save()
+    # a progress bar redrawn with carriage returns is a single line
+    JobEvent(job=job, stdout='progress 50%\rprogress 100%\r\nTesting done', start_line=0, end_line=2, counter=1, job_created=created).save()
+    assert ''.join(job.result_stdout_chunks(start_line=1)) == 'Testing done'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('fmt', ['txt', 'txt_download'])
+def test_stdout_from_event_archive(get, admin, fmt):
+    created = tz_now()
+    job = Job(created=created, status='successful')
+    job.save()
+    for i in range(3):
+        JobEvent(job=job, stdout='Testing {}'.format(i), start_line=i, end_line=i + 1, counter=i + 1, job_created=created).save()
+    UnifiedJobEventArchive.archive(job)
+    assert job.get_event_queryset().count() == 0
+
+    url = reverse('api:job_stdout', kwargs={'pk': job.pk}) + '?format=' + fmt
+    response = get(url, user=admin, expect=200)
+    content = response.getvalue() if response.streaming else response.content
+    assert smart_str(content).splitlines() == ['Testing 0', 'Testing 1', 'Testing 2']
+
+    job = Job.objects.get(pk=job.pk)
+    assert ''.join(job.result_stdout_chunks(start_line=2)) == 'Testing 2'
@@ -3,13 +3,18 @@ import time
 from unittest import mock
 from uuid import uuid4
 
-from django.test import TransactionTestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TransactionTestCase, override_settings
+from django.utils.timezone import now as tz_now
 
-from awx.main.dispatch.worker.callback import job_stats_wrapup, CallbackBrokerWorker
+from awx.main.dispatch.worker.callback import job_stats_wrapup, AdaptiveFlushPolicy, CallbackBrokerWorker, EventBroadcaster
+from awx.main.dispatch.worker.event_writers import CopyEventWriter, BulkCreateEventWriter, get_event_writer
 
+from awx.main.consumers import emit_channel_notifications
 from awx.main.models.jobs import Job
 from awx.main.models.inventory import InventoryUpdate, InventorySource
-from awx.main.models.events import InventoryUpdateEvent
+from awx.main.models.events import InventoryUpdateEvent, JobEvent
+from awx.main.queue import CallbackQueueDispatcher, get_callback_queue_names
 
 
 @pytest.mark.django_db
@@ -55,8 +60,9 @@ class FakeRedis:
 class TestCallbackBrokerWorker(TransactionTestCase):
     @pytest.fixture(autouse=True)
     def turn_off_websockets(self):
-        with mock.patch('awx.main.dispatch.worker.callback.emit_event_detail', lambda *a, **kw: None):
-            yield
+        with override_settings(JOB_EVENT_BROADCAST_QUEUE_SIZE=0):
+            with mock.patch('awx.main.dispatch.worker.callback.emit_channel_notifications', lambda *a, **kw: None):
+                yield
 
     def get_worker(self):
         with mock.patch('redis.Redis', new=FakeRedis):  # turn off redis stuff
@@ -89,6 +95,29 @@ class TestCallbackBrokerWorker(TransactionTestCase):
         assert InventoryUpdateEvent.objects.filter(uuid=events[2].uuid).count() == 1
         assert worker.buff == {InventoryUpdateEvent: [events[1]]}
 
+    def test_flush_bisects_failing_batch(self):
+        worker = self.get_worker()
+        kwargs = self.event_create_kwargs()
+        events = [InventoryUpdateEvent(uuid=str(uuid4()), stdout=f'good{i}', **kwargs) for i in range(7)]
+        bad_event = InventoryUpdateEvent(uuid=str(uuid4()), stdout='bad', counter=-2, **kwargs)
+        events.insert(5, bad_event)
+        worker.buff = {InventoryUpdateEvent: events.copy()}
+        with mock.patch.object(InventoryUpdateEvent, 'save', autospec=True, side_effect=InventoryUpdateEvent.save) as save_mock:
+            worker.flush()
+        # only the bad event and its neighbor in the final bisected pair are saved individually
+        assert save_mock.call_count == 2
+        assert InventoryUpdateEvent.objects.filter(uuid__in=[e.uuid for e in events]).count() == 7
+        assert worker.buff == {InventoryUpdateEvent: [bad_event]}
+
+    def test_copy_writer_falls_back_to_bulk_create(self):
+        worker = self.get_worker()
+        worker.writer = CopyEventWriter()
+        events = [InventoryUpdateEvent(uuid=str(uuid4()), **self.event_create_kwargs())]
+        worker.buff = {InventoryUpdateEvent: events}
+        worker.flush()
+        assert worker.buff.get(InventoryUpdateEvent, []) == []
+        assert InventoryUpdateEvent.objects.filter(uuid=events[0].uuid).count() == 1
+
     def test_duplicate_key_not_saved_twice(self):
         worker = self.get_worker()
         events = [InventoryUpdateEvent(uuid=str(uuid4()), **self.event_create_kwargs())]
@@ -123,6 +152,20 @@ class TestCallbackBrokerWorker(TransactionTestCase):
             worker.flush()
         flush_mock.assert_not_called()
 
+    def test_buffered_bytes_count_encoded_stdout(self):
+        worker = self.get_worker()
+        inventory_update = self.event_create_kwargs()['inventory_update']
+        with mock.patch.object(worker, 'flush'):
+            worker.perform_work({'inventory_update_id': inventory_update.id, 'uuid': str(uuid4()), 'stdout': '\u2603' * 10})
+        assert worker.buffered_bytes == 30
+
+    def test_read_timeout_resets_queue_depth(self):
+        worker = self.get_worker()
+        worker.redis = mock.Mock(blpop=mock.Mock(return_value=None))
+        worker.flush_policy.observe_queue_depth(500)
+        assert worker.read(None) == {'event': 'FLUSH'}
+        assert worker.flush_policy.queue_depth == 0
+
     def test_postgres_invalid_NUL_char(self):
         # In postgres, text fields reject NUL character, 0x00
         # tests use sqlite3 which will not raise an error
@@ -144,3 +187,186 @@ class TestCallbackBrokerWorker(TransactionTestCase):
 
             event = InventoryUpdateEvent.objects.get(uuid=events[0].uuid)
             assert "\x00" not in event.stdout
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name, writer_cls', [('copy', CopyEventWriter), ('bulk_create', BulkCreateEventWriter), ('unknown', BulkCreateEventWriter)])
+def test_get_event_writer(name, writer_cls):
+    assert type(get_event_writer(name)) is writer_cls
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_SHARDS=1, JOB_EVENT_WORKERS=4)
+def test_unsharded_callback_queue():
+    assert get_callback_queue_names() == ['callback_tasks']
+    assert CallbackBrokerWorker.queues_for_worker(3) == ['callback_tasks']
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_SHARDS=8, JOB_EVENT_WORKERS=4)
+def test_sharded_callback_queue_worker_affinity():
+    assert CallbackBrokerWorker.queues_for_worker(0) == ['callback_tasks_0', 'callback_tasks_4', 'callback_tasks']
+    assert CallbackBrokerWorker.queues_for_worker(1) == ['callback_tasks_1', 'callback_tasks_5']
+    # every shard is bound to exactly one worker
+    bound = [q for idx in range(4) for q in CallbackBrokerWorker.queues_for_worker(idx) if q != 'callback_tasks']
+    assert sorted(bound) == sorted(get_callback_queue_names())
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_SHARDS=2, JOB_EVENT_WORKERS=4)
+def test_fewer_callback_queue_shards_than_workers():
+    # workers sharing a shard would not process the events of a job in order
+    with pytest.raises(ImproperlyConfigured):
+        CallbackBrokerWorker.queues_for_worker(0)
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_SHARDS=8)
+def test_sharded_callback_queue_dispatch():
+    with mock.patch('redis.Redis', new=FakeRedis):
+        dispatcher = CallbackQueueDispatcher()
+    assert dispatcher.queue_for({'job_id': 13, 'counter': 1}) == 'callback_tasks_5'
+    assert dispatcher.queue_for({'job_id': 13, 'event': 'EOF'}) == 'callback_tasks_5'
+    assert dispatcher.queue_for({'inventory_update_id': 16}) == 'callback_tasks_0'
+
+
+def broadcast_event(job_id, event, counter):
+    return JobEvent(job_id=job_id, event=event, counter=counter, uuid=str(uuid4()), created=tz_now())
+
+
+@pytest.mark.django_db
+@override_settings(UI_LIVE_UPDATES_ENABLED=True)
+@mock.patch('awx.main.dispatch.worker.callback.job_stats_wrapup')
+@mock.patch('awx.main.dispatch.worker.callback.emit_channel_notifications')
+def test_event_broadcaster_batch(emit, wrapup):
+    broadcaster = EventBroadcaster(mock.Mock())
+    events = [broadcast_event(1, 'runner_on_ok', counter) for counter in range(1, 4)]
+    stats = broadcast_event(1, 'playbook_on_stats', 4)
+    broadcaster.process([('event', e) for e in events] + [('wrapup', 1, stats), ('event', stats), ('summary', 1, 4)], broadcaster.metrics)
+    # the events that precede the wrapup are sent before it, in one call
+    assert [call.args[0] for call in emit.call_args_list] == [
+        [('job_events-1', mock.ANY)] * 3,
+        [('job_events-1', mock.ANY), ('jobs-summary', dict(group_name='jobs', unified_job_id=1, final_counter=4))],
+    ]
+    assert [payload['counter'] for group, payload in emit.call_args_list[0].args[0]] == [1, 2, 3]
+    wrapup.assert_called_once_with(1, event=stats)
+    broadcaster.metrics.inc.assert_called_once_with('callback_receiver_events_broadcast', 4)
+
+
+@pytest.mark.django_db
+@override_settings(UI_LIVE_UPDATES_ENABLED=True)
+@mock.patch('awx.main.dispatch.worker.callback.emit_channel_notifications')
+def test_event_broadcaster_event_batch(emit):
+    broadcaster = EventBroadcaster(mock.Mock())
+    batch = {'event': 'event_batch', 'job_id': 1, 'counters': [[3, 5]], 'stdout_lines': ['ok 5'], 'start_line': 3, 'end_line': 6}
+    broadcaster.process([('event_batch', JobEvent, 1, batch)], broadcaster.metrics)
+    emit.assert_called_once_with(
+        [
+            (
+                'job_events-1',
+                {'job': 1, 'group_name': 'job_events', 'event': 'event_batch', 'counters': [[3, 5]], 'stdout_lines': ['ok 5'], 'start_line': 3, 'end_line': 6},
+            )
+        ]
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    'coalesce, expected',
+    [
+        (
+            False,
+            [
+                ('job_events-1', {'type': 'internal.message', 'text': '{"counter": 1}', 'needs_relay': True}),
+                ('job_events-1', {'type': 'internal.message', 'text': '{"counter": 2}', 'needs_relay': True}),
+            ],
+        ),
+        (True, [('job_events-1', {'type': 'internal.messages', 'texts': ['{"counter": 1}', '{"counter": 2}'], 'needs_relay': True})]),
+    ],
+)
+def test_emit_channel_notifications(coalesce, expected):
+    channel_layer = mock.Mock(group_send=mock.AsyncMock())
+    with override_settings(BROADCAST_WEBSOCKET_COALESCE_MESSAGES=coalesce), mock.patch('awx.main.consumers.get_channel_layer', return_value=channel_layer):
+        emit_channel_notifications([('job_events-1', {'counter': 1}), ('job_events-1', {'counter': 2})])
+    # nodes that were not upgraded yet only understand internal.message
+    assert [c.args for c in channel_layer.group_send.call_args_list] == expected
+
+
+@override_settings(JOB_EVENT_BROADCAST_QUEUE_SIZE=2)
+def test_event_broadcaster_drops_non_minimal_events_first():
+    broadcaster = EventBroadcaster(mock.Mock())
+    broadcaster.thread = mock.Mock()  # do not drain the queue
+    ok = [broadcast_event(1, 'runner_on_ok', counter) for counter in range(1, 4)]
+    task_start = broadcast_event(1, 'playbook_on_task_start', 4)
+    broadcaster.event(ok[0])
+    broadcaster.event(ok[1])
+    broadcaster.event(ok[2])  # queue is full, dropped
+    broadcaster.event(task_start)  # evicts the oldest non-minimal event
+    broadcaster.summary(1, 4)  # evicts the other one
+    assert [item for item, priority in broadcaster.items] == [('event', task_start), ('summary', 1, 4)]
+    assert broadcaster.dropped == 3
+
+
+@pytest.mark.django_db
+@override_settings(JOB_EVENT_BROADCAST_QUEUE_SIZE=100, UI_LIVE_UPDATES_ENABLED=True)
+@mock.patch('awx.main.dispatch.worker.callback.s_metrics.Metrics', mock.Mock())
+@mock.patch('awx.main.dispatch.worker.callback.emit_channel_notifications')
+def test_event_broadcaster_thread(emit):
+    broadcaster = EventBroadcaster(mock.Mock())
+    for counter in range(1, 6):
+        broadcaster.event(broadcast_event(1, 'runner_on_ok', counter))
+    broadcaster.stop()
+    assert not broadcaster.thread.is_alive()
+    sent = [payload['counter'] for call in emit.call_args_list for group, payload in call.args[0]]
+    assert sent == [1, 2, 3, 4, 5]
+
+
+@override_settings(JOB_EVENT_BROADCAST_QUEUE_SIZE=100)
+@mock.patch('awx.main.dispatch.worker.callback.s_metrics.Metrics', mock.Mock())
+@mock.patch('awx.main.dispatch.worker.callback.django_connection')
+@mock.patch('awx.main.dispatch.worker.callback.job_stats_wrapup')
+@mock.patch('awx.main.dispatch.worker.callback.emit_channel_notifications', mock.Mock())
+def test_event_broadcaster_thread_recycles_connection(wrapup, connection):
+    broadcaster = EventBroadcaster(mock.Mock())
+    broadcaster.wrapup(1)
+    broadcaster.stop()
+    wrapup.assert_called_once_with(1, event=None)
+    connection.close_if_unusable_or_obsolete.assert_called()
+    connection.close.assert_called_once_with()
+
+
+FLUSH_POLICY_SETTINGS = dict(
+    JOB_EVENT_BUFFER_MIN_BATCH=100,
+    JOB_EVENT_BUFFER_MAX_BATCH=5000,
+    JOB_EVENT_BUFFER_TARGET_SECONDS=0.5,
+    JOB_EVENT_BUFFER_SECONDS=1,
+    JOB_EVENT_BUFFER_MAX_BYTES=1024,
+    JOB_EVENT_QUEUE_DEPTH_INTERVAL=0.1,
+)
+
+
+@override_settings(**FLUSH_POLICY_SETTINGS)
+def test_adaptive_flush_policy_batch_size():
+    policy = AdaptiveFlushPolicy()
+    assert policy.batch_size == 100
+    # a deep backlog grows the batch, up to the bound
+    policy.observe_queue_depth(2000)
+    assert policy.batch_size == 2000
+    policy.observe_queue_depth(50000)
+    assert policy.batch_size == 5000
+    # slow inserts cap the batch at what can be inserted in the target time
+    policy.observe_insert(1000, 0.5)
+    assert policy.batch_size == 1000
+    # a drained queue favors latency
+    policy.observe_queue_depth(0)
+    assert policy.batch_size == 100
+
+
+@override_settings(**FLUSH_POLICY_SETTINGS)
+def test_adaptive_flush_policy_reasons():
+    policy = AdaptiveFlushPolicy()
+    policy.observe_queue_depth(500)
+    assert policy.flush_reason({InventoryUpdateEvent: []}, 0, 5.0) is None
+    assert policy.flush_reason({InventoryUpdateEvent: [object()] * 10}, 0, 0.5) is None
+    assert policy.flush_reason({InventoryUpdateEvent: [object()] * 10}, 2048, 0.5) == 'memory'
+    assert policy.flush_reason({InventoryUpdateEvent: [object()] * 500}, 0, 0.5) == 'batch_size'
+    assert policy.flush_reason({InventoryUpdateEvent: [object()] * 10}, 0, 1.5) == 'time'
+    policy.observe_queue_depth(0)
+    assert policy.flush_reason({InventoryUpdateEvent: [object()]}, 0, 0.05) is None
+    assert policy.flush_reason({InventoryUpdateEvent: [object()]}, 0, 0.5) == 'idle'
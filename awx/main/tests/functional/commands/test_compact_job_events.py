@@ -0,0 +1,82 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+
+from django.core.management import call_command
+from django.utils.timezone import now
+
+from awx.main.models import Job, JobEvent, ProjectUpdate, UnifiedJobEventArchive, UnifiedJobEventArchiveChunk
+
+
+def _mk_job(days_ago, status='successful'):
+    created = now() - timedelta(days=days_ago)
+    job = Job.objects.create(created=created, finished=created, status=status)
+    for i in range(3):
+        JobEvent.create_from_data(
+            job_id=job.pk, uuid='uuid{}'.format(i), event='verbose', counter=i + 1, stdout='line {}'.format(i), job_created=created
+        ).save()
+    return job
+
+
+@pytest.mark.django_db
+def test_compact_job_events():
+    old, recent, running = _mk_job(40), _mk_job(10), _mk_job(40, status='running')
+    created = list(old.get_event_queryset().order_by('counter').values_list('created', flat=True))
+    call_command('compact_job_events', '--days', '30')
+
+    assert old.get_event_queryset().count() == 0
+    archive = UnifiedJobEventArchive.objects.get(unified_job=old)
+    assert archive.event_count == 3
+    assert archive.stdout_length == len('line 0line 1line 2')
+    events = archive.get_events(JobEvent)
+    assert [(e.counter, e.uuid, e.stdout, e.job_id) for e in events] == [(i + 1, 'uuid{}'.format(i), 'line {}'.format(i), old.pk) for i in range(3)]
+    assert [e.created for e in events] == created
+
+    for job in (recent, running):
+        assert job.get_event_queryset().count() == 3
+        assert not UnifiedJobEventArchive.objects.filter(unified_job=job).exists()
+
+    old = Job.objects.get(pk=old.pk)
+    assert old.event_processing_finished
+    assert old.result_stdout == 'line 0\nline 1\nline 2'
+
+    # jobs are only archived once
+    call_command('compact_job_events', '--days', '30')
+    assert UnifiedJobEventArchive.objects.count() == 1
+    assert not ProjectUpdate.objects.filter(event_archive__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_compact_job_events_dry_run():
+    job = _mk_job(40)
+    call_command('compact_job_events', '--days', '30', '--dry-run')
+    assert job.get_event_queryset().count() == 3
+    assert not UnifiedJobEventArchive.objects.exists()
+
+
+@pytest.mark.django_db
+def test_archived_events_read_by_chunk(settings):
+    settings.JOB_EVENT_ARCHIVE_CHUNK_SIZE = 2
+    job = Job.objects.create(status='successful')
+    for i in range(5):
+        JobEvent.create_from_data(
+            job_id=job.pk, uuid='uuid{}'.format(i), event='verbose', counter=i + 1, stdout='line {}'.format(i), job_created=job.created
+        ).save()
+    archive = UnifiedJobEventArchive.archive(job)
+    assert list(archive.chunks.order_by('first_index').values_list('first_index', 'first_counter', 'last_counter')) == [(0, 1, 2), (2, 3, 4), (4, 5, 5)]
+    assert archive.compressed_length == sum(len(chunk.data) for chunk in archive.chunks.all())
+
+    events = archive.get_events(JobEvent)
+    assert len(events) == 5
+    assert [e.counter for e in events] == [1, 2, 3, 4, 5]
+    with mock.patch.object(UnifiedJobEventArchiveChunk, 'iter_rows', autospec=True, side_effect=UnifiedJobEventArchiveChunk.iter_rows) as iter_rows:
+        assert [e.counter for e in events[2:4]] == [3, 4]
+    # only the chunk that holds the page is decompressed
+    assert [call.args[0].first_index for call in iter_rows.call_args_list] == [2]
+
+    narrowed = events.filter_counter('gt', 1).filter_counter('lte', 4)
+    assert len(narrowed) == 3
+    assert [e.counter for e in narrowed[1:]] == [3, 4]
+    assert narrowed[0].stdout == 'line 1'
+    assert len(events.filter_counter('exact', 9)) == 0
@@ -631,9 +631,15 @@ def _request(verb):
             assert response.status_code == expect, 'Response data: {}'.format(getattr(response, 'data', None))
         if hasattr(response, 'render'):
             response.render()
+        if getattr(response, 'streaming', False):
+            # consume streamed responses (e.g., stdout downloads), they can be read once with getvalue()
+            content = b''.join(response.streaming_content)
+            response.streaming_content = [content]
+        else:
+            content = response.content
         __SWAGGER_REQUESTS__.setdefault(request.path, {})[(request.method.lower(), response.status_code)] = (
             response.get('Content-Type', None),
-            response.content,
+            content,
             kwargs.get('data'),
         )
         return response
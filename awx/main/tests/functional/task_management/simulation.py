@@ -0,0 +1,226 @@
+"""
+Offline simulation of the task managers, to measure how they behave with a
+large backlog before it happens on a live system.
+
+A SchedulerSimulation builds a synthetic cluster (a control plane group and a
+default execution group) and organizations with projects, inventories, job
+templates and workflows in the test database, launches a backlog of jobs and
+then runs cycles of DependencyManager, TaskManager and WorkflowManager.  It
+also plays the part of the dispatcher: a task the task manager moved to
+waiting is running on the next cycle, and finishes successfully a few cycles
+later.  Time is counted in cycles.
+
+report() returns how long each manager took and how many queries it made per
+cycle, how many tasks were started per second of task manager time, how long
+tasks waited, and how fairly organizations were served while competing, see
+format_report() and test_scheduler_benchmark.py.
+"""
+
+import collections
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from awx.main.models import Inventory, JobTemplate, Organization, Project, UnifiedJob, WorkflowJob, WorkflowJobTemplate
+from awx.main.scheduler import DependencyManager, TaskManager, WorkflowManager
+from awx.main.tests.factories import create_instance, create_instance_group
+
+
+def jain_index(values):
+    """Jain's fairness index, 1.0 when all values are equal and 1/n when a single one is not zero"""
+    values = list(values)
+    if not values or not any(values):
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class SchedulerSimulation:
+    MANAGERS = (DependencyManager, TaskManager, WorkflowManager)
+
+    def __init__(self, seed=0, durations=(1, 5)):
+        self.rng = random.Random(seed)
+        # how many cycles tasks run for, unless given when launched
+        self.durations = durations
+        self.cycle = 0
+        self.job_templates = collections.defaultdict(list)
+        self.workflow_job_templates = collections.defaultdict(list)
+        self.organization_names = {}
+        # task pk -> cycle it was launched, started, or has to finish at
+        self.launched = {}
+        self.started = {}
+        self.finish_at = {}
+        self.duration = {}
+        # manager name -> [(seconds, queries)] per cycle
+        self.cycles = collections.defaultdict(list)
+        # organization -> tasks started while organizations were competing
+        self.contended_starts = collections.Counter()
+
+    def add_cluster(self, control=1, execution=4, capacity=200):
+        """Create the control plane and default instance groups, returning the execution instances"""
+        control_instances = [create_instance(f'control-{i}', node_type='control', capacity=capacity) for i in range(control)]
+        create_instance_group(settings.DEFAULT_CONTROL_PLANE_QUEUE_NAME, instances=control_instances)
+        execution_instances = [create_instance(f'execution-{i}', node_type='execution', capacity=capacity) for i in range(execution)]
+        create_instance_group(settings.DEFAULT_EXECUTION_QUEUE_NAME, instances=execution_instances)
+        return execution_instances
+
+    def add_organization(self, name, job_templates=2, workflow_length=0, update_on_launch=True):
+        """
+        Create an organization with a project and an inventory, `job_templates`
+        job templates and, if `workflow_length`, a workflow running that many of
+        them one after another.  With `update_on_launch`, the project is updated
+        before its jobs run, but only once per cycle.
+        """
+        organization = Organization.objects.create(name=name)
+        self.organization_names[organization.pk] = name
+        project = Project(
+            name=f'{name}-project',
+            organization=organization,
+            scm_type='git',
+            scm_url='localhost',
+            scm_update_on_launch=update_on_launch,
+            playbook_files=['helloworld.yml'],
+        )
+        project.save(skip_update=True)
+        inventory = Inventory.objects.create(name=f'{name}-inventory', organization=organization)
+        for i in range(job_templates):
+            self.job_templates[organization.pk].append(
+                JobTemplate.objects.create(
+                    name=f'{name}-jt-{i}', organization=organization, project=project, inventory=inventory, playbook='helloworld.yml', allow_simultaneous=True
+                )
+            )
+        if workflow_length:
+            wfjt = WorkflowJobTemplate.objects.create(name=f'{name}-workflow', organization=organization, allow_simultaneous=True)
+            parent = None
+            for i in range(workflow_length):
+                node = wfjt.workflow_nodes.create(unified_job_template=self.rng.choice(self.job_templates[organization.pk]))
+                if parent is not None:
+                    parent.success_nodes.add(node)
+                parent = node
+            self.workflow_job_templates[organization.pk].append(wfjt)
+        return organization
+
+    def submit(self, task, task_impact=None, duration=None):
+        task.status = 'pending'
+        task.save()
+        if task_impact is not None:
+            UnifiedJob.objects.filter(pk=task.pk).update(task_impact=task_impact)
+        if duration is not None:
+            self.duration[task.pk] = duration
+        self.launched[task.pk] = self.cycle
+
+    def launch(self, organization, count, task_impact=(5, 50), duration=None):
+        """Launch `count` jobs of the organization's job templates, with a random impact in the `task_impact` range"""
+        for i in range(count):
+            job = self.rng.choice(self.job_templates[organization.pk]).create_unified_job()
+            self.submit(job, task_impact=self.rng.randint(*task_impact), duration=duration)
+
+    def launch_workflows(self, organization, count):
+        for i in range(count):
+            self.submit(self.rng.choice(self.workflow_job_templates[organization.pk]).create_unified_job())
+
+    def active_tasks(self):
+        return UnifiedJob.objects.filter(status__in=['pending', 'waiting', 'running'])
+
+    def run_tasks(self):
+        """Do what the dispatcher would: run the tasks started by the task manager, and finish them"""
+        for task in self.active_tasks().exclude(status='pending'):
+            if isinstance(task, WorkflowJob):
+                # the workflow manager runs those
+                continue
+            if task.status == 'waiting':
+                task.status = 'running'
+                task.save()
+                duration = self.duration.get(task.pk) or self.rng.randint(*self.durations)
+                self.finish_at[task.pk] = self.cycle + duration
+            elif self.finish_at.get(task.pk, self.cycle) <= self.cycle:
+                task.status = 'successful'
+                task.save()
+
+    def run_manager(self, manager_class):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            manager_class().schedule()
+            elapsed = time.perf_counter() - start
+        self.cycles[manager_class.__name__].append((elapsed, len(queries)))
+
+    def run_cycle(self):
+        self.cycle += 1
+        self.run_tasks()
+        for manager_class in self.MANAGERS:
+            if manager_class is not TaskManager:
+                self.run_manager(manager_class)
+                continue
+            pending = dict(UnifiedJob.objects.filter(status='pending', dependencies_processed=True).values_list('pk', 'organization_id'))
+            for pk in pending:
+                # dependencies and the jobs of workflows are launched by the other managers
+                self.launched.setdefault(pk, self.cycle)
+            self.run_manager(manager_class)
+            started = UnifiedJob.objects.filter(pk__in=pending).exclude(status='pending').values_list('pk', flat=True)
+            for pk in started:
+                self.started[pk] = self.cycle
+            if len(set(pending.values())) > 1:
+                for pk in started:
+                    self.contended_starts[pending[pk]] += 1
+                # organizations that could not start anything count as well
+                for organization_id in pending.values():
+                    self.contended_starts.setdefault(organization_id, 0)
+
+    def run(self, max_cycles=100):
+        """Run cycles until all tasks are finished, or for `max_cycles`"""
+        for i in range(max_cycles):
+            self.run_cycle()
+            if not self.active_tasks().exists():
+                break
+        return self.report()
+
+    def report(self):
+        managers = {}
+        for name, cycles in self.cycles.items():
+            seconds = [s for s, _ in cycles]
+            queries = [q for _, q in cycles]
+            managers[name] = dict(
+                cycles=len(cycles),
+                avg_seconds=sum(seconds) / len(seconds),
+                max_seconds=max(seconds),
+                avg_queries=sum(queries) / len(queries),
+                max_queries=max(queries),
+            )
+        waits = {pk: started - self.launched[pk] for pk, started in self.started.items()}
+        waits_by_organization = collections.defaultdict(list)
+        for pk, organization_id in UnifiedJob.objects.filter(pk__in=waits).values_list('pk', 'organization_id'):
+            waits_by_organization[self.organization_names.get(organization_id, organization_id)].append(waits[pk])
+        task_manager_seconds = sum(s for s, _ in self.cycles['TaskManager'])
+        return dict(
+            cycles=self.cycle,
+            managers=managers,
+            started=len(self.started),
+            started_per_second=len(self.started) / task_manager_seconds if task_manager_seconds else 0,
+            wait_avg=sum(waits.values()) / len(waits) if waits else 0,
+            wait_p95=percentile(waits.values(), 0.95),
+            wait_max=max(waits.values(), default=0),
+            wait_by_organization={name: sum(w) / len(w) for name, w in sorted(waits_by_organization.items())},
+            fairness=jain_index(self.contended_starts.values()),
+        )
+
+
+def format_report(report):
+    lines = [
+        f'{report["cycles"]} cycles, {report["started"]} tasks started ({report["started_per_second"]:.1f} per second of task manager time)',
+        f'{"manager":<20}{"avg s":>10}{"max s":>10}{"avg queries":>13}{"max queries":>13}',
+    ]
+    for name, m in report['managers'].items():
+        lines.append(f'{name:<20}{m["avg_seconds"]:>10.4f}{m["max_seconds"]:>10.4f}{m["avg_queries"]:>13.1f}{m["max_queries"]:>13}')
+    lines.append(f'wait (cycles): avg {report["wait_avg"]:.1f}, p95 {report["wait_p95"]}, max {report["wait_max"]}')
+    lines.append('wait by organization: ' + ', '.join(f'{name} {wait:.1f}' for name, wait in report['wait_by_organization'].items()))
+    lines.append(f'fairness while competing (Jain index): {report["fairness"]:.2f}')
+    return '\n'.join(lines)
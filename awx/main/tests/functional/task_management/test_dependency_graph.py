@@ -0,0 +1,52 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from awx.main.models import Job, WorkflowJob
+from awx.main.scheduler import TaskManager
+from awx.main.scheduler.dependency_graph import DependencyGraph
+from . import create_job
+
+
+@pytest.mark.django_db
+def test_blocking_checks_query_count(job_template_factory, inventory_source_factory, django_assert_num_queries):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    objects.job_template.allow_simultaneous = True
+    objects.job_template.save()
+    inventory_update = inventory_source_factory('src', inventory=objects.inventory).create_inventory_update()
+    inventory_update.status = 'running'
+    inventory_update.dependencies_processed = True
+    inventory_update.save()
+
+    def check_blocking():
+        with CaptureQueriesContext(connection) as queries:
+            tasks = list(TaskManager().get_task_queryset(dict(status__in=['pending', 'waiting', 'running'], dependencies_processed=True)))
+            pending = [task for task in tasks if task.status == 'pending']
+            with django_assert_num_queries(0):
+                graph = DependencyGraph()
+                graph.add_jobs([task for task in tasks if task.status == 'running'])
+                assert [graph.task_blocked_by(task) for task in pending] == [inventory_update] * len(pending)
+        return len(pending), len(queries)
+
+    # warm up content type caches
+    check_blocking()
+
+    for i in range(2):
+        create_job(objects.job_template)
+    pending, queries = check_blocking()
+    assert pending == 2
+
+    for i in range(5):
+        create_job(objects.job_template)
+    assert check_blocking() == (7, queries)
+
+
+def test_sliced_workflow_blocked_by_job_template_job():
+    job = Job(id=1, job_template_id=42)
+    sliced = WorkflowJob(id=2, unified_job_template_id=42, allow_simultaneous=False)
+    graph = DependencyGraph()
+    assert graph.task_blocked_by(sliced) is None
+    graph.add_job(job)
+    assert graph.task_blocked_by(sliced) is job
+    assert graph.get_item(DependencyGraph.JOB_TEMPLATE, 42) is job
@@ -5,10 +5,11 @@ from datetime import timedelta
 
 from awx.main.scheduler import TaskManager, DependencyManager, WorkflowManager
 from awx.main.utils import encrypt_field
-from awx.main.models import WorkflowJobTemplate, JobTemplate, Job
+from awx.main.models import WorkflowJobTemplate, JobTemplate, Job, ProjectUpdate
 from awx.main.models.ha import Instance
 from . import create_job
 from django.conf import settings
+from django.utils.timezone import now as tz_now
 
 
 @pytest.mark.django_db
@@ -526,3 +527,147 @@ def test_generate_dependencies_only_once(job_template_factory):
         dm.generate_dependencies = mock.MagicMock(return_value=[])
         dm.schedule()
         dm.generate_dependencies.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_shared_dependencies_created_once_per_cycle(job_template_factory, inventory_source_factory):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    p = objects.project
+    p.scm_update_on_launch = True
+    p.scm_type = "git"
+    p.scm_url = "http://github.com/ansible/ansible.git"
+    p.save()
+    ii = inventory_source_factory("ec2", inventory=objects.inventory)
+    ii.source = "ec2"
+    ii.update_on_launch = True
+    ii.save()
+    jobs = [create_job(objects.job_template, dependencies_processed=False) for i in range(3)]
+
+    with mock.patch("awx.main.scheduler.TaskManager.start_task"):
+        DependencyManager().schedule()
+
+    pu = p.project_updates.get()
+    iu = ii.inventory_updates.get()
+    for job in jobs:
+        job.refresh_from_db()
+        assert job.dependencies_processed
+        assert set(job.dependent_jobs.all()) == {pu, iu}
+
+
+@pytest.mark.django_db
+def test_latest_updates_by_project(project_factory):
+    p1 = project_factory('p1')
+    p2 = project_factory('p2')
+    now = tz_now()
+    updates = {}
+    for project in (p1, p2):
+        for minutes in (10, 5):
+            update = project.create_project_update()
+            ProjectUpdate.objects.filter(pk=update.pk).update(created=now - timedelta(minutes=minutes))
+            updates[project.id] = update
+
+    latest = DependencyManager.get_latest_updates(ProjectUpdate.objects.filter(project_id__in=[p1.id, p2.id]), 'project_id')
+    assert latest == updates
+
+
+@pytest.mark.django_db
+def test_tasks_started_in_bulk(controlplane_instance_group, job_template_factory, mocker, django_capture_on_commit_callbacks):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    jt = objects.job_template
+    jt.allow_simultaneous = True
+    jt.save()
+    jobs = [create_job(jt) for i in range(3)]
+    submit_tasks = mocker.patch.object(TaskManager, 'submit_tasks')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        TaskManager().schedule()
+
+    submit_tasks.assert_called_once()
+    messages = submit_tasks.call_args[0][0]
+    assert len(messages) == 3
+    for job, (queue, body) in zip(jobs, messages):
+        job.refresh_from_db()
+        assert job.status == 'waiting'
+        assert job.instance_group == controlplane_instance_group
+        assert queue == job.controller_node == 'hybrid-1'
+        assert body['uuid'] == job.celery_task_id
+        assert body['args'] == [job.pk]
+    jt.refresh_from_db()
+    assert jt.current_job == jobs[-1]
+    assert jt.status == 'waiting'
+
+
+@pytest.mark.django_db
+def test_fair_share_scheduling(controlplane_instance_group, job_template_factory, mocker, settings):
+    settings.TASK_MANAGER_SCHEDULING = 'fair_share'
+    settings.START_TASK_LIMIT = 3
+    busy = job_template_factory('busy', organization='org1', project='proj1', inventory='inv1', credential='cred1').job_template
+    other = job_template_factory('other', organization='org2', project='proj2', inventory='inv2', credential='cred2').job_template
+    busy.allow_simultaneous = True
+    busy.save()
+    busy_jobs = [create_job(busy) for i in range(5)]
+    other_job = create_job(other)
+    # one task per turn
+    settings.TASK_MANAGER_FAIR_SHARE_QUANTUM = max(other_job.task_impact, 1)
+
+    tm = TaskManager()
+    tm.schedule()
+    started = [job for job in busy_jobs + [other_job] if Job.objects.get(pk=job.pk).status == 'waiting']
+    assert started == [busy_jobs[0], busy_jobs[1], other_job]
+    metrics = tm.subsystem_metrics.METRICS
+    busy_queue, other_queue = f'organization-{busy.organization_id}', f'organization-{other.organization_id}'
+    assert metrics['task_manager_queue_started'].current_value == {busy_queue: 2, other_queue: 1}
+    assert metrics['task_manager_queue_pending'].current_value == {busy_queue: 3}
+    assert metrics['task_manager_queue_wait_seconds'].current_value[busy_queue] > 0
+
+    # only the busiest queues are named in the metrics
+    settings.TASK_MANAGER_QUEUE_METRICS_LIMIT = 1
+    create_job(other)
+    tm = TaskManager()
+    tm.schedule()
+    metrics = tm.subsystem_metrics.METRICS
+    # the new job of other waits for the first one to finish
+    assert metrics['task_manager_queue_started'].current_value == {busy_queue: 3}
+    assert metrics['task_manager_queue_pending'].current_value == {'other': 1}
+
+
+@pytest.mark.django_db
+def test_template_priority(controlplane_instance_group, job_template_factory, mocker):
+    low = job_template_factory('low', organization='org1', project='proj1', inventory='inv1', credential='cred1').job_template
+    high = job_template_factory('high', organization='org2', project='proj2', inventory='inv2', credential='cred2').job_template
+    high.priority = 10
+    high.save()
+    low_job = create_job(low)
+    high_job = create_job(high)
+    start_task = mocker.patch.object(TaskManager, 'start_task')
+
+    TaskManager().schedule()
+    assert [c.args[0] for c in start_task.call_args_list] == [high_job, low_job]
+
+
+@pytest.mark.django_db
+def test_only_pending_tasks_started(controlplane_instance_group, job_template_factory, mocker, django_capture_on_commit_callbacks):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    jt = objects.job_template
+    jt.allow_simultaneous = True
+    jt.save()
+    jobs = [create_job(jt) for i in range(3)]
+    submit_tasks = mocker.patch.object(TaskManager, 'submit_tasks')
+    # the second job is canceled while the task manager runs
+    claim_tasks = TaskManager.claim_tasks
+
+    def cancel_and_claim(tm, tasks):
+        Job.objects.filter(pk=jobs[1].pk).update(status='canceled')
+        return claim_tasks(tm, tasks)
+
+    mocker.patch.object(TaskManager, 'claim_tasks', autospec=True, side_effect=cancel_and_claim)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        TaskManager().schedule()
+
+    messages = submit_tasks.call_args[0][0]
+    assert [body['args'] for queue, body in messages] == [[jobs[0].pk], [jobs[2].pk]]
+    for job, status in zip(jobs, ('waiting', 'canceled', 'waiting')):
+        job.refresh_from_db()
+        assert job.status == status
+    assert jobs[1].celery_task_id == ''
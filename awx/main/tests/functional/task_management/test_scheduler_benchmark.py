@@ -0,0 +1,83 @@
+import math
+
+import pytest
+
+from polymorphic.query import Polymorphic_QuerySet_objects_per_request
+
+from .simulation import SchedulerSimulation, format_report
+
+# the queries of a task manager cycle of test_scheduler_queries, measured
+# with the current code, besides those loading the tasks
+TASK_MANAGER_MAX_QUERIES = 12
+
+
+@pytest.fixture
+def scale(request):
+    return request.config.getoption('--scheduler-benchmark-scale')
+
+
+def print_report(scale, report):
+    if scale > 1:
+        print(format_report(report))
+
+
+@pytest.mark.django_db
+def test_scheduler_benchmark(scale, settings):
+    settings.START_TASK_LIMIT = 20
+    simulation = SchedulerSimulation()
+    simulation.add_cluster(execution=2, capacity=100)
+    organizations = [simulation.add_organization(f'org{i}', workflow_length=3) for i in range(3)]
+    simulation.launch(organizations[0], 30 * scale)
+    simulation.launch(organizations[1], 10 * scale)
+    simulation.launch_workflows(organizations[2], 2 * scale)
+
+    report = simulation.run(max_cycles=100 * scale)
+    print_report(scale, report)
+    assert not simulation.active_tasks().exists()
+    # the jobs, the jobs of the workflows, the workflows, and at least one project update per organization
+    assert report['started'] >= 40 * scale + 8 * scale + 3
+
+
+@pytest.mark.django_db
+def test_scheduler_queries(scale, settings):
+    settings.START_TASK_LIMIT = 20
+    simulation = SchedulerSimulation()
+    simulation.add_cluster(execution=2, capacity=100)
+    organizations = [simulation.add_organization(f'org{i}', update_on_launch=False) for i in range(3)]
+    for organization in organizations:
+        simulation.launch(organization, 30 * scale)
+
+    report = simulation.run(max_cycles=100 * scale)
+    print_report(scale, report)
+    assert report['started'] == 90 * scale
+    # neither the pending tasks nor the tasks started make the task manager
+    # query the database once per task (workflow jobs and tasks failing their
+    # pre-start checks are still saved one by one, so there are none here).
+    # Without a journal in tests, every cycle loads all the tasks, which
+    # takes two queries per batch of polymorphic objects.
+    batches = math.ceil(90 * scale / Polymorphic_QuerySet_objects_per_request)
+    task_manager = report['managers']['TaskManager']
+    assert task_manager['max_queries'] <= TASK_MANAGER_MAX_QUERIES + 2 * batches
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('scheduling, fairness', [('fifo', 0.6), ('fair_share', 0.9)])
+def test_scheduler_fairness(scale, settings, scheduling, fairness):
+    settings.TASK_MANAGER_SCHEDULING = scheduling
+    settings.TASK_MANAGER_FAIR_SHARE_QUANTUM = 20
+    settings.START_TASK_LIMIT = 5
+    simulation = SchedulerSimulation()
+    simulation.add_cluster(execution=1, capacity=1000)
+    busy = simulation.add_organization('busy', update_on_launch=False)
+    other = simulation.add_organization('other', update_on_launch=False)
+    # one organization launches a burst of jobs just before another one
+    simulation.launch(busy, 40 * scale, task_impact=(10, 10), duration=1)
+    simulation.launch(other, 10 * scale, task_impact=(10, 10), duration=1)
+
+    report = simulation.run(max_cycles=50 * scale)
+    print_report(scale, report)
+    assert report['started'] == 50 * scale
+    if scheduling == 'fifo':
+        assert report['fairness'] < fairness
+    else:
+        assert report['fairness'] >= fairness
@@ -0,0 +1,144 @@
+import pytest
+from datetime import timedelta
+
+from django.utils.timezone import now as tz_now
+
+from awx.main.models import Job, TaskManagerChange
+from awx.main.scheduler import TaskManager
+from awx.main.scheduler.task_manager_models import TaskManagerState
+from awx.main.utils.common import TaskManagerJournal
+from . import create_job
+
+
+@pytest.fixture
+def journal(mocker):
+    journal = TaskManagerJournal()
+    mocker.patch('awx.main.utils.common.get_task_manager_journal', return_value=journal)
+    mocker.patch('awx.main.scheduler.task_manager.get_task_manager_journal', return_value=journal)
+    return journal
+
+
+@pytest.fixture
+def state(mocker):
+    state = TaskManagerState()
+    mocker.patch('awx.main.scheduler.task_manager.task_manager_state', state)
+    return state
+
+
+@pytest.mark.django_db
+def test_state_reloads_changed_tasks(job_template_factory, journal, state, django_capture_on_commit_callbacks):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    j1 = create_job(objects.job_template)
+    j2 = create_job(objects.job_template)
+    queryset = TaskManager().get_task_queryset(dict(status__in=['pending', 'waiting', 'running'], dependencies_processed=True))
+
+    assert state.sync(queryset, journal) == (True, 2)
+    state.validate()
+    assert state.sync(queryset, journal) == (False, 0)
+    state.validate()
+
+    j1.status = 'canceled'
+    j1.save()
+    assert TaskManagerChange.objects.order_by('-id').first().unified_job_id == j1.pk
+    assert state.sync(queryset, journal) == (False, 0)
+    assert list(state.tasks) == [j2.pk]
+    state.validate()
+
+    # everything is reloaded once the reconcile interval expired
+    state.reconciled = 0
+    assert state.sync(queryset, journal) == (True, 1)
+
+    # or if the last run did not commit
+    assert state.sync(queryset, journal) == (True, 1)
+
+
+@pytest.mark.django_db
+def test_state_sees_changes_of_other_nodes(job_template_factory, journal):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    j1 = create_job(objects.job_template)
+    queryset = TaskManager().get_task_queryset(dict(status__in=['pending', 'waiting', 'running'], dependencies_processed=True))
+    # the task managers of two nodes
+    node1, node2 = TaskManagerState(), TaskManagerState()
+    for state in (node1, node2):
+        assert state.sync(queryset, journal) == (True, 1)
+        state.validate()
+
+    # node1 starts the job; node2 has to reload it before its next run
+    Job.objects.filter(pk=j1.pk).update(status='waiting')
+    journal.record([j1.pk])
+    for state in (node1, node2):
+        assert state.sync(queryset, journal) == (False, 1)
+        assert state.tasks[j1.pk].status == 'waiting'
+        state.validate()
+
+
+@pytest.mark.django_db
+def test_journal_rereads_entries_committed_late(journal):
+    journal.record([1])
+    position = journal.position()
+    assert journal.read(position) == (set(), position)
+
+    # the transaction that took the next id has not committed yet
+    last_id = position[0]
+    TaskManagerChange.objects.create(id=last_id + 2, unified_job_id=3)
+    task_ids, position = journal.read(position)
+    assert task_ids == {3}
+    assert position == (last_id + 2, frozenset([last_id + 1]))
+    assert journal.position() == position
+
+    TaskManagerChange.objects.create(id=last_id + 1, unified_job_id=2)
+    assert journal.read(position) == ({2}, (last_id + 2, frozenset()))
+
+
+@pytest.mark.django_db
+def test_journal_trimmed_past_position(settings):
+    settings.TASK_MANAGER_JOURNAL_LENGTH = 2
+    journal = TaskManagerJournal()
+    journal.record([1])
+    position = journal.position()
+    journal.record([2, 3, 4])
+    journal.trim()
+    assert TaskManagerChange.objects.count() == 2
+    assert journal.read(position) is None
+    assert journal.read(journal.position()) == (set(), journal.position())
+
+
+@pytest.mark.django_db
+def test_blocked_task_skipped_until_blocker_changes(job_template_factory, journal, state, mocker, django_capture_on_commit_callbacks):
+    objects = job_template_factory('jt', organization='org1', project='proj', inventory='inv', credential='cred')
+    j1 = create_job(objects.job_template)
+    j2 = create_job(objects.job_template)
+    # old enough for the task manager to explain why it is not starting
+    Job.objects.filter(pk=j1.pk).update(created=tz_now() - timedelta(minutes=10))
+    Job.objects.filter(pk=j2.pk).update(created=tz_now() - timedelta(minutes=5))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        TaskManager().schedule()
+    j2.refresh_from_db()
+    assert j2.status == 'pending'
+    assert j2.job_explanation == f'waiting for job-{j1.pk} to finish'
+    assert state.blocked_by == {j2.pk: j1.pk}
+
+    # j1 went to waiting, so j2 is evaluated again
+    with django_capture_on_commit_callbacks(execute=True):
+        tm = TaskManager()
+        tm.schedule()
+    assert tm.subsystem_metrics.METRICS['task_manager_tasks_blocked'].current_value == 1
+    assert state.blocked_by == {j2.pk: j1.pk}
+
+    start_task = mocker.patch.object(TaskManager, 'start_task')
+    with django_capture_on_commit_callbacks(execute=True):
+        tm = TaskManager()
+        tm.schedule()
+    assert tm.subsystem_metrics.METRICS['task_manager_tasks_skipped'].current_value == 1
+    assert tm.subsystem_metrics.METRICS['task_manager_reconciled'].current_value == 0
+    start_task.assert_not_called()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        j1.refresh_from_db()
+        j1.status = 'successful'
+        j1.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        TaskManager().schedule()
+    assert start_task.call_count == 1
+    assert start_task.call_args[0][0] == j2
@@ -1,19 +1,24 @@
 import datetime
+import json
 import multiprocessing
 import random
 import signal
 import time
 import yaml
 from unittest import mock
+from uuid import uuid4
 
+from django.conf import settings
+from django.test.utils import override_settings
 from django.utils.timezone import now as tz_now
 import pytest
 
-from awx.main.models import Job, WorkflowJob, Instance
+from awx.main.models import Job, WorkflowJob, Instance, DispatcherClaimCheck
 from awx.main.dispatch import reaper
-from awx.main.dispatch.pool import StatefulPoolWorker, WorkerPool, AutoscalePool
-from awx.main.dispatch.publish import task
+from awx.main.dispatch.pool import StatefulPoolWorker, WorkerPool, AutoscalePool, TaskClassPool
+from awx.main.dispatch.publish import serialize_body, task
 from awx.main.dispatch.worker import BaseWorker, TaskWorker
+from awx.main.dispatch.worker.base import AWXConsumerBase
 from awx.main.dispatch.periodic import Scheduler
 
 
@@ -74,6 +79,13 @@ class SlowResultWriter(BaseWorker):
         super(SlowResultWriter, self).perform_work(body, result_queue)
 
 
+class TaskResultWriter(BaseWorker):
+    def perform_work(self, body, result_queue):
+        if body['task'].endswith('RunJob'):
+            time.sleep(3)
+        result_queue.put(body['uuid'])
+
+
 @pytest.mark.usefixtures("disable_database_settings")
 class TestPoolWorker:
     def setup_method(self, test_method):
@@ -237,6 +249,46 @@ class TestAutoScaling:
         assert len(self.pool) == 10
         assert self.pool.workers[0].messages_sent == 2
 
+    def test_least_loaded_worker_when_maxed(self):
+        self.pool.max_workers = 2
+        self.pool.init_workers(TaskResultWriter().work_loop, multiprocessing.Queue())
+        for i in range(2):
+            self.pool.workers[0].put({'task': 'awx.main.tasks.jobs.RunJob'})
+        self.pool.workers[1].put({'task': 'awx.main.tasks.jobs.RunJob'})
+        time.sleep(1)
+
+        self.pool.write(0, {'task': 'awx.main.tasks.jobs.RunJob'})
+        assert len(self.pool) == 2
+        assert [len(w.managed_tasks) for w in self.pool.workers] == [2, 2]
+
+    def test_spare_workers(self):
+        self.pool.min_workers = 1
+        self.pool.spare_workers = 2
+        self.pool.init_workers(TaskResultWriter().work_loop, multiprocessing.Queue())
+        assert len(self.pool) == 2
+
+        # a spare worker takes the message, and another one is started
+        self.pool.write(0, {'task': 'awx.main.tasks.jobs.RunJob'})
+        assert len(self.pool) == 3
+        assert len([w for w in self.pool.workers if w.idle]) == 2
+
+        # spare workers are not scaled down
+        self.pool.cleanup()
+        assert len(self.pool) == 3
+
+    def test_first_task_seconds(self):
+        result_queue = multiprocessing.Queue()
+        self.pool.init_workers(TaskResultWriter().work_loop, result_queue)
+        self.pool.write(0, {'uuid': str(uuid4()), 'task': 'awx.main.tasks.system.handle_work_success', 'time_ack': time.time()})
+        result_queue.get(timeout=2)
+        for i in range(10):
+            first_task_seconds = self.pool.pop_first_task_seconds()
+            if first_task_seconds:
+                break
+            time.sleep(0.1)
+        assert len(first_task_seconds) == 1
+        assert 0 <= first_task_seconds[0] < 2
+
     @pytest.mark.timeout(20)
     def test_lost_worker_autoscale(self):
         # if a worker exits, it should be replaced automatically up to min_workers
@@ -260,6 +312,84 @@ class TestAutoScaling:
 
 
 @pytest.mark.usefixtures("disable_database_settings")
+@pytest.mark.django_db
+class TestTaskClassPool:
+    def setup_method(self, test_method):
+        self.pool = TaskClassPool(
+            {
+                'jobs': {'tasks': ['awx.main.tasks.jobs.Run*'], 'min_workers': 1, 'max_workers': 2},
+                'system': {'tasks': ['*'], 'min_workers': 1, 'max_workers': 2},
+            }
+        )
+
+    def teardown_method(self, test_method):
+        self.pool.stop(signal.SIGTERM)
+
+    def message(self, task):
+        return {'uuid': str(uuid4()), 'task': task, 'time_ack': time.time()}
+
+    def test_task_class(self):
+        assert self.pool.task_class({'task': 'awx.main.tasks.jobs.RunJob'}) == 'jobs'
+        assert self.pool.task_class({'task': 'awx.main.tasks.system.handle_work_success'}) == 'system'
+        assert self.pool.task_class('Hello, World!') == 'system'
+
+    def test_jobs_do_not_hold_up_system_tasks(self):
+        result_queue = multiprocessing.Queue()
+        self.pool.init_workers(TaskResultWriter().work_loop, result_queue)
+        assert len(self.pool) == 2
+        for i in range(3):
+            self.pool.write(0, self.message('awx.main.tasks.jobs.RunJob'))
+        system_task = self.message('awx.main.tasks.system.handle_work_success')
+        self.pool.write(0, system_task)
+
+        assert result_queue.get(timeout=2) == system_task['uuid']
+        assert len(self.pool.pools['jobs']) == 2
+        assert len(self.pool.pools['system']) == 1
+
+    @mock.patch('awx.main.dispatch.pool.get_auto_max_workers', return_value=68)
+    def test_worker_budget_split_across_classes(self, get_auto_max_workers):
+        max_workers = TaskClassPool.split_max_workers(
+            {
+                'heartbeat': {'min_workers': 1, 'max_workers': 2},
+                'jobs': {'min_workers': 1, 'max_workers': None},
+                'firewalls': {'min_workers': 1, 'max_workers': None},
+                'system': {'min_workers': 4, 'max_workers': 16},
+            }
+        )
+        assert max_workers == {'heartbeat': 2, 'jobs': 25, 'firewalls': 25, 'system': 16}
+        assert sum(max_workers.values()) == 68
+
+    @mock.patch('awx.main.dispatch.pool.get_auto_max_workers', return_value=68)
+    def test_default_worker_budget_left_to_jobs(self, get_auto_max_workers):
+        # the task manager sends a node as many jobs as its capacity allows
+        assert TaskClassPool.split_max_workers(settings.DISPATCHER_TASK_CLASSES) == {'heartbeat': 2, 'jobs': 46, 'firewalls': 4, 'system': 16}
+
+    @mock.patch('awx.main.dispatch.pool.get_auto_max_workers', return_value=10)
+    def test_worker_budget_exhausted_by_fixed_classes(self, get_auto_max_workers):
+        pool = TaskClassPool({'jobs': {'min_workers': 2, 'max_workers': None}, 'system': {'min_workers': 4, 'max_workers': 16}})
+        assert pool.pools['jobs'].max_workers == 2
+        pool.stop(signal.SIGTERM)
+
+    def test_queue_wait_metrics(self):
+        result_queue = multiprocessing.Queue()
+        self.pool.init_workers(TaskResultWriter().work_loop, result_queue)
+        self.pool.write(0, self.message('awx.main.tasks.system.handle_work_success'))
+        result_queue.get(timeout=2)
+
+        metrics = mock.Mock()
+        for i in range(10):
+            # the worker reports the start of a task before running it, but on another queue
+            self.pool.pools['system'].workers[0].calculate_managed_tasks()
+            if self.pool.pools['system'].workers[0].queue_waits:
+                break
+            time.sleep(0.1)
+        self.pool.produce_subsystem_metrics(metrics)
+        values = {c.args[0]: c.args[1] for c in metrics.set.call_args_list}
+        assert values['dispatcher_pool_class_worker_count'] == {'jobs': 1, 'system': 1}
+        assert values['dispatcher_pool_class_queue_wait_avg_seconds']['jobs'] == 0.0
+        assert 0 < values['dispatcher_pool_class_queue_wait_max_seconds']['system'] < 2
+
+
 class TestTaskDispatcher:
     @property
     def tm(self):
@@ -337,6 +467,34 @@ class TestTaskPublisher:
         message, queue = add.apply_async([2, 2], queue=lambda: 'called')
         assert queue == 'called'
 
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('queue, shared', [('foobar', False), ('tower_broadcast_all', True)])
+    def test_large_body_claim_check(self, queue, shared):
+        body = add.get_async_body(['x' * 1000, 'y'])
+        with override_settings(DISPATCHER_CLAIM_CHECK_THRESHOLD=1000):
+            payload = json.loads(serialize_body(queue, body))
+            small_payload = json.loads(serialize_body(queue, add.get_async_body([2, 2])))
+        assert small_payload['args'] == [2, 2]
+        assert 'args' not in payload
+        assert payload['uuid'] == body['uuid']
+        assert DispatcherClaimCheck.objects.count() == 1
+
+        consumer = AWXConsumerBase.__new__(AWXConsumerBase)
+        assert consumer.redeem_claim_check(payload) == body
+        assert DispatcherClaimCheck.objects.filter(pk=payload['claim_check']).exists() is shared
+        if not shared:
+            assert consumer.redeem_claim_check(payload) is None
+
+    @pytest.mark.django_db
+    def test_expired_claim_checks_removed(self):
+        expired = DispatcherClaimCheck.objects.create(payload='{}', created=tz_now() - datetime.timedelta(hours=2))
+        current = DispatcherClaimCheck.objects.create(payload='{}')
+        consumer = AWXConsumerBase.__new__(AWXConsumerBase)
+        with override_settings(DISPATCHER_CLAIM_CHECK_TTL=3600):
+            consumer.cleanup_claim_checks()
+        assert list(DispatcherClaimCheck.objects.all()) == [current]
+        assert not DispatcherClaimCheck.objects.filter(pk=expired.pk).exists()
+
 
 yesterday = tz_now() - datetime.timedelta(days=1)
 minute = tz_now() - datetime.timedelta(seconds=120)
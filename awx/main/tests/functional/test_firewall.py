@@ -0,0 +1,323 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from awx.main.models import UpdateFirewallStatus, UpdateFirewallStatusLogs
+from awx.main.tasks.firewall import (
+    UPGRADE_STEPS,
+    FirewallLogBuffer,
+    FirewallRollout,
+    FirewallStatus,
+    FirewallUpgrade,
+    FirewallUpgrades,
+    assign_waves,
+    get_dispatched_key,
+    get_ha_peer,
+    get_job_progress,
+    get_remaining_steps,
+    resume_firewall_upgrades,
+    start_firewall_upgrades,
+    upgrade_firewalls,
+)
+from awx.main.utils.panos import PanosError, PanosResponse
+
+
+def create_firewalls(job_id, statuses, group_name='group', first=0, **kwargs):
+    return [
+        UpdateFirewallStatus.objects.create(job_id=job_id, ip_address=f'10.0.0.{i}', group_name=group_name, name=f'fw-{i}', status=status, **kwargs)
+        for i, status in enumerate(statuses, first)
+    ]
+
+
+@pytest.mark.parametrize(
+    'status, first_step',
+    [
+        ('waiting', FirewallStatus.SOLAR_WIND_MUTE),
+        ('download', FirewallStatus.INSTALL),
+        ('solar_wind_unmute', FirewallStatus.UPDATED),
+    ],
+)
+def test_remaining_steps_resume_after_last_completed(status, first_step):
+    assert get_remaining_steps(status)[0] == first_step
+
+
+@pytest.mark.parametrize('status', ['updated', 'error', 'stop'])
+def test_no_remaining_steps_when_finished(status):
+    assert get_remaining_steps(status) == []
+
+
+def set_status(firewall, status):
+    firewall.refresh_from_db()
+    firewall.status = status
+    firewall.save()
+
+
+def start_upgrades(upgrades, **kwargs):
+    with override_settings(**kwargs):
+        return [firewall.pk for firewall in upgrades.schedule()]
+
+
+def rollout_logs(job_id):
+    return list(UpdateFirewallStatusLogs.objects.filter(job_id=job_id, ip_address=FirewallRollout.ROLLOUT_LOG).order_by('pk').values_list('text', flat=True))
+
+
+@pytest.mark.parametrize('count, expected', [(1, [0]), (4, [0, 1, 2, 2]), (20, [0] * 2 + [1] * 8 + [2] * 10)])
+def test_assign_waves(count, expected):
+    firewalls = [mock.Mock(wave=None) for i in range(count)]
+    assign_waves(firewalls, [10, 50, 100])
+    assert [f.wave for f in firewalls] == expected
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('sequence, expected', [(True, [1, 2]), (False, [1])])
+def test_schedule(sequence, expected):
+    firewalls = create_firewalls(1, ['updated', 'waiting', 'waiting'], sequence=sequence, ha_peer='')
+    upgrades = FirewallUpgrades(1)
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == [firewalls[i].pk for i in expected]
+    # they are not started again
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == []
+
+
+@pytest.mark.django_db
+def test_schedule_resumes_upgrades_not_running():
+    firewalls = create_firewalls(1, ['install', 'waiting'], sequence=False, ha_peer='')
+    # the upgrade of the first firewall was started by a task that died
+    upgrades = FirewallUpgrades(1)
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == [firewalls[0].pk]
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == []
+
+
+@pytest.mark.django_db
+def test_upgrades_dispatched_once():
+    create_firewalls(1, ['waiting'])
+    cache.delete(get_dispatched_key(1))
+    with mock.patch.object(upgrade_firewalls, 'apply_async') as apply_async:
+        start_firewall_upgrades(1)
+        # the task did not start yet
+        start_firewall_upgrades(1)
+        assert apply_async.call_count == 1
+        cache.delete(get_dispatched_key(1))
+        start_firewall_upgrades(1)
+        assert apply_async.call_args_list == [mock.call([1])] * 2
+
+
+@pytest.mark.django_db
+def test_resume_dispatches_unfinished_jobs():
+    create_firewalls(1, ['install', 'updated'])
+    create_firewalls(2, ['updated', 'error'])
+    cache.delete(get_dispatched_key(1))
+    with mock.patch.object(upgrade_firewalls, 'apply_async') as apply_async:
+        resume_firewall_upgrades()
+        resume_firewall_upgrades()
+    apply_async.assert_called_once_with([1])
+
+
+HA_ENABLED = (
+    b'<response status="success"><result><enabled>yes</enabled><group><peer-info><mgmt-ip>10.0.0.2/23</mgmt-ip></peer-info></group></result></response>'
+)
+HA_DISABLED = b'<response status="success"><result><enabled>no</enabled></result></response>'
+
+
+@pytest.mark.parametrize('response, expected', [(PanosResponse(200, HA_ENABLED), '10.0.0.2'), (PanosResponse(200, HA_DISABLED), ''), (PanosError(), '')])
+@pytest.mark.django_db(transaction=True)
+def test_get_ha_peer(response, expected):
+    client = mock.Mock(op=mock.AsyncMock(side_effect=[response]))
+    assert asyncio.run(get_ha_peer(client, mock.Mock(job_id=1, ip_address='10.0.0.1', api_key='key'))) == expected
+
+
+@pytest.mark.django_db
+def test_ha_peers_found_before_the_rollout():
+    create_firewalls(1, ['waiting'])
+    assert start_upgrades(FirewallUpgrades(1)) == []
+
+
+@pytest.mark.django_db
+def test_waves():
+    firewalls = create_firewalls(1, ['waiting'] * 4, sequence=True, ha_peer='')
+    upgrades, settings = FirewallUpgrades(1), dict(FIREWALL_UPGRADE_WAVES=[25, 100])
+    assert start_upgrades(upgrades, **settings) == [firewalls[0].pk]
+    assert rollout_logs(1) == ['planned 4 firewalls in waves of 1, 3', 'wave 1 started, 1 firewalls']
+    # the next wave waits for the first one to finish
+    assert start_upgrades(upgrades, **settings) == []
+    set_status(firewalls[0], 'updated')
+    assert start_upgrades(upgrades, **settings) == [f.pk for f in firewalls[1:]]
+    assert rollout_logs(1)[2:] == ['wave 1 finished in 0s: 1 updated', 'wave 2 started, 3 firewalls']
+
+
+@pytest.mark.django_db
+def test_concurrency_per_group():
+    firewalls = create_firewalls(1, ['waiting'] * 3, sequence=True, ha_peer='')
+    other_group = create_firewalls(1, ['waiting'], sequence=True, ha_peer='', group_name='other', first=3)
+    started = start_upgrades(FirewallUpgrades(1), FIREWALL_UPGRADE_WAVES=[100], FIREWALL_UPGRADE_MAX_CONCURRENT_PER_GROUP=2)
+    assert started == [firewalls[0].pk, firewalls[1].pk, other_group[0].pk]
+
+
+@pytest.mark.django_db
+def test_ha_peers_not_upgraded_together():
+    firewalls = create_firewalls(1, ['waiting'] * 3, sequence=True, ha_peer='')
+    # only one of the peers knows of the other
+    UpdateFirewallStatus.objects.filter(pk=firewalls[2].pk).update(ha_peer=firewalls[0].ip_address)
+    upgrades = FirewallUpgrades(1)
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == [firewalls[0].pk, firewalls[1].pk]
+    set_status(firewalls[0], 'updated')
+    assert start_upgrades(upgrades, FIREWALL_UPGRADE_WAVES=[100]) == [firewalls[2].pk]
+
+
+@pytest.mark.django_db
+def test_halt_on_failure_rate():
+    firewalls = create_firewalls(1, ['waiting'] * 4, sequence=True, ha_peer='')
+    upgrades, settings = FirewallUpgrades(1), dict(FIREWALL_UPGRADE_WAVES=[50, 100], FIREWALL_UPGRADE_MAX_FAILURE_RATE=0.4)
+    assert start_upgrades(upgrades, **settings) == [firewalls[0].pk, firewalls[1].pk]
+    set_status(firewalls[0], 'updated')
+    set_status(firewalls[1], 'error')
+    with mock.patch('awx.main.tasks.firewall.send_job_progress') as send_job_progress:
+        assert start_upgrades(upgrades, **settings) == []
+    send_job_progress.assert_called_once_with(1)
+    assert list(UpdateFirewallStatus.objects.filter(job_id=1).order_by('pk').values_list('status', flat=True)) == ['updated', 'error', 'stop', 'stop']
+    assert rollout_logs(1)[-1] == 'halted, 50% of the upgrades failed, 2 firewalls stopped'
+
+
+@pytest.mark.django_db
+def test_get_job_progress():
+    create_firewalls(1, ['updated', 'install'])
+    create_firewalls(2, ['waiting'])
+    assert get_job_progress(1) == {'group': {'10.0.0.0': {'status': 'updated', 'name': 'fw-0'}, '10.0.0.1': {'status': 'install', 'name': 'fw-1'}}}
+
+
+def patch_steps(statuses, **results):
+    """Patch the steps of FirewallUpgrade, recording the status of the firewall each one starts from"""
+
+    def step(result):
+        async def _step(self, firewall, *args):
+            statuses.append((firewall.ip_address, firewall.status))
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return _step
+
+    steps = {f'{s.value}_firewalls': step(results.get(s.value, True)) for s in UPGRADE_STEPS}
+    return mock.patch.multiple(FirewallUpgrade, send_progress=mock.DEFAULT, create_firewall_status_log=mock.DEFAULT, **steps)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upgrade_resumes_after_last_completed_step():
+    create_firewalls(1, ['reboot'], ha_peer='')
+    statuses = []
+    with patch_steps(statuses, solar_wind_unmute=False):
+        upgrade_firewalls(1)
+    # the status in the database is the last step completed
+    assert statuses == [('10.0.0.0', 'reboot'), ('10.0.0.0', 'login')]
+    assert UpdateFirewallStatus.objects.get().status == 'error'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upgrade_error_on_unexpected_exception():
+    create_firewalls(1, ['download'], ha_peer='')
+    statuses = []
+    with patch_steps(statuses, install=AttributeError()), mock.patch('awx.main.tasks.firewall.logger'):
+        upgrade_firewalls(1)
+    # the step is not replayed
+    assert statuses == [('10.0.0.0', 'download')]
+    assert UpdateFirewallStatus.objects.get().status == 'error'
+
+
+INSTALL_FINISHED = b'<response status="success"><result><job><type>SWInstall</type><status>FIN</status></job></result></response>'
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('in_progress, sent', [('', True), ('install', False)])
+def test_install_sent_once(in_progress, sent):
+    firewall = create_firewalls(1, ['download'], ha_peer='', in_progress=in_progress, update_version='11.0')[0]
+    installs = []
+
+    async def request(ip, params, idempotent=True):
+        if not idempotent:
+            # marked as sent before it is sent
+            installs.append(await sync_to_async(UpdateFirewallStatus.objects.values_list('in_progress', flat=True).get)())
+        return PanosResponse(200, INSTALL_FINISHED)
+
+    upgrade = FirewallUpgrade(firewall, mock.Mock(request=request), None)
+    with mock.patch.multiple(FirewallUpgrade, send_progress=mock.DEFAULT, create_firewall_status_log=mock.DEFAULT):
+        # a resumed install only waits for the one sent by the task that died
+        assert asyncio.run(upgrade.install_firewalls(firewall, firewall.ip_address, 1, 'key', '11.0', '10.0')) is True
+        assert installs == (['install'] if sent else [])
+        assert UpdateFirewallStatus.objects.get().in_progress == 'install'
+        asyncio.run(upgrade.set_status(FirewallStatus.INSTALL))
+    assert list(UpdateFirewallStatus.objects.values_list('status', 'in_progress')) == [('install', '')]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upgrades_of_a_job_run_in_one_task():
+    create_firewalls(1, ['waiting'] * 3, sequence=True)
+    statuses = []
+    client = mock.Mock(op=mock.AsyncMock(return_value=PanosResponse(200, HA_DISABLED)), close=mock.AsyncMock())
+    with patch_steps(statuses), mock.patch('awx.main.tasks.firewall.get_async_client', return_value=client), override_settings(
+        FIREWALL_UPGRADE_WAVES=[30, 100]
+    ):
+        upgrade_firewalls(1)
+    assert client.op.call_count == 3
+    assert list(UpdateFirewallStatus.objects.values_list('ha_peer', 'status')) == [('', 'updated')] * 3
+    # the two firewalls of the second wave were upgraded together
+    assert [ip for ip, status in statuses if status == 'waiting'] == ['10.0.0.0', '10.0.0.1', '10.0.0.2']
+    assert [ip for ip, status in statuses][len(UPGRADE_STEPS) :][:2] == ['10.0.0.1', '10.0.0.2']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_buffer_flushes_by_batch():
+    channel_layer = mock.Mock(group_send=mock.AsyncMock())
+    buffer = FirewallLogBuffer(1)
+
+    async def write():
+        for i in range(3):
+            await buffer.write('10.0.0.1', f'line {i}')
+        written = await sync_to_async(UpdateFirewallStatusLogs.objects.count)()
+        await buffer.flush()
+        return written
+
+    with override_settings(FIREWALL_LOG_BATCH_SIZE=2), mock.patch('awx.main.tasks.firewall.get_channel_layer', return_value=channel_layer):
+        assert asyncio.run(write()) == 2
+    assert list(UpdateFirewallStatusLogs.objects.order_by('pk').values_list('text', flat=True)) == ['line 0', 'line 1', 'line 2']
+    # every line is sent right away, apart from the status of the firewalls
+    assert {c.args[0] for c in channel_layer.group_send.call_args_list} == {'firewall_upgrade_logs-1'}
+    assert [json.loads(c.args[1]['text'])['log']['text'] for c in channel_layer.group_send.call_args_list] == ['line 0', 'line 1', 'line 2']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_buffer_flushes_after_interval():
+    buffer = FirewallLogBuffer(1)
+
+    async def write():
+        await buffer.write('10.0.0.1', 'line')
+        await asyncio.sleep(0.1)
+
+    with override_settings(FIREWALL_LOG_FLUSH_INTERVAL=0), mock.patch(
+        'awx.main.tasks.firewall.get_channel_layer', return_value=mock.Mock(group_send=mock.AsyncMock())
+    ):
+        asyncio.run(write())
+    assert UpdateFirewallStatusLogs.objects.count() == 1
+    assert buffer.flusher is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_log_buffer_write_survives_failed_flush():
+    buffer = FirewallLogBuffer(1)
+
+    async def write():
+        with mock.patch.object(UpdateFirewallStatusLogs.objects, 'bulk_create', side_effect=Exception('database is down')):
+            await buffer.write('10.0.0.1', 'line 0')
+            await buffer.write('10.0.0.1', 'line 1')
+        await buffer.write('10.0.0.1', 'line 2')
+
+    with override_settings(FIREWALL_LOG_BATCH_SIZE=1), mock.patch(
+        'awx.main.tasks.firewall.get_channel_layer', return_value=mock.Mock(group_send=mock.AsyncMock(side_effect=Exception('redis is down')))
+    ), mock.patch('awx.main.tasks.firewall.logger') as logger:
+        asyncio.run(write())
+    assert logger.exception.call_count == 5
+    # the lines that failed are written with the next ones
+    assert list(UpdateFirewallStatusLogs.objects.order_by('pk').values_list('text', flat=True)) == ['line 0', 'line 1', 'line 2']
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from awx.main.scheduler.task_manager_models import FairShareQueues
+
+
+def make_tasks(organization_id, count, task_impact=10, priority=0):
+    return [
+        SimpleNamespace(
+            name=f'org{organization_id}-p{priority}-{i}', organization_id=organization_id, task_impact=task_impact, unified_job_template_priority=priority
+        )
+        for i in range(count)
+    ]
+
+
+def names(queues):
+    return [task.name for task in queues]
+
+
+def test_queues_take_turns():
+    tasks = make_tasks(1, 30) + make_tasks(2, 3)
+    order = names(FairShareQueues(tasks, quantum=20))
+    assert order[:7] == ['org1-p0-0', 'org1-p0-1', 'org2-p0-0', 'org2-p0-1', 'org1-p0-2', 'org1-p0-3', 'org2-p0-2']
+    assert len(order) == 33
+
+
+def test_weights():
+    tasks = make_tasks(1, 10, task_impact=50) + make_tasks(2, 20)
+    order = names(FairShareQueues(tasks, quantum=50, weights={'organization-2': 2}))
+    assert order[:23] == ['org1-p0-0'] + [f'org2-p0-{i}' for i in range(10)] + ['org1-p0-1'] + [f'org2-p0-{i}' for i in range(10, 20)] + ['org1-p0-2']
+
+
+def test_credit_is_kept_for_large_tasks():
+    tasks = make_tasks(1, 2, task_impact=150) + make_tasks(2, 4, task_impact=50)
+    assert names(FairShareQueues(tasks, quantum=100)) == ['org2-p0-0', 'org2-p0-1', 'org1-p0-0', 'org2-p0-2', 'org2-p0-3', 'org1-p0-1']
+
+
+def test_priority_within_queue():
+    tasks = make_tasks(1, 2) + make_tasks(1, 1, priority=5) + make_tasks(2, 1, priority=1)
+    assert names(FairShareQueues(tasks, quantum=10)) == ['org1-p5-0', 'org2-p1-0', 'org1-p0-0', 'org1-p0-1']
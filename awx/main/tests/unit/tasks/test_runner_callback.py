@@ -1,6 +1,15 @@
-from awx.main.tasks.callback import RunnerCallback
+import json
+import time
+from unittest import mock
+
+import pytest
+
+from awx.main.tasks.callback import RunnerCallback, WebsocketEventBatch
 from awx.main.constants import ANSIBLE_RUNNER_NEEDS_UPDATE_MESSAGE
+from awx.main.models import Job, ProjectUpdate
+from awx.main.queue import CallbackQueueDispatcher, MSGPACK_V1, encode_event, decode_event
 
+from django.test import override_settings
 from django.utils.translation import gettext_lazy as _
 
 
@@ -50,3 +59,171 @@ def test_special_ansible_runner_message(mock_me):
         'Traceback:\ngot an unexpected keyword argument\nFile: bar.py\n'
         f'{ANSIBLE_RUNNER_NEEDS_UPDATE_MESSAGE}'
     )
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_BUFFER_EVENTS=3, CALLBACK_QUEUE_BUFFER_BYTES=1048576, CALLBACK_QUEUE_BUFFER_SECONDS=60)
+def test_buffered_dispatch():
+    dispatcher = CallbackQueueDispatcher(buffered=True)
+    dispatcher.connection = mock.MagicMock()
+    pipe = dispatcher.connection.pipeline.return_value
+    for counter in (1, 2):
+        dispatcher.dispatch({'job_id': 1, 'counter': counter})
+    pipe.rpush.assert_not_called()
+    dispatcher.dispatch({'job_id': 1, 'counter': 3})
+    pipe.rpush.assert_called_once_with('callback_tasks', '{"job_id": 1, "counter": 1}', '{"job_id": 1, "counter": 2}', '{"job_id": 1, "counter": 3}')
+    pipe.execute.assert_called_once()
+    # the shards are pushed to atomically
+    dispatcher.connection.pipeline.assert_called_once_with(transaction=True)
+    dispatcher.connection.rpush.assert_not_called()
+    assert dispatcher.flush_timer is None
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_BUFFER_EVENTS=2, CALLBACK_QUEUE_BUFFER_BYTES=1048576, CALLBACK_QUEUE_BUFFER_SECONDS=60)
+def test_buffered_dispatch_kept_when_redis_fails():
+    dispatcher = CallbackQueueDispatcher(buffered=True)
+    dispatcher.connection = mock.MagicMock()
+    pipe = dispatcher.connection.pipeline.return_value
+    pipe.execute.side_effect = [ConnectionError(), None]
+    dispatcher.dispatch({'job_id': 1, 'counter': 1})
+    with pytest.raises(ConnectionError):
+        dispatcher.dispatch({'job_id': 1, 'counter': 2})
+    assert dispatcher.buffered_events == 2
+    dispatcher.flush()
+    pipe.rpush.assert_called_with('callback_tasks', '{"job_id": 1, "counter": 1}', '{"job_id": 1, "counter": 2}')
+    assert dispatcher.buffer == {}
+    assert dispatcher.buffered_events == 0
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_BUFFER_EVENTS=100, CALLBACK_QUEUE_BUFFER_BYTES=1048576, CALLBACK_QUEUE_BUFFER_SECONDS=60)
+def test_buffered_dispatch_flushed_on_eof(mock_me):
+    rc = RunnerCallback()
+    rc.dispatcher.connection = mock.MagicMock()
+    rc.instance = Job(pk=1, id=1)
+    rc.event_handler({'event': 'runner_on_ok', 'stdout': 'ok', 'start_line': 0, 'end_line': 1})
+    pipe = rc.dispatcher.connection.pipeline.return_value
+    pipe.rpush.assert_not_called()
+    rc.finished_callback(None)
+    assert [json.loads(m)['event'] for m in pipe.rpush.call_args[0][1:]] == ['runner_on_ok', 'EOF']
+    assert rc.dispatcher.flush_timer is None
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_BUFFER_EVENTS=0)
+def test_unbuffered_dispatch():
+    dispatcher = CallbackQueueDispatcher(buffered=True)
+    dispatcher.connection = mock.MagicMock()
+    dispatcher.dispatch({'job_id': 1, 'counter': 1})
+    dispatcher.connection.rpush.assert_called_once_with('callback_tasks', '{"job_id": 1, "counter": 1}')
+
+
+class VaultValue:
+    yaml_tag = '!vault'
+    data = '$ANSIBLE_VAULT;1.1;AES256'
+
+
+class UnsafeText(str):
+    pass
+
+
+@pytest.mark.parametrize('serializer', ['json', 'msgpack'])
+def test_event_serialization_round_trip(serializer):
+    event = {'job_id': 1, 'counter': 2, 'stdout': 'ok', 'event_data': {'res': {'secret': VaultValue(), 'msg': UnsafeText('{{ lookup("pipe", "id") }}')}}}
+    decoded = decode_event(encode_event(event, serializer))
+    assert decoded == {'job_id': 1, 'counter': 2, 'stdout': 'ok', 'event_data': {'res': {'secret': VaultValue.data, 'msg': '{{ lookup("pipe", "id") }}'}}}
+
+
+def test_decode_legacy_json_bytes():
+    # callback receivers pop bytes from redis, and must keep decoding messages from older producers
+    assert decode_event(b'{"job_id": 1, "event": "EOF"}') == {'job_id': 1, 'event': 'EOF'}
+
+
+@override_settings(CALLBACK_QUEUE='callback_tasks', CALLBACK_QUEUE_BUFFER_EVENTS=0, CALLBACK_QUEUE_SERIALIZER='msgpack')
+def test_dispatch_msgpack():
+    dispatcher = CallbackQueueDispatcher()
+    dispatcher.connection = mock.MagicMock()
+    dispatcher.dispatch({'job_id': 1, 'counter': 1})
+    message = dispatcher.connection.rpush.call_args[0][1]
+    assert message.startswith(MSGPACK_V1)
+    assert decode_event(message) == {'job_id': 1, 'counter': 1}
+
+
+def test_websocket_event_batch():
+    batch = WebsocketEventBatch(stdout_lines=3)
+    assert not batch
+    for counter in (4, 5, 6, 9, 10):
+        batch.add({'counter': counter, 'stdout': f'line {counter}a\r\nline {counter}b', 'start_line': counter * 2, 'end_line': counter * 2 + 2})
+    assert batch
+    assert batch.pop() == {
+        'event': 'event_batch',
+        'counters': [[4, 6], [9, 10]],
+        'stdout_lines': ['line 9b', 'line 10a', 'line 10b'],
+        'start_line': 8,
+        'end_line': 22,
+    }
+    assert not batch
+
+
+@override_settings(
+    CALLBACK_QUEUE='callback_tasks',
+    CALLBACK_QUEUE_BUFFER_EVENTS=0,
+    MAX_WEBSOCKET_EVENT_RATE=2,
+    WEBSOCKET_EVENT_COALESCING={'job': 'batch'},
+    WEBSOCKET_EVENT_BATCH_INTERVAL=60,
+)
+def test_rate_limited_events_are_batched(mock_me):
+    rc = RunnerCallback()
+    rc.dispatcher.connection = mock.MagicMock()
+    rc.instance = Job(pk=1, id=1)
+    with mock.patch('awx.main.tasks.callback.time.time', return_value=1000.0):
+        for counter in range(1, 6):
+            rc.event_handler({'event': 'runner_on_ok', 'counter': counter, 'stdout': f'ok {counter}', 'start_line': counter, 'end_line': counter + 1})
+    rc.finished_callback(None)
+    messages = [json.loads(call[0][1]) for call in rc.dispatcher.connection.rpush.call_args_list]
+    assert [m['event'] for m in messages] == ['runner_on_ok'] * 5 + ['event_batch', 'EOF']
+    assert [m.get('skip_websocket_message', False) for m in messages[:5]] == [False, False, True, True, True]
+    assert messages[5]['counters'] == [[3, 5]]
+    assert messages[5]['stdout_lines'] == ['ok 3', 'ok 4', 'ok 5']
+    assert messages[5]['job_id'] == 1
+    # event_batch messages are not events, and do not count towards final_counter
+    assert messages[6]['final_counter'] == 5
+
+
+@override_settings(
+    CALLBACK_QUEUE='callback_tasks',
+    CALLBACK_QUEUE_BUFFER_EVENTS=0,
+    MAX_WEBSOCKET_EVENT_RATE=1,
+    WEBSOCKET_EVENT_COALESCING={'job': 'batch'},
+    WEBSOCKET_EVENT_BATCH_INTERVAL=0,
+)
+def test_websocket_event_batch_sent_on_timer(mock_me):
+    rc = RunnerCallback()
+    rc.dispatcher.connection = mock.MagicMock()
+    rc.instance = Job(pk=1, id=1)
+    with mock.patch('awx.main.tasks.callback.time.time', return_value=1000.0):
+        for counter in (1, 2):
+            rc.event_handler({'event': 'runner_on_ok', 'counter': counter, 'stdout': f'ok {counter}', 'start_line': counter, 'end_line': counter + 1})
+    # no other event follows, the batch is sent anyway
+    for i in range(100):
+        if rc.dispatcher.connection.rpush.call_count == 3:
+            break
+        time.sleep(0.05)
+    messages = [json.loads(call[0][1]) for call in rc.dispatcher.connection.rpush.call_args_list]
+    assert [m['event'] for m in messages] == ['runner_on_ok', 'runner_on_ok', 'event_batch']
+    assert messages[2]['counters'] == [[2, 2]]
+    assert rc.websocket_event_batch_timer is None
+
+
+@override_settings(WEBSOCKET_EVENT_COALESCING={'job': 'batch'})
+def test_websocket_event_coalescing_per_job_type(mock_me):
+    rc = RunnerCallback()
+    rc.instance = Job(pk=1, id=1)
+    assert isinstance(rc.websocket_event_batch, WebsocketEventBatch)
+    rc = RunnerCallback()
+    rc.instance = ProjectUpdate(pk=1, id=1)
+    assert rc.websocket_event_batch is None
+
+
+def test_websocket_events_skipped_by_default(mock_me):
+    # existing clients of the job_events websocket do not know of event_batch messages
+    rc = RunnerCallback()
+    rc.instance = Job(pk=1, id=1)
+    assert rc.websocket_event_batch is None
@@ -221,3 +221,45 @@ class TestSelectBestInstanceForTask(object):
             assert tm_models.instance_groups.find_largest_idle_instance('controlplane') is None, reason
         else:
             assert tm_models.instance_groups.find_largest_idle_instance('controlplane').hostname == instances[instance_fit_index].hostname, reason
+
+    @pytest.mark.parametrize(
+        'strategy,instances,instance_fit_index',
+        [
+            ('worst_fit', Is([50, 150, 120]), 1),
+            ('worst_fit_heap', Is([50, 150, 120]), 1),
+            ('best_fit', Is([50, 150, 120]), 0),
+            ('best_fit', Is([30, 150, 120]), 2),
+            ('best_fit', Is([30, 20, 10]), None),
+            ('worst_fit_heap', Is([30, 20, 10]), None),
+        ],
+    )
+    def test_placement_strategies(self, strategy, instances, instance_fit_index):
+        ig = InstanceGroup(id=10, name='controlplane')
+        for instance in instances:
+            ig.instances.add(instance)
+        tm_models = TaskManagerModels(instances=instances, instance_groups=[ig], placement_strategies={'controlplane': strategy})
+        instance_picked = tm_models.instance_groups.fit_task_to_most_remaining_capacity_instance(Job(task_impact=40), 'controlplane')
+
+        if instance_fit_index is None:
+            assert instance_picked is None
+        else:
+            assert instance_picked.hostname == instances[instance_fit_index].hostname
+
+    def test_heap_placement_matches_worst_fit(self):
+        picked = {}
+        for strategy in ('worst_fit', 'worst_fit_heap'):
+            instances = Is([100, 250, 80, 250, 175])
+            ig = InstanceGroup(id=10, name='controlplane')
+            for instance in instances:
+                ig.instances.add(instance)
+            tm_models = TaskManagerModels(instances=instances, instance_groups=[ig], placement_strategy=strategy)
+            picked[strategy] = []
+            for impact in (30, 75, 10, 120, 45, 45, 60, 5, 90, 200, 15):
+                task = Job(task_impact=impact)
+                instance = tm_models.instance_groups.fit_task_to_most_remaining_capacity_instance(task, 'controlplane')
+                picked[strategy].append(instance.hostname if instance else None)
+                if instance:
+                    task.execution_node = instance.hostname
+                    tm_models.consume_capacity(task)
+        assert picked['worst_fit'] == picked['worst_fit_heap']
+        assert None in picked['worst_fit']
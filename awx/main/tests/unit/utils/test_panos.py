@@ -0,0 +1,179 @@
+import asyncio
+from unittest import mock
+
+import aiohttp
+import pytest
+import requests
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from awx.main.utils.panos import AsyncPanosClient, PanosAuthError, PanosClient, PanosError
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+    async def read(self):
+        return b'<response status="success"/>'
+
+
+class FakeRequest:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    async def __aenter__(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return FakeResponse(self.outcome)
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, params=None):
+        self.calls += 1
+        return FakeRequest(self.outcomes.pop(0))
+
+
+def request(outcomes, idempotent=True):
+    client = AsyncPanosClient()
+    client.session = FakeSession(*outcomes)
+    with override_settings(PANOS_API_RETRIES=2, PANOS_API_RETRY_BACKOFF=0):
+        try:
+            return asyncio.run(client.request('10.0.0.1', {'type': 'op'}, idempotent=idempotent)), client.session.calls
+        except PanosError:
+            return None, client.session.calls
+
+
+def connect_error():
+    return aiohttp.ClientConnectorError(mock.Mock(host='10.0.0.1', port=443, ssl=False), OSError('refused'))
+
+
+@pytest.mark.parametrize('idempotent', [True, False])
+def test_connect_errors_are_retried(idempotent):
+    response, calls = request([connect_error(), 200], idempotent=idempotent)
+    assert response.status_code == 200
+    assert response.text == '<response status="success"/>'
+    assert calls == 2
+
+
+def test_gives_up_after_retries():
+    assert request([connect_error()] * 3) == (None, 3)
+
+
+@pytest.mark.parametrize('idempotent, expected', [(True, (200, 2)), (False, (500, 1))])
+def test_server_errors_retried_if_idempotent(idempotent, expected):
+    response, calls = request([500, 200], idempotent=idempotent)
+    assert (response.status_code, calls) == expected
+
+
+@pytest.mark.parametrize('idempotent, expected', [(True, 2), (False, 1)])
+def test_timeouts_retried_if_idempotent(idempotent, expected):
+    response, calls = request([asyncio.TimeoutError(), 200], idempotent=idempotent)
+    assert calls == expected
+    assert (response is None) is not idempotent
+
+
+class FakeSyncSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append(params)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status_code, content = outcome
+        return mock.Mock(status_code=status_code, content=content)
+
+
+def sync_client(*outcomes):
+    client = PanosClient()
+    session = FakeSyncSession(*outcomes)
+    client.get_session = lambda url: session
+    return client, session
+
+
+@override_settings(PANOS_API_VIEW_RETRIES=2, PANOS_API_RETRY_BACKOFF=0)
+@pytest.mark.parametrize('idempotent, expected', [(True, 2), (False, 1)])
+def test_sync_timeouts_retried_if_idempotent(idempotent, expected):
+    client, session = sync_client(requests.ReadTimeout(), (200, b'<response/>'))
+    try:
+        client.request('10.0.0.1', {'type': 'op'}, idempotent=idempotent)
+    except PanosError:
+        pass
+    assert len(session.calls) == expected
+
+
+@override_settings(PANOS_API_VIEW_RETRIES=2, PANOS_API_RETRY_BACKOFF=0)
+def test_sync_connect_errors_are_retried():
+    client, session = sync_client(requests.ConnectTimeout(), (200, b'<response/>'))
+    assert client.request('10.0.0.1', {'type': 'op'}, idempotent=False).status_code == 200
+
+
+def test_sessions_kept_per_host():
+    client = PanosClient()
+    with override_settings(PANOS_API_MAX_SESSIONS=2):
+        first = client.get_session('https://10.0.0.1/api/')
+        first.close = mock.Mock()
+        assert client.get_session('https://10.0.0.1/api/') is first
+        client.get_session('https://10.0.0.2/api/')
+        client.get_session('https://10.0.0.3/api/')
+    assert list(client.sessions) == ['10.0.0.2', '10.0.0.3']
+    # another thread may still be using it
+    first.close.assert_not_called()
+
+
+def test_api_key_cached_encrypted():
+    client, session = sync_client((200, b'<response status="success"><result><key>secret-key</key></result></response>'))
+    assert client.get_api_key('10.0.0.1', 'admin', 'password') == 'secret-key'
+    # the second call does not reach the firewall
+    assert client.get_api_key('10.0.0.1', 'admin', 'password') == 'secret-key'
+    assert len(session.calls) == 1
+    assert 'secret-key' not in cache.get(client.get_api_key_cache_key('10.0.0.1', 'admin', 'password'))
+
+
+def test_api_key_not_shared_with_other_credentials():
+    client, session = sync_client(
+        (200, b'<response status="success"><result><key>secret-key</key></result></response>'),
+        (403, b'<response status="error"><result><msg>Invalid Credential</msg></result></response>'),
+    )
+    client.get_api_key('10.0.0.1', 'admin', 'password')
+    with pytest.raises(PanosAuthError):
+        client.get_api_key('10.0.0.1', 'admin', 'wrong')
+
+
+def key(value):
+    return (200, f'<response status="success"><result><key>{value}</key></result></response>'.encode())
+
+
+def test_stale_api_key_generated_again():
+    client, session = sync_client(key('old-key'), (403, b'<response status="error"/>'), key('new-key'), (200, b'<response/>'))
+    cache.delete(client.get_api_key_cache_key('10.0.0.4', 'admin', 'password'))
+    assert client.op_as('10.0.0.4', 'admin', 'password', '<show/>').status_code == 200
+    assert [c.get('key') for c in session.calls] == [None, 'old-key', None, 'new-key']
+    assert client.get_api_key('10.0.0.4', 'admin', 'password') == 'new-key'
+
+
+def test_api_key_generated_again_once():
+    client, session = sync_client(key('key'), (403, b'<response status="error"/>'), key('key'), (403, b'<response status="error"/>'))
+    cache.delete(client.get_api_key_cache_key('10.0.0.4', 'admin', 'password'))
+    with pytest.raises(PanosAuthError):
+        client.op_as('10.0.0.4', 'admin', 'password', '<show/>')
+    assert len(session.calls) == 4
+
+
+@override_settings(PANOS_API_VIEW_RETRIES=0)
+def test_keygen_server_error_is_not_an_auth_error():
+    client, session = sync_client((500, b'Internal Server Error'))
+    cache.delete(client.get_api_key_cache_key('10.0.0.4', 'admin', 'password'))
+    with pytest.raises(PanosError) as e:
+        client.get_api_key('10.0.0.4', 'admin', 'password')
+    assert not isinstance(e.value, PanosAuthError)
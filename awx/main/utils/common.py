@@ -27,7 +27,7 @@ from django.db import connection, transaction, ProgrammingError, IntegrityError
 from django.db.models.fields.related import ForeignObjectRel, ManyToManyField
 from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor, ManyToManyDescriptor
 from django.db.models.query import QuerySet
-from django.db.models import Q
+from django.db.models import Q, Max, Min
 from django.db import connection as django_connection
 from django.core.cache import cache as django_cache
 
@@ -83,9 +83,13 @@ __all__ = [
     'ScheduleTaskManager',
     'ScheduleDependencyManager',
     'ScheduleWorkflowManager',
+    'TaskManagerJournal',
+    'get_task_manager_journal',
+    'record_task_manager_changes',
     'classproperty',
     'create_temporary_fifo',
     'truncate_stdout',
+    'split_stdout_lines',
     'deepmerge',
     'get_event_partition_epoch',
     'cleanup_new_process',
@@ -937,6 +941,96 @@ class ScheduleWorkflowManager(ScheduleManager):
         super().__init__(workflow_manager, _workflow_manager)
 
 
+class TaskManagerJournal:
+    """
+    A table (TaskManagerChange) of the ids of unified jobs whose state changed
+    in a way that matters to the task manager (their status, or their
+    dependencies having been processed).  The task manager reads it to update
+    its in-memory state incrementally, see TaskManagerState.
+
+    Changes are recorded in the transaction that makes them, so they are seen
+    by the task manager of every node as soon as they are committed.  A
+    position in the journal is the id of the last entry read plus the lower
+    ids that were not committed yet when it was read: entry ids come from a
+    sequence, and a transaction can commit after one that recorded a change
+    later.  These gaps are read again until they show up, or until they are
+    older than the TASK_MANAGER_JOURNAL_LENGTH entries the journal keeps
+    (rolled back transactions leave gaps that never do).
+    """
+
+    def __init__(self):
+        from django.conf import settings
+
+        self.max_length = settings.TASK_MANAGER_JOURNAL_LENGTH
+
+    @property
+    def model(self):
+        from awx.main.models import TaskManagerChange  # circular import
+
+        return TaskManagerChange
+
+    def record(self, task_ids):
+        self.model.objects.bulk_create([self.model(unified_job_id=pk) for pk in task_ids])
+
+    def trim(self):
+        """Remove all but the newest TASK_MANAGER_JOURNAL_LENGTH entries"""
+        last_id = self.model.objects.aggregate(last_id=Max('id'))['last_id']
+        if last_id is not None:
+            self.model.objects.filter(id__lte=last_id - self.max_length).delete()
+
+    def _gaps(self, first_id, last_id, entry_ids):
+        return frozenset(pk for pk in range(max(first_id, last_id - self.max_length + 1), last_id + 1) if pk not in entry_ids)
+
+    def position(self):
+        """Return the position of the newest entry of the journal"""
+        entry_ids = set(self.model.objects.order_by('-id').values_list('id', flat=True)[: self.max_length])
+        if not entry_ids:
+            return 0, frozenset()
+        last_id = max(entry_ids)
+        return last_id, self._gaps(min(entry_ids), last_id, entry_ids)
+
+    def read(self, position):
+        """
+        Return the set of unified job ids recorded after `position`, and the
+        new position; or None if some of those entries were already trimmed.
+        """
+        last_id, gaps = position
+        first_id = self.model.objects.aggregate(first_id=Min('id'))['first_id']
+        if first_id is not None and first_id > last_id + 1:
+            return None
+        entries = self.model.objects.filter(Q(id__gt=last_id) | Q(id__in=gaps)).values_list('id', 'unified_job_id')
+        task_ids = set()
+        entry_ids = set()
+        for entry_id, task_id in entries:
+            entry_ids.add(entry_id)
+            task_ids.add(task_id)
+        new_last_id = max(entry_ids | {last_id})
+        gaps = (gaps - entry_ids) | self._gaps(last_id + 1, new_last_id, entry_ids)
+        return task_ids, (new_last_id, frozenset(pk for pk in gaps if pk > new_last_id - self.max_length))
+
+
+_task_manager_journal = None
+
+
+def get_task_manager_journal():
+    """Return the TaskManagerJournal, or None when running tests"""
+    global _task_manager_journal
+    if is_testing():
+        return None
+    if _task_manager_journal is None:
+        _task_manager_journal = TaskManagerJournal()
+    return _task_manager_journal
+
+
+def record_task_manager_changes(task_ids):
+    """Add the given unified job ids to the TaskManagerJournal, as part of the current transaction"""
+    journal = get_task_manager_journal()
+    task_ids = [pk for pk in task_ids if pk]
+    if journal is None or not task_ids:
+        return
+    journal.record(task_ids)
+
+
 @contextlib.contextmanager
 def ignore_inventory_computed_fields():
     """
@@ -1131,6 +1225,22 @@ def truncate_stdout(stdout, size):
     return stdout + u'\u001b[0m' * (set_count - reset_count)
 
 
+def split_stdout_lines(stdout):
+    """
+    Split stdout into lines that keep their trailing newline.  Unlike
+    str.splitlines(), only \\n ends a line, which is how the start_line and
+    end_line of job events are counted.
+
+    >>> split_stdout_lines('a\\r\\nb\\rc\\n\\nd')
+    ['a\\r\\n', 'b\\rc\\n', '\\n', 'd']
+    """
+    lines = [line + '\n' for line in stdout.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
 def deepmerge(a, b):
     """
     Merge dict structures and return the result.
@@ -1,10 +1,12 @@
 # Copyright (c) 2017 Ansible by Red Hat
 # All Rights Reserved.
 
+import json
 from itertools import chain
 
 from awx.settings.application_name import set_application_name
 from django.conf import settings
+from django.db import connections
 
 
 def get_all_field_names(model):
@@ -25,3 +27,21 @@ def get_all_field_names(model):
 
 def set_connection_name(function):
     set_application_name(settings.DATABASES, settings.CLUSTER_HOST_ID, function=function)
+
+
+def estimate_count(queryset):
+    """
+    Return the postgres query planner's estimate of the number of rows of a
+    queryset (which is based on the table statistics in pg_class and
+    pg_statistic), or None on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
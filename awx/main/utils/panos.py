@@ -0,0 +1,266 @@
+"""
+Clients for the API of PAN-OS firewalls and Panorama: AsyncPanosClient to
+upgrade firewalls from awx.main.tasks.firewall, and PanosClient for the
+firewall views of the API.
+
+Every call of the XML API is an HTTP GET of https://<ip>/api/ with the request
+in the query string, e.g. type=op&cmd=<show><system><info/></system></show>.
+"""
+
+import asyncio
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import weakref
+import xml.etree.ElementTree as ET
+
+import aiohttp
+import requests
+import urllib3
+import xmltodict
+from django.conf import settings
+from django.core.cache import cache
+
+from awx.main.utils.encryption import decrypt_value, encrypt_value, get_encryption_key
+
+logger = logging.getLogger('awx.main.utils.panos')
+
+
+class PanosError(Exception):
+    """The firewall could not be reached, did not answer in time, or not with XML"""
+
+
+class PanosAuthError(PanosError):
+    """The firewall refused the credentials"""
+
+
+class PanosResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def xml(self):
+        try:
+            return ET.fromstring(self.content)
+        except ET.ParseError as e:
+            raise PanosError(f'invalid XML answer: {e}')
+
+    def to_dict(self):
+        try:
+            return xmltodict.parse(self.content)
+        except Exception as e:
+            raise PanosError(f'invalid XML answer: {e}')
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except ValueError as e:
+            raise PanosError(f'invalid JSON answer: {e}')
+
+
+def get_url(host, path='/api/'):
+    """The URL of `path` on the host, which can be given with its scheme, e.g. for Panorama"""
+    if '://' not in host:
+        host = f'https://{host}'
+    return host.rstrip('/') + path
+
+
+def get_retry_delay(attempt):
+    return settings.PANOS_API_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+class AsyncPanosClient:
+    """
+    Calls the API of many firewalls concurrently without blocking the event
+    loop.  Connections are pooled, at most PANOS_API_CONNECTIONS_PER_HOST to
+    each firewall.  Requests that could not connect are retried up to
+    PANOS_API_RETRIES times, as are timeouts and server errors of idempotent
+    requests; requests that change the firewall (install, reboot...) pass
+    idempotent=False so they are never sent twice.
+    """
+
+    def __init__(self):
+        self.session = None
+
+    @property
+    def closed(self):
+        return self.session is not None and self.session.closed
+
+    def get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=0, limit_per_host=settings.PANOS_API_CONNECTIONS_PER_HOST, ssl=None if settings.PANOS_API_VERIFY_CERT else False
+            )
+            timeout = aiohttp.ClientTimeout(total=None, connect=settings.PANOS_API_CONNECT_TIMEOUT, sock_read=settings.PANOS_API_READ_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def request(self, ip, params, idempotent=True):
+        url = get_url(ip)
+        for attempt in range(settings.PANOS_API_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(get_retry_delay(attempt))
+            try:
+                async with self.get_session().get(url, params=params) as response:
+                    content = await response.read()
+            except aiohttp.ClientConnectorError as e:
+                # the request was not sent, so it is safe to send it again
+                error = e
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                if idempotent:
+                    continue
+                break
+            if response.status >= 500 and idempotent and attempt < settings.PANOS_API_RETRIES:
+                logger.debug(f'{ip} answered {response.status}, retrying')
+                continue
+            return PanosResponse(response.status, content)
+        raise PanosError(f'{ip}: {error.__class__.__name__} {error}')
+
+    async def op(self, ip, api_key, cmd, idempotent=True):
+        return await self.request(ip, {'type': 'op', 'cmd': cmd, 'key': api_key}, idempotent=idempotent)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# one client per event loop, as aiohttp sessions can not be shared between loops
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.closed:
+        client = _async_clients[loop] = AsyncPanosClient()
+    return client
+
+
+class PanosClient:
+    """
+    Calls the API of firewalls from the views of the API.  Each host gets a
+    requests.Session, whose connections are kept alive so that the pages
+    calling the same firewall again and again do not go through a TLS
+    handshake each time; the sessions of the last PANOS_API_MAX_SESSIONS
+    hosts are kept.  Requests are retried as by AsyncPanosClient, but answers
+    are only waited for PANOS_API_VIEW_READ_TIMEOUT seconds and
+    PANOS_API_VIEW_RETRIES times, as a user is waiting for them.
+    """
+
+    def __init__(self):
+        self.sessions = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_session(self, url):
+        host = url.split('/')[2]
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = requests.Session()
+                session.verify = settings.PANOS_API_VERIFY_CERT
+                if not session.verify:
+                    # firewalls usually have self-signed certificates
+                    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings.PANOS_API_CONNECTIONS_PER_HOST))
+                while len(self.sessions) > settings.PANOS_API_MAX_SESSIONS:
+                    # not closed, as another thread may still be using it; its connections go with it
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(host)
+        return session
+
+    def request(self, host, params=None, idempotent=True, path='/api/', headers=None):
+        url = get_url(host, path)
+        for attempt in range(settings.PANOS_API_VIEW_RETRIES + 1):
+            if attempt:
+                time.sleep(get_retry_delay(attempt))
+            try:
+                response = self.get_session(url).get(
+                    url, params=params, headers=headers, timeout=(settings.PANOS_API_CONNECT_TIMEOUT, settings.PANOS_API_VIEW_READ_TIMEOUT)
+                )
+            except requests.RequestException as e:
+                error = e
+                # the request was not sent if it could not connect, so it is safe to send it again
+                not_sent = isinstance(e, requests.ConnectTimeout) or isinstance(
+                    getattr(e.args[0] if e.args else None, 'reason', None), urllib3.exceptions.NewConnectionError
+                )
+                if not_sent or (idempotent and isinstance(e, (requests.ConnectionError, requests.Timeout))):
+                    continue
+                break
+            if response.status_code >= 500 and idempotent and attempt < settings.PANOS_API_VIEW_RETRIES:
+                logger.debug(f'{host} answered {response.status_code}, retrying')
+                continue
+            return PanosResponse(response.status_code, response.content)
+        raise PanosError(f'{host}: {error.__class__.__name__} {error}')
+
+    def op(self, host, api_key, cmd, idempotent=True):
+        return self.request(host, {'type': 'op', 'cmd': cmd, 'key': api_key}, idempotent=idempotent)
+
+    def op_as(self, host, username, password, cmd, idempotent=True):
+        """
+        Run `cmd` with the API key of the user.  When the firewall no longer
+        accepts the cached key, e.g. because the password changed, the key is
+        generated again, once.
+        """
+        response = self.op(host, self.get_api_key(host, username, password), cmd, idempotent=idempotent)
+        if response.status_code == 403:
+            self.forget_api_key(host, username, password)
+            response = self.op(host, self.get_api_key(host, username, password), cmd, idempotent=idempotent)
+            if response.status_code == 403:
+                raise PanosAuthError('Invalid credentials')
+        return response
+
+    @staticmethod
+    def get_api_key_cache_key(host, username, password):
+        digest = hmac.new(settings.SECRET_KEY.encode(), f'{host}\0{username}\0{password}'.encode(), hashlib.sha256).hexdigest()
+        return f'panos_api_key_{digest}'
+
+    def forget_api_key(self, host, username, password):
+        """Forget the cached API key, e.g. when the firewall no longer accepts it"""
+        cache.delete(self.get_api_key_cache_key(host, username, password))
+
+    def get_api_key(self, host, username, password):
+        """
+        The API key of the user, generated by the firewall the first time and
+        then kept encrypted in the cache for PANOS_API_KEY_CACHE_TTL seconds,
+        under a digest of the credentials so that only they can get it.
+        """
+        cache_key = self.get_api_key_cache_key(host, username, password)
+        encrypted = cache.get(cache_key)
+        if encrypted:
+            try:
+                return decrypt_value(get_encryption_key('value', pk=None), encrypted)
+            except Exception:
+                # encrypted with a previous SECRET_KEY
+                logger.debug(f'Could not decrypt the cached API key of {username} on {host}')
+        response = self.request(host, {'type': 'keygen', 'user': username, 'password': password})
+        if response.status_code == 403:
+            raise PanosAuthError('Invalid credentials')
+        if response.status_code != 200:
+            raise PanosError(f'{host}: keygen answered {response.status_code}')
+        root = response.xml()
+        api_key = root.findtext('./result/key')
+        if not api_key:
+            raise PanosAuthError(root.findtext('.//msg') or root.findtext('.//line') or 'Invalid credentials')
+        cache.set(cache_key, encrypt_value(api_key), settings.PANOS_API_KEY_CACHE_TTL)
+        return api_key
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = PanosClient()
+    return _client
@@ -184,6 +184,16 @@ CONTROL_PLANE_EXECUTION_ENVIRONMENT = 'quay.io/ansible/awx-ee:latest'
 # Note: This setting may be overridden by database settings.
 STDOUT_MAX_BYTES_DISPLAY = 1048576
 
+# The number of job events read per query when stdout is streamed for download
+STDOUT_STREAM_CHUNK_EVENTS = 1000
+
+# The gzip compression level (1-9) of the archives that the compact_job_events
+# management command moves the events of old jobs into, and the number of events per
+# separately compressed chunk of an archive (pages of archived events only
+# decompress the chunks that hold them)
+JOB_EVENT_ARCHIVE_COMPRESSLEVEL = 6
+JOB_EVENT_ARCHIVE_CHUNK_SIZE = 1000
+
 # Returned in the header on event api lists as a recommendation to the UI
 # on how many events to display before truncating/hiding
 MAX_UI_JOB_EVENTS = 4000
@@ -200,6 +210,19 @@ MAX_EVENT_RES_DATA = 700000
 EVENT_STDOUT_MAX_BYTES_DISPLAY = 1024
 MAX_WEBSOCKET_EVENT_RATE = 30
 
+# How websocket messages of events over MAX_WEBSOCKET_EVENT_RATE are handled,
+# per job type: 'skip' drops them, 'batch' replaces them with an event_batch
+# message sent WEBSOCKET_EVENT_BATCH_INTERVAL seconds after the first skipped
+# event (or when the job finishes), which carries the
+# counter ranges of the skipped events and the last
+# WEBSOCKET_EVENT_BATCH_STDOUT_LINES lines of their stdout.  Job types that
+# are not listed use 'skip'.  Only enable 'batch' for clients of the job_events
+# websocket that render event_batch messages, e.g.
+# {'job': 'batch', 'ad_hoc_command': 'batch'}
+WEBSOCKET_EVENT_COALESCING = {}
+WEBSOCKET_EVENT_BATCH_INTERVAL = 1
+WEBSOCKET_EVENT_BATCH_STDOUT_LINES = 50
+
 # The amount of time before a stdout file is expired and removed locally
 # Note that this can be recreated if the stdout is downloaded
 LOCAL_STDOUT_EXPIRE_TIME = 2592000
@@ -212,6 +235,36 @@ JOB_EVENT_WORKERS = 4
 # writes in memory before flushing via JobEvent.objects.bulk_create()
 JOB_EVENT_BUFFER_SECONDS = 1
 
+# Bounds for the number of events of one type the callback receiver buffers
+# before flushing. Within these bounds the batch size grows with the redis
+# queue backlog, capped at the number of events that can be inserted in
+# JOB_EVENT_BUFFER_TARGET_SECONDS; buffered events are flushed as soon as the
+# queue is drained (checked every JOB_EVENT_QUEUE_DEPTH_INTERVAL seconds)
+JOB_EVENT_BUFFER_MIN_BATCH = 100
+JOB_EVENT_BUFFER_MAX_BATCH = 5000
+JOB_EVENT_BUFFER_TARGET_SECONDS = 0.5
+JOB_EVENT_QUEUE_DEPTH_INTERVAL = 0.1
+
+# Flush the callback receiver buffer once the stdout of buffered events
+# reaches this many bytes, regardless of the batch size
+JOB_EVENT_BUFFER_MAX_BYTES = 33554432
+
+# How the callback receiver writes buffered events to the database, either
+# 'copy' (COPY ... FROM STDIN, postgres only) or 'bulk_create'; batches that
+# fail are always bisected and retried with bulk_create
+JOB_EVENT_WRITER = 'copy'
+
+# The number of saved events whose websocket messages (and stats wrapups) each
+# callback receiver worker queues for its broadcast thread; when the queue is
+# full, messages for events outside of MINIMAL_EVENTS are dropped first.
+# 0 sends them inline, before the next batch is written
+JOB_EVENT_BROADCAST_QUEUE_SIZE = 10000
+
+# Whether the websocket messages for a group sent together are coalesced into a
+# single internal.messages channel layer message.  Only consumers and relays of
+# this version understand it, so enable it once every node has been upgraded
+BROADCAST_WEBSOCKET_COALESCE_MESSAGES = False
+
 # The interval at which callback receiver statistics should be
 # recorded
 JOB_EVENT_STATISTICS_INTERVAL = 5
@@ -246,6 +299,40 @@ START_TASK_LIMIT = 100
 TASK_MANAGER_TIMEOUT = 300
 TASK_MANAGER_TIMEOUT_GRACE_PERIOD = 60
 
+# The task manager keeps the tasks it schedules in memory between runs, and
+# only reloads those recorded in a table (of the last
+# TASK_MANAGER_JOURNAL_LENGTH entries) as having changed.  Every
+# TASK_MANAGER_RECONCILE_INTERVAL seconds it reloads all of them anyway.
+TASK_MANAGER_JOURNAL_LENGTH = 10000
+TASK_MANAGER_RECONCILE_INTERVAL = 60
+
+# How the task manager picks the instance of an instance group to run a task on:
+#   worst_fit: the instance with the most capacity left, spreading tasks out
+#   best_fit: the instance with the least capacity left that fits the task,
+#             keeping other instances free for tasks with a large impact
+#   worst_fit_heap: same as worst_fit, using a heap for large instance groups
+# TASK_MANAGER_PLACEMENT_STRATEGIES overrides it per instance group name, e.g.
+# {'default': 'best_fit'}
+TASK_MANAGER_PLACEMENT_STRATEGY = 'worst_fit'
+TASK_MANAGER_PLACEMENT_STRATEGIES = {}
+
+# How the task manager orders pending tasks:
+#   fifo: oldest first
+#   fair_share: in a queue per organization (or per template, when
+#               TASK_MANAGER_FAIR_SHARE_KEY is 'template'), taken in turns by
+#               deficit round robin.  Each turn a queue can start tasks with a
+#               total impact of TASK_MANAGER_FAIR_SHARE_QUANTUM times its weight
+#               in TASK_MANAGER_FAIR_SHARE_WEIGHTS (1 by default), e.g.
+#               {'organization-1': 2}
+# Either way, tasks of templates with a higher priority come first in their queue.
+TASK_MANAGER_SCHEDULING = 'fifo'
+TASK_MANAGER_FAIR_SHARE_KEY = 'organization'
+TASK_MANAGER_FAIR_SHARE_QUANTUM = 100
+TASK_MANAGER_FAIR_SHARE_WEIGHTS = {}
+# The per-queue task manager metrics name at most this many queues (those with
+# the most pending and started tasks), and add up the others as 'other'
+TASK_MANAGER_QUEUE_METRICS_LIMIT = 20
+
 # Number of seconds _in addition to_ the task manager timeout a job can stay
 # in waiting without being reaped
 JOB_WAITING_GRACE_PERIOD = 60
@@ -341,6 +428,10 @@ INSTALLED_APPS = [
 INTERNAL_IPS = ('127.0.0.1',)
 
 MAX_PAGE_SIZE = 200
+
+# With ?count_estimate, the counts of lists of more than this many rows are
+# taken from the query planner's estimate rather than from COUNT(*)
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = 10000
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'awx.api.pagination.Pagination',
     'PAGE_SIZE': 25,
@@ -455,6 +546,34 @@ EXECUTION_NODE_REMEDIATION_CHECKS = 60 * 30  # once every 30 minutes check if an
 # Amount of time dispatcher will try to reconnect to database for jobs and consuming new work
 DISPATCHER_DB_DOWNTIME_TOLERANCE = 40
 
+# Task bodies larger than this many bytes are not sent in the pg_notify payload,
+# which postgres limits to 8000 bytes, but stored in an unlogged table that the
+# dispatcher of every node can read, the payload only referring to them.  Those
+# left unredeemed (and those of broadcast tasks) are removed after
+# DISPATCHER_CLAIM_CHECK_TTL seconds.  0 sends every body in the payload.
+DISPATCHER_CLAIM_CHECK_THRESHOLD = 4096
+DISPATCHER_CLAIM_CHECK_TTL = 3600
+
+# The dispatcher runs each class of task in its own pool of workers, so that
+# long running jobs can not take every worker and hold up short system tasks or
+# the heartbeat.  A task goes to the first class with a pattern (fnmatch)
+# matching its name, or to the last class.  The classes share the worker
+# budget derived from the memory of the node: the max_workers of each class
+# counts against it, and the classes with a max_workers of None split the rest
+# evenly.  Keep jobs the only class without a max_workers: the task manager
+# sends a node as many jobs as its capacity allows, so they need the whole
+# budget left.  The pool keeps spare_workers idle workers
+# started and connected, so a burst of tasks does not wait for new workers to
+# start up.  When empty, all tasks share a single pool.
+DISPATCHER_TASK_CLASSES = {
+    'heartbeat': {'tasks': ['awx.main.tasks.system.cluster_node_heartbeat'], 'min_workers': 1, 'max_workers': 2},
+    'jobs': {'tasks': ['awx.main.tasks.jobs.Run*'], 'min_workers': 1, 'max_workers': None, 'spare_workers': 2},
+    # firewall upgrades wait on the firewalls for up to hours; one task upgrades
+    # all the firewalls of a job, so this is how many jobs upgrade at a time
+    'firewalls': {'tasks': ['awx.main.tasks.firewall.upgrade_firewalls'], 'min_workers': 1, 'max_workers': 4},
+    'system': {'tasks': ['*'], 'min_workers': 4, 'max_workers': 16},
+}
+
 BROKER_URL = 'unix:///var/run/redis/redis.sock'
 CELERYBEAT_SCHEDULE = {
     'tower_scheduler': {'task': 'awx.main.tasks.system.awx_periodic_scheduler', 'schedule': timedelta(seconds=30), 'options': {'expires': 20}},
@@ -472,6 +591,7 @@ CELERYBEAT_SCHEDULE = {
     'cleanup_images': {'task': 'awx.main.tasks.system.cleanup_images_and_files', 'schedule': timedelta(hours=3)},
     'cleanup_host_metrics': {'task': 'awx.main.tasks.host_metrics.cleanup_host_metrics', 'schedule': timedelta(hours=3, minutes=30)},
     'host_metric_summary_monthly': {'task': 'awx.main.tasks.host_metrics.host_metric_summary_monthly', 'schedule': timedelta(hours=4)},
+    'resume_firewall_upgrades': {'task': 'awx.main.tasks.firewall.resume_firewall_upgrades', 'schedule': timedelta(seconds=60), 'options': {'expires': 50}},
 }
 
 # Django Caching Configuration
@@ -777,6 +897,26 @@ ACTIVITY_STREAM_ENABLED_FOR_INVENTORY_SYNC = False
 
 CALLBACK_QUEUE = "callback_tasks"
 
+# The number of redis lists that job events are spread across. Every event of
+# a given job goes to the same list, and each callback receiver worker reads
+# from its own subset of the lists, so per-job ordering is preserved while
+# ingestion scales with JOB_EVENT_WORKERS. Must be at least JOB_EVENT_WORKERS, ideally a
+# multiple of it; 1 disables sharding and uses the single CALLBACK_QUEUE list.
+CALLBACK_QUEUE_SHARDS = 1
+
+# Buffer job events in the task that runs the job and publish them to redis
+# with one pipelined RPUSH once this many events (or CALLBACK_QUEUE_BUFFER_BYTES
+# of serialized events) are buffered, or CALLBACK_QUEUE_BUFFER_SECONDS after
+# the first buffered event. A value of 0 or 1 publishes every event on its own.
+CALLBACK_QUEUE_BUFFER_EVENTS = 0
+CALLBACK_QUEUE_BUFFER_BYTES = 1048576
+CALLBACK_QUEUE_BUFFER_SECONDS = 0.25
+
+# Wire format of job events published to the callback queue, 'json' or
+# 'msgpack'. Callback receivers decode both, so only switch to 'msgpack' once
+# every control node in the cluster runs a version that understands it.
+CALLBACK_QUEUE_SERIALIZER = 'json'
+
 # Note: This setting may be overridden by database settings.
 ORG_ADMINS_CAN_SEE_ALL_USERS = True
 MANAGE_ORGANIZATION_AUTH = True
@@ -1017,6 +1157,43 @@ BROADCAST_WEBSOCKET_BEACON_FROM_WEB_RATE_SECONDS = 15
 
 DJANGO_GUID = {'GUID_HEADER_NAME': 'X-API-Request-Id'}
 
+# Calls of the PAN-OS XML API when upgrading firewalls, see awx.main.utils.panos
+# Whether to check the certificates of the firewalls, which are usually self-signed
+PANOS_API_VERIFY_CERT = False
+# Maximum number of concurrent connections to each firewall
+PANOS_API_CONNECTIONS_PER_HOST = 4
+# Seconds to wait for a firewall to accept a connection, and then for each read of its answer
+PANOS_API_CONNECT_TIMEOUT = 10
+PANOS_API_READ_TIMEOUT = 120
+# Retries of requests that failed to connect (or timed out, for requests that do not change the firewall),
+# waiting PANOS_API_RETRY_BACKOFF seconds before the first one and twice as long before each next one
+PANOS_API_RETRIES = 3
+PANOS_API_RETRY_BACKOFF = 2
+# The views calling the API wait less, and retry less, as a user is waiting for them
+PANOS_API_VIEW_READ_TIMEOUT = 10
+PANOS_API_VIEW_RETRIES = 1
+# The views keep alive the connections to the last PANOS_API_MAX_SESSIONS firewalls they called
+PANOS_API_MAX_SESSIONS = 100
+# Seconds API keys generated from a username and password are cached, encrypted
+PANOS_API_KEY_CACHE_TTL = 3600
+
+# Rollout of firewall upgrades, see awx.main.tasks.firewall
+# Maximum number of firewalls of a group upgraded at the same time (jobs without sequence upgrade one at a time)
+FIREWALL_UPGRADE_MAX_CONCURRENT_PER_GROUP = 10
+# The firewalls of a job are upgraded in waves, each one reaching this percentage of them,
+# and a wave only starts once the previous one finished
+FIREWALL_UPGRADE_WAVES = [1, 10, 50, 100]
+# The rollout halts, stopping the firewalls it did not start, when more than this fraction
+# of the finished upgrades failed
+FIREWALL_UPGRADE_MAX_FAILURE_RATE = 0.2
+# The task upgrading the firewalls of a job is not dispatched again for this many seconds after it was
+# dispatched, unless it started, so that resume_firewall_upgrades does not pile up tasks waiting for a worker
+FIREWALL_UPGRADE_DISPATCH_TIMEOUT = 600
+# The logs of an upgrade are written to the database by batches of up to FIREWALL_LOG_BATCH_SIZE lines,
+# at most FIREWALL_LOG_FLUSH_INTERVAL seconds after they were logged
+FIREWALL_LOG_BATCH_SIZE = 100
+FIREWALL_LOG_FLUSH_INTERVAL = 2
+
 # Name of the default task queue
 DEFAULT_EXECUTION_QUEUE_NAME = 'default'
 # pod spec used when the default execution queue is a container group, e.g. when deploying on k8s/ocp with the operator
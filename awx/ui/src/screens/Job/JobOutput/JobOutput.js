@@ -268,10 +268,29 @@ function JobOutput({ job, eventRelatedSearchableKeys, eventSearchableKeys }) {
       batchedEvents = [];
     };
 
+    // rate limited events have no message of their own: the event_batch
+    // message announcing them is shown as a single row with the tail of
+    // their stdout, at the position of the last of them
+    const getEventBatchRow = (data) => {
+      const firstCounter = data.counters[0][0];
+      const lastCounter = Math.max(...data.counters.map(([, end]) => end));
+      return {
+        id: `event_batch-${firstCounter}-${lastCounter}`,
+        uuid: `event_batch-${firstCounter}-${lastCounter}`,
+        event: 'event_batch',
+        counter: lastCounter,
+        stdout: data.stdout_lines.join('\r\n'),
+        start_line: data.end_line - data.stdout_lines.length,
+        end_line: data.end_line,
+      };
+    };
+
     connectJobSocket(job, (data) => {
       console.log("🚀 ~ file: JobOutput.js:272 ~ connectJobSocket ~ data:", data)
       if (data.group_name === `${job.type}_events`) {
-        batchedEvents.push(data);
+        batchedEvents.push(
+          data.event === 'event_batch' ? getEventBatchRow(data) : data
+        );
         clearTimeout(batchTimeout);
         if (batchedEvents.length >= 10) {
           addBatchedEvents();
@@ -0,0 +1,103 @@
+#! /usr/bin/env awx-python
+
+#
+# Micro-benchmark for the wire formats supported by the callback queue
+# (see CALLBACK_QUEUE_SERIALIZER).  It encodes and decodes a set of
+# representative job events with each serializer, and reports the average
+# cost per event and the average message size, e.g.
+#
+#   $ awx-python tools/scripts/callback_serialization_benchmark.py --events 5000
+#   serializer     encode us/event   decode us/event    bytes/event
+#   json                     17.31             15.45           1403
+#   msgpack                   6.94             10.25           1150
+#
+
+import argparse
+import datetime
+import time
+from uuid import uuid4
+
+from awx.main.queue import CALLBACK_QUEUE_SERIALIZERS, encode_event, decode_event
+
+
+def sample_events(count, forks=50):
+    job_created = str(datetime.datetime.now(datetime.timezone.utc))
+    for counter in range(1, count + 1):
+        host = f'host-{counter % forks}.example.org'
+        stdout = f'\x1b[0;32mok: [{host}] => (item=package-{counter})\x1b[0m'
+        yield {
+            'uuid': str(uuid4()),
+            'counter': counter,
+            'stdout': stdout,
+            'start_line': counter,
+            'end_line': counter + 1,
+            'runner_ident': str(uuid4()),
+            'event': 'runner_item_on_ok',
+            'job_id': 1234,
+            'job_created': job_created,
+            'created': datetime.datetime.utcnow().isoformat(),
+            'parent_uuid': str(uuid4()),
+            'host_name': host,
+            'event_data': {
+                'playbook': 'site.yml',
+                'playbook_uuid': str(uuid4()),
+                'play': 'configure web servers',
+                'play_uuid': str(uuid4()),
+                'play_pattern': 'webservers',
+                'task': 'install packages',
+                'task_uuid': str(uuid4()),
+                'task_action': 'ansible.builtin.package',
+                'task_args': '',
+                'task_path': '/runner/project/roles/web/tasks/main.yml:3',
+                'host': host,
+                'remote_addr': host,
+                'res': {
+                    'changed': False,
+                    'msg': 'Nothing to do',
+                    'rc': 0,
+                    'results': [],
+                    'invocation': {'module_args': {'name': [f'package-{counter}'], 'state': 'present', 'use': 'auto'}},
+                    'ansible_loop_var': 'item',
+                    'item': f'package-{counter}',
+                    '_ansible_no_log': False,
+                },
+                'start': datetime.datetime.utcnow().isoformat(),
+                'end': datetime.datetime.utcnow().isoformat(),
+                'duration': 0.52,
+                'event_loop': None,
+                'uuid': str(uuid4()),
+                'guid': uuid4().hex,
+            },
+        }
+
+
+def benchmark(events, serializer):
+    start = time.perf_counter()
+    messages = [encode_event(event, serializer) for event in events]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for message in messages:
+        decode_event(message)
+    decode_seconds = time.perf_counter() - start
+
+    size = sum(len(message) for message in messages)
+    return encode_seconds, decode_seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure callback queue event serialization cost')
+    parser.add_argument('--events', type=int, default=10000, help='number of events to encode and decode per serializer')
+    parser.add_argument('--rounds', type=int, default=3, help='number of rounds, the fastest one is reported')
+    args = parser.parse_args()
+
+    events = list(sample_events(args.events))
+    print(f'{"serializer":<12}{"encode us/event":>18}{"decode us/event":>18}{"bytes/event":>15}')
+    for serializer in CALLBACK_QUEUE_SERIALIZERS:
+        encode_seconds, decode_seconds, size = min(benchmark(events, serializer) for _ in range(args.rounds))
+        encode_us, decode_us = encode_seconds / len(events) * 1e6, decode_seconds / len(events) * 1e6
+        print(f'{serializer:<12}{encode_us:>18.2f}{decode_us:>18.2f}{size / len(events):>15.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#! /usr/bin/env awx-python
+
+#
+# Simulation of the task placement strategies of the task manager (see
+# TASK_MANAGER_PLACEMENT_STRATEGY).  It replays a sequence of jobs, either
+# recorded (a CSV file of `task_impact,duration` lines, e.g. exported from the
+# task_impact and elapsed fields of finished jobs) or generated, against a
+# synthetic instance group, running a task manager cycle every few simulated
+# seconds.  For each strategy it reports the average capacity utilization
+# and how long jobs waited to start, e.g.
+#
+#   $ awx-python tools/scripts/placement_simulation.py --jobs 1500 --rate 0.4
+#   strategy        utilization  wait avg  wait p95  wait max  large wait avg
+#   worst_fit             75.4%    186.0s   1726.0s   3659.0s         1290.4s
+#   best_fit              78.2%    161.8s   1111.4s   3362.6s         1075.1s
+#   worst_fit_heap        75.4%    186.0s   1726.0s   3659.0s         1290.4s
+#
+
+import argparse
+import csv
+import os
+import random
+from types import SimpleNamespace
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'awx.settings.development')
+django.setup()
+
+from awx.main.scheduler.task_manager_models import PLACEMENT_STRATEGIES, TaskManagerModels  # noqa
+
+
+class FakeInstances:
+    def __init__(self, instances):
+        self.instances = instances
+
+    def all(self):
+        return self.instances
+
+
+def synthetic_cluster(count, capacity):
+    instances = [SimpleNamespace(hostname=f'exec-{i}', node_type='execution', capacity=capacity) for i in range(count)]
+    group = SimpleNamespace(
+        pk=1,
+        id=1,
+        name='default',
+        is_container_group=False,
+        max_concurrent_jobs=0,
+        max_forks=0,
+        instances=FakeInstances(instances),
+    )
+    return instances, group
+
+
+def recorded_jobs(path):
+    with open(path) as f:
+        return [(int(float(impact)), float(duration)) for impact, duration in csv.reader(f)]
+
+
+def synthetic_jobs(count, rng):
+    # mostly jobs with few forks, and some against large inventories
+    jobs = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            jobs.append((rng.randint(80, 150), rng.uniform(300, 900)))
+        else:
+            jobs.append((rng.randint(2, 20), rng.uniform(20, 240)))
+    return jobs
+
+
+def simulate(strategy, jobs, arrivals, instance_count, capacity, cycle):
+    instances, group = synthetic_cluster(instance_count, capacity)
+    total_capacity = instance_count * capacity
+    pending = [SimpleNamespace(task_impact=impact, duration=duration, arrival=arrival) for (impact, duration), arrival in zip(jobs, arrivals)]
+    pending.reverse()
+    queue, running, waits, utilization = [], [], [], []
+    now = 0.0
+    while pending or queue or running:
+        while pending and pending[-1].arrival <= now:
+            queue.append(pending.pop())
+        running = [job for job in running if job.finished > now]
+
+        tm_models = TaskManagerModels(instances=instances, instance_groups=[group], placement_strategy=strategy, control_task_impact=0)
+        for job in running:
+            tm_models.consume_capacity(job)
+        still_queued = []
+        for job in queue:
+            job.capacity_type = 'execution'
+            instance = tm_models.instance_groups.fit_task_to_most_remaining_capacity_instance(job, 'default')
+            if instance is None:
+                instance = tm_models.instance_groups.find_largest_idle_instance('default')
+            if instance is None:
+                still_queued.append(job)
+                continue
+            job.execution_node = instance.hostname
+            job.controller_node = ''
+            job.instance_group_id = None
+            job.finished = now + job.duration
+            tm_models.consume_capacity(job)
+            running.append(job)
+            waits.append((job.task_impact, now - job.arrival))
+        queue = still_queued
+
+        consumed = sum(min(i.consumed_capacity, i.capacity) for i in tm_models.instances.instances_by_hostname.values())
+        utilization.append(consumed / total_capacity)
+        now += cycle
+    return waits, utilization
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare task placement strategies on a synthetic instance group')
+    parser.add_argument('--jobs', type=int, default=2000, help='number of synthetic jobs, when --recorded is not given')
+    parser.add_argument('--recorded', help='CSV file of task_impact,duration lines to replay')
+    parser.add_argument('--instances', type=int, default=10, help='number of execution instances')
+    parser.add_argument('--capacity', type=int, default=200, help='capacity of each instance')
+    parser.add_argument('--rate', type=float, default=1.0, help='average number of jobs launched per second')
+    parser.add_argument('--cycle', type=float, default=10.0, help='seconds between task manager runs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    jobs = recorded_jobs(args.recorded) if args.recorded else synthetic_jobs(args.jobs, rng)
+    arrivals, t = [], 0.0
+    for _ in jobs:
+        t += rng.expovariate(args.rate)
+        arrivals.append(t)
+    large_impact = sorted(impact for impact, _ in jobs)[int(len(jobs) * 0.9)]
+
+    print(f'{"strategy":<16}{"utilization":>11}{"wait avg":>10}{"wait p95":>10}{"wait max":>10}{"large wait avg":>16}')
+    for strategy in PLACEMENT_STRATEGIES:
+        waits, utilization = simulate(strategy, jobs, arrivals, args.instances, args.capacity, args.cycle)
+        times = sorted(wait for _, wait in waits)
+        large = [wait for impact, wait in waits if impact >= large_impact]
+        print(
+            f'{strategy:<16}{sum(utilization) / len(utilization):>11.1%}{sum(times) / len(times):>9.1f}s'
+            f'{times[int(len(times) * 0.95)]:>9.1f}s{times[-1]:>9.1f}s{sum(large) / len(large):>15.1f}s'
+        )
+
+
+if __name__ == '__main__':
+    main()